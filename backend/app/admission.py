@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from time import perf_counter
+from typing import Deque, Iterable, Optional
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from . import metrics
+
+RETRY_AFTER_SECONDS = 1
+# вес нового замера в скользящем среднем времени обработки
+SERVICE_TIME_ALPHA = 0.1
+
+shed_requests = metrics.counter(
+    "http_requests_shed_total",
+    "Requests rejected with 503 by admission control.",
+    ("reason",),
+)
+
+
+def service_unavailable() -> JSONResponse:
+    return JSONResponse(
+        {"detail": "Server is busy, try again later"},
+        status_code=503,
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+    )
+
+
+class AdmissionMiddleware:
+    """
+    Ограничитель конкурентности на воркер. Сверх max_concurrent запросы ждут в очереди,
+    но только если ожидаемое ожидание (очередь × среднее время ответа / лимит) укладывается
+    в target_wait; иначе — сразу 503 с Retry-After, не доводя дело до пула БД.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        max_concurrent: int,
+        target_wait: float,
+        exempt_paths: Iterable[str] = (),
+    ) -> None:
+        self.app = app
+        self.max_concurrent = max(1, max_concurrent)
+        self.target_wait = target_wait
+        self.exempt_paths = frozenset(exempt_paths)
+        self.in_flight = 0
+        self.service_time = 0.0
+        self._waiters: Deque[asyncio.Future] = deque()
+        _active.middleware = self
+
+    def _estimated_wait(self) -> float:
+        return (len(self._waiters) + 1) * self.service_time / self.max_concurrent
+
+    def _release(self) -> None:
+        # слот передаётся первому живому ожидающему, in_flight при этом не меняется
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+
+        if self.in_flight < self.max_concurrent:
+            self.in_flight += 1
+        else:
+            if self._estimated_wait() > self.target_wait:
+                shed_requests.inc(("queue_estimate",))
+                await service_unavailable()(scope, receive, send)
+                return
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter), timeout=self.target_wait)
+            except BaseException as exc:
+                if waiter.done() and not waiter.cancelled():
+                    # слот успели отдать в момент таймаута/отмены — вернуть его
+                    self._release()
+                else:
+                    waiter.cancel()
+                if not isinstance(exc, asyncio.TimeoutError):
+                    raise
+                shed_requests.inc(("queue_timeout",))
+                await service_unavailable()(scope, receive, send)
+                return
+
+        started = perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            elapsed = perf_counter() - started
+            if self.service_time:
+                self.service_time += SERVICE_TIME_ALPHA * (elapsed - self.service_time)
+            else:
+                self.service_time = elapsed
+            self._release()
+
+
+
+class _Active:
+    middleware: Optional[AdmissionMiddleware] = None
+
+
+_active = _Active()
+
+
+def _collect_admission_metrics():
+    middleware = _active.middleware
+    if middleware is None:
+        return
+    yield "admission_in_flight", "gauge", "Requests currently admitted.", [((), middleware.in_flight)], ()
+    yield "admission_queued", "gauge", "Requests waiting for admission.", [((), len(middleware._waiters))], ()
+    yield (
+        "admission_service_time_seconds",
+        "gauge",
+        "Smoothed request service time.",
+        [((), middleware.service_time)],
+        (),
+    )
+
+
+metrics.register_collector(_collect_admission_metrics)
@@ -2,21 +2,26 @@ from __future__ import annotations
 
 import hmac
 import hashlib
+import math
 import secrets
 from datetime import datetime
 from typing import Optional
 from uuid import UUID
 
-from fastapi import HTTPException, Request, Response, status
+from fastapi import Depends, HTTPException, Request, Response, status
 
-from . import db
 from .config import settings
+from .storage import Storage, get_storage
 
 COOKIE_NAME = "user_id"
 CSRF_COOKIE = "csrf_token"
 CSRF_HEADER = "X-CSRF-Token"
+# Подписанный срок «читать с primary» после записи: "<user_id>.<unix-время>.<подпись>"
+PRIMARY_PIN_COOKIE = "rw_until"
 MAX_AGE_SECONDS = settings.cookie_max_age_days * 24 * 60 * 60
 COOKIE_EXPIRE_NOW = 0
+# Ключ в scope["state"], куда middleware кладёт уже проверенный user_id (или None)
+AUTH_STATE_KEY = "auth_user_id"
 
 
 def _sign_user_id(user_id: str) -> str:
@@ -43,6 +48,42 @@ def verify_cookie_value(raw: str) -> Optional[UUID]:
     return UUID(uid_part)
 
 
+def request_user_id(request: Request) -> Optional[UUID]:
+    """
+    user_id из подписанной cookie. Если запрос прошёл через RequestLoggingMiddleware,
+    подпись уже проверена — берём результат из scope и не считаем HMAC повторно.
+    """
+    state = request.scope.get("state") or {}
+    if AUTH_STATE_KEY in state:
+        return state[AUTH_STATE_KEY]
+    raw_cookie = request.cookies.get(COOKIE_NAME)
+    return verify_cookie_value(raw_cookie) if raw_cookie else None
+
+
+def build_primary_pin(user_id: UUID, until: float) -> str:
+    payload = f"{user_id}.{int(until)}"
+    return f"{payload}.{_sign_user_id('rw:' + payload)}"
+
+
+def verify_primary_pin(raw: str, user_id: UUID) -> Optional[float]:
+    """Срок (unix-время) из cookie, если она подписана нами и выдана этому же пользователю."""
+    payload, _, signature = raw.rpartition(".")
+    uid_part, _, until = payload.partition(".")
+    if uid_part != str(user_id) or not until.isdigit():
+        return None
+    if not hmac.compare_digest(_sign_user_id('rw:' + payload), signature):
+        return None
+    return float(until)
+
+
+def primary_pin_header(user_id: UUID, now: float) -> bytes:
+    """Set-Cookie для ответа на запись (собирается в ASGI middleware, без Response)."""
+    seconds = max(1, math.ceil(settings.read_your_writes_seconds))
+    value = build_primary_pin(user_id, now + seconds)
+    secure = "; Secure" if settings.cookie_secure else ""
+    return f"{PRIMARY_PIN_COOKIE}={value}; Max-Age={seconds}; Path=/; HttpOnly; SameSite=lax{secure}".encode("latin-1")
+
+
 def set_user_cookie(response: Response, user_id: UUID) -> None:
     response.set_cookie(
         COOKIE_NAME,
@@ -89,19 +130,22 @@ def verify_csrf(request: Request) -> None:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid CSRF token")
 
 
-async def get_current_user(request: Request, response: Response) -> dict:
-    raw_cookie = request.cookies.get(COOKIE_NAME)
-    user_id = verify_cookie_value(raw_cookie) if raw_cookie else None
+async def get_current_user(
+    request: Request,
+    response: Response,
+    store: Storage = Depends(get_storage),
+) -> dict:
+    user_id = request_user_id(request)
     if not user_id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
 
-    user = await db.fetch_user(user_id)
+    user = await store.fetch_user(user_id)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
 
     # Sliding expiration
     set_user_cookie(response, user_id)
-    await db.touch_user(user_id, datetime.utcnow())
+    await store.touch_user(user_id, datetime.utcnow())
     # keep in request state for logging convenience
     request.state.user = user
     return user
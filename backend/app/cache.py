@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Callable, Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+V = TypeVar("V")
+
+
+class TTLCache(Generic[V]):
+    """
+    Ограниченный по размеру LRU-кэш с TTL на запись.
+    Живёт внутри одного процесса (воркера uvicorn) и рассчитан на работу в event loop,
+    поэтому блокировки не нужны: между await никто не вклинится.
+    С weigher дополнительно ограничен суммарный вес значений (maxweight), например число строк.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        weigher: Optional[Callable[[V], int]] = None,
+        maxweight: int = 0,
+    ) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.weigher = weigher
+        self.maxweight = maxweight
+        self.weight = 0
+        self._data: "OrderedDict[Hashable, Tuple[float, V]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[V]:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = item
+        if expires_at <= monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key: Hashable) -> Optional[V]:
+        """Как get, но без учёта в hits/misses и без сдвига в LRU."""
+        item = self._data.get(key)
+        if item is None or item[0] <= monotonic():
+            return None
+        return item[1]
+
+    def _remove(self, key: Hashable) -> None:
+        _, value = self._data.pop(key)
+        if self.weigher is not None:
+            self.weight -= self.weigher(value)
+
+    def set(self, key: Hashable, value: V) -> None:
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        if self.weigher is not None:
+            if self.weigher(value) > self.maxweight:
+                # одно значение тяжелее всего бюджета — не кэшируем
+                self.invalidate(key)
+                return
+            if key in self._data:
+                self._remove(key)
+            self.weight += self.weigher(value)
+        self._data[key] = (monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize or (self.weigher is not None and self.weight > self.maxweight):
+            self._remove(next(iter(self._data)))
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        if key in self._data:
+            self._remove(key)
+
+    def invalidate_if(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Удалить все ключи, для которых predicate(key) истинен (полный проход, для редких случаев)."""
+        keys = [key for key in self._data if predicate(key)]
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.weight = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "weight": self.weight,
+        }
@@ -0,0 +1,242 @@
+"""
+Лента изменений проектов для SSE (GET /api/projects/stream).
+
+Триггеры на projects (миграция 5) шлют NOTIFY project_changes — одно сообщение на владельца
+за SQL-оператор. В каждом воркере одно выделенное соединение (вне пула) слушает канал и
+раскладывает события по очередям подписчиков этого владельца. MemoryStorage публикует
+те же события напрямую.
+
+Id события — "<epoch воркера>-<номер>": по Last-Event-ID переподключившийся клиент получает
+пропущенные события из истории воркера, а если это невозможно (другой воркер, история
+вытеснена, был разрыв LISTEN) — событие reset, после которого список перечитывается целиком.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import secrets
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+from uuid import UUID
+
+import asyncpg
+from loguru import logger
+
+from . import metrics
+from .config import settings
+
+CHANNEL = "project_changes"
+# Больше id в одном событии не передаём (лимит payload NOTIFY — 8000 байт);
+# то же число зашито в функцию notify_project_changes (миграции 5 и 6)
+MAX_EVENT_IDS = 500
+RECONNECT_DELAY_SECONDS = 1.0
+MAX_RECONNECT_DELAY_SECONDS = 30.0
+
+log = logger.bind(req="-", user="-", nick="-")
+
+feed_events = metrics.counter(
+    "project_feed_events_total",
+    "Project change events: published by this worker, replayed on resume, client queue overflows.",
+    ("outcome",),
+)
+feed_listener_reconnects = metrics.counter(
+    "project_feed_listener_reconnects_total",
+    "Times the LISTEN connection had to be re-established.",
+)
+
+Event = Dict[str, Any]
+# (владелец или None при reset, операция, ids, время записи в БД по часам Postgres)
+ChangeListener = Callable[[Optional[UUID], str, Optional[List[int]], Optional[float]], None]
+
+
+class Subscription:
+    """Очередь одного SSE-клиента. Переполнение заменяет накопленное одним reset."""
+
+    def __init__(self, owner_id: UUID, maxsize: int) -> None:
+        self.owner_id = owner_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+
+    def offer(self, event: Event) -> None:
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # клиент не успевает читать: догонять по событиям дороже, чем перечитать список
+            feed_events.inc(("overflow",))
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"id": event["id"], "op": "reset", "ids": None})
+
+
+class ChangeFeed:
+    def __init__(self, history_size: int, client_queue_size: int) -> None:
+        self.epoch = secrets.token_hex(4)
+        self.seq = 0
+        self.client_queue_size = client_queue_size
+        # (номер, владелец, событие) последних событий для resume по Last-Event-ID
+        self.history: Deque[Tuple[int, UUID, Event]] = deque(maxlen=history_size)
+        self.subscribers: Dict[UUID, Set[Subscription]] = {}
+        # внутренние потребители событий (кэш проектов), вызываются синхронно в event loop
+        self.listeners: List[ChangeListener] = []
+        self.available = False
+        # DSN с поднятым LISTEN: при шардировании слушаем каждый шард
+        self.dsns: List[str] = []
+        self.listening: Set[str] = set()
+        self.tasks: List[asyncio.Task] = []
+
+    # --- публикация ---
+
+    def _next_id(self) -> str:
+        self.seq += 1
+        return f"{self.epoch}-{self.seq}"
+
+    def add_listener(self, listener: ChangeListener) -> None:
+        self.listeners.append(listener)
+
+    def publish(
+        self, owner_id: UUID, op: str, ids: Optional[List[int]], sent_at: Optional[float] = None
+    ) -> None:
+        if ids is not None and len(ids) > MAX_EVENT_IDS:
+            ids = None
+        for listener in self.listeners:
+            listener(owner_id, op, ids, sent_at)
+        event = {"id": self._next_id(), "op": op, "ids": ids}
+        self.history.append((self.seq, owner_id, event))
+        feed_events.inc(("published",))
+        for subscription in self.subscribers.get(owner_id, ()):
+            subscription.offer(event)
+
+    def reset_all(self) -> None:
+        """События могли потеряться (разрыв LISTEN): всем — reset, старые id больше не валидны."""
+        event = {"id": self._next_id(), "op": "reset", "ids": None}
+        self.history.clear()
+        for listener in self.listeners:
+            listener(None, "reset", None, None)
+        for subscriptions in self.subscribers.values():
+            for subscription in subscriptions:
+                subscription.offer(event)
+
+    @property
+    def connected(self) -> bool:
+        """Все LISTEN-соединения подняты: ни одно изменение не может пройти мимо."""
+        return bool(self.dsns) and len(self.listening) == len(self.dsns)
+
+    # --- подписчики ---
+
+    @property
+    def subscriber_count(self) -> int:
+        return sum(len(subscriptions) for subscriptions in self.subscribers.values())
+
+    def subscribe(self, owner_id: UUID, last_event_id: Optional[str] = None) -> Subscription:
+        subscription = Subscription(owner_id, self.client_queue_size)
+        self.subscribers.setdefault(owner_id, set()).add(subscription)
+        if last_event_id:
+            self._replay(subscription, last_event_id)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscriptions = self.subscribers.get(subscription.owner_id)
+        if subscriptions is None:
+            return
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del self.subscribers[subscription.owner_id]
+
+    def _replay(self, subscription: Subscription, last_event_id: str) -> None:
+        epoch, _, raw_seq = last_event_id.partition("-")
+        oldest = self.history[0][0] if self.history else self.seq + 1
+        try:
+            last_seq = int(raw_seq)
+        except ValueError:
+            last_seq = -1
+        if epoch != self.epoch or last_seq > self.seq or last_seq + 1 < oldest:
+            subscription.offer({"id": f"{self.epoch}-{self.seq}", "op": "reset", "ids": None})
+            return
+        for seq, owner_id, event in self.history:
+            if seq > last_seq and owner_id == subscription.owner_id:
+                feed_events.inc(("replayed",))
+                subscription.offer(event)
+
+    # --- LISTEN ---
+
+    def _on_notify(self, connection: Any, pid: int, channel: str, payload: str) -> None:
+        try:
+            data = json.loads(payload)
+            self.publish(UUID(data["owner_id"]), data["op"], data.get("ids"), data.get("at"))
+        except (ValueError, KeyError, TypeError):
+            log.exception("event=project_feed_bad_payload payload={payload}", payload=payload[:200])
+
+    async def _listen(self, dsn: str) -> None:
+        delay = RECONNECT_DELAY_SECONDS
+        first = True
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(dsn)
+                await connection.add_listener(CHANNEL, self._on_notify)
+                self.listening.add(dsn)
+                delay = RECONNECT_DELAY_SECONDS
+                if not first:
+                    feed_listener_reconnects.inc()
+                    self.reset_all()
+                first = False
+                log.info("event=project_feed_listening channel={channel}", channel=CHANNEL)
+                # NOTIFY приходят в callback; здесь только проверяем, что соединение живо
+                while True:
+                    await asyncio.sleep(settings.project_feed_heartbeat_seconds)
+                    await connection.fetchval("SELECT 1;", timeout=settings.db_pool_acquire_timeout_seconds)
+            except asyncio.CancelledError:
+                raise
+            except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError):
+                log.exception("event=project_feed_listener_failed retry_in={delay}", delay=delay)
+            finally:
+                self.listening.discard(dsn)
+                if connection is not None and not connection.is_closed():
+                    await connection.close(timeout=1)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY_SECONDS)
+
+    def start(self, *dsns: str) -> None:
+        """Начать принимать подписки; с dsn — ещё и слушать NOTIFY из Postgres (по соединению на базу)."""
+        self.available = True
+        if dsns and not self.tasks:
+            self.dsns = list(dsns)
+            self.tasks = [asyncio.create_task(self._listen(dsn)) for dsn in dsns]
+
+    async def stop(self) -> None:
+        self.available = False
+        tasks, self.tasks, self.dsns = self.tasks, [], []
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        # открытые потоки завершатся сами, получив None
+        for subscriptions in self.subscribers.values():
+            for subscription in subscriptions:
+                while not subscription.queue.empty():
+                    subscription.queue.get_nowait()
+                subscription.queue.put_nowait(None)
+
+
+def format_event(event: Event) -> bytes:
+    data = json.dumps({"op": event["op"], "ids": event["ids"]}, separators=(",", ":"))
+    return f"id: {event['id']}\nevent: {event['op']}\ndata: {data}\n\n".encode()
+
+
+feed = ChangeFeed(settings.project_feed_history, settings.project_feed_client_queue)
+
+
+def _collect_feed_metrics():
+    yield "project_feed_subscribers", "gauge", "Open SSE project streams in this worker.", [((), feed.subscriber_count)], ()
+    yield (
+        "project_feed_listener_connected",
+        "gauge",
+        "1 if every LISTEN connection (one per shard) is up.",
+        [((), int(feed.connected))],
+        (),
+    )
+
+
+metrics.register_collector(_collect_feed_metrics)
@@ -1,3 +1,5 @@
+from typing import Tuple
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -6,8 +8,100 @@ class Settings(BaseSettings):
     auth_secret: str
     cookie_secure: bool = False
     cookie_max_age_days: int = 30
+    # Хранилище: "postgres" (asyncpg, app.db) или "memory" (для тестов и бенчмарков)
+    storage_backend: str = "postgres"
+    # Миграции при старте; в проде можно отключить и запускать python -m app.migrations
+    run_migrations_on_startup: bool = True
+    # Пул соединений и защита от перегрузки (значения — на один воркер)
+    db_pool_min_size: int = 1
+    db_pool_max_size: int = 5
+    db_pool_acquire_timeout_seconds: float = 5.0
+    # Общий бюджет соединений к одному серверу БД на все воркеры (0 — брать db_pool_max_size);
+    # должен оставаться ниже max_connections Postgres с запасом на миграции и админку
+    db_connection_budget: int = 0
+    max_concurrent_requests: int = 64
+    admission_target_wait_seconds: float = 0.5
+    # Реплики для чтения: DSN через запятую; "round_robin" или "least_busy";
+    # после записи пользователь читает с primary ещё read_your_writes_seconds
+    replica_database_urls: str = ""
+    replica_routing: str = "round_robin"
+    read_your_writes_seconds: float = 5.0
+    # Шарды по владельцу: DSN через запятую (номер шарда — позиция в списке, список только дописывать);
+    # database_url тогда хранит справочник user_directory. Реплики при шардировании не используются.
+    # Размещение владельца кэшируется на shard_directory_ttl_seconds (см. app/shards.py)
+    shard_database_urls: str = ""
+    shard_directory_ttl_seconds: float = 10.0
+    # Кэш пользователей в каждом воркере; TTL ограничивает рассинхрон между воркерами
+    user_cache_size: int = 10_000
+    user_cache_ttl_seconds: float = 30.0
+    # Кэш проектов в каждом воркере: сброс по NOTIFY (работает только при project_feed_enabled),
+    # TTL — страховка от потерянного события и отставания реплики дольше read_your_writes_seconds
+    project_cache_enabled: bool = True
+    project_cache_size: int = 10_000
+    project_cache_list_size: int = 2_000
+    # суммарно строк во всех закэшированных списках воркера (потолок памяти)
+    project_cache_list_rows: int = 100_000
+    project_cache_ttl_seconds: float = 60.0
+    # Лимиты частоты запросов (token bucket): «политика=запросов/секунд[:ip|user|nickname]», через запятую.
+    # login и register по умолчанию считаются по IP клиента, login_nickname — по нику из запроса
+    # (вход в один аккаунт с многих адресов), project_write и project_export — по пользователю.
+    # rate_limit_backend: memory — вёдра в каждом воркере (лимит фактически × число воркеров),
+    # postgres — общие вёдра в UNLOGGED-таблице rate_limit_buckets (запрос к БД на каждую проверку)
+    rate_limit_enabled: bool = True
+    rate_limits: str = "login=10/60,login_nickname=10/300,register=5/600,project_write=120/60,project_export=10/600"
+    rate_limit_backend: str = "memory"
+    rate_limit_max_keys: int = 100_000
+    # Удаление аккаунта: запрос только помечает deleted_at, проекты удаляет фоновый purger
+    # пачками по account_purge_batch_size с паузой между ними; проход — раз в interval или сразу по удалению
+    account_purge_batch_size: int = 1_000
+    account_purge_pause_seconds: float = 0.05
+    account_purge_interval_seconds: float = 30.0
+    # Отложенная запись last_seen: пачка раз в N секунд или по M накопленным пользователям
+    last_seen_flush_interval_seconds: float = 5.0
+    last_seen_flush_max_entries: int = 500
+    last_seen_min_interval_seconds: float = 60.0
+    # PBKDF2 вне event loop: "thread" или "process", число воркеров и длина очереди до 503
+    password_executor: str = "thread"
+    password_workers: int = 2
+    password_max_queue: int = 32
+    # Одновременных выгрузок /api/projects/export на воркер (каждая держит соединение пула), сверх — 503
+    export_max_concurrent: int = 2
+    # Продакшн-запуск (python -m app.serve): 0 воркеров — по числу доступных ядер.
+    # keep-alive должен быть больше idle timeout балансировщика перед сервисом
+    web_host: str = "0.0.0.0"
+    web_port: int = 8000
+    web_workers: int = 0
+    web_backlog: int = 2048
+    web_keepalive_seconds: int = 75
+    web_graceful_shutdown_seconds: int = 30
+    # Логи: "text" (цветной, для разработки) или "json" (JSON lines пачками из фонового потока);
+    # пустой log_file — stdout. log_sample_rates: "событие=доля,..." (warning+ пишутся всегда),
+    # log_skip_paths: пути через запятую, для которых не пишется access-лог (например, /health)
+    log_format: str = "text"
+    log_file: str = ""
+    log_file_max_bytes: int = 100 * 1024 * 1024
+    log_file_backups: int = 5
+    log_sample_rates: str = ""
+    log_skip_paths: str = ""
+    log_queue_size: int = 10_000
+    # Лента изменений проектов (SSE): LISTEN-соединение на воркер (сверх пула),
+    # очередь на клиента, история для Last-Event-ID, heartbeat и лимит потоков на воркер
+    project_feed_enabled: bool = True
+    project_feed_client_queue: int = 100
+    project_feed_history: int = 1000
+    project_feed_heartbeat_seconds: float = 15.0
+    project_feed_max_clients: int = 1000
 
     model_config = SettingsConfigDict(env_file='.env', env_file_encoding='utf-8')
 
+    def db_pool_size(self) -> Tuple[int, int]:
+        """(min, max) пула одного воркера: бюджет соединений делится поровну между воркерами."""
+        max_size = self.db_pool_max_size
+        if self.db_connection_budget > 0:
+            share = self.db_connection_budget // max(1, self.web_workers)
+            # одно соединение воркера занято LISTEN ленты изменений
+            max_size = max(1, share - int(self.project_feed_enabled))
+        return min(self.db_pool_min_size, max_size), max_size
+
 
 settings = Settings()
@@ -1,110 +1,335 @@
 from __future__ import annotations
 
-from datetime import datetime
-from typing import Any, Dict, List, Optional
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from time import monotonic, perf_counter
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
 from uuid import UUID, uuid4
 
 import asyncpg
+from loguru import logger
 
+from . import changes, metrics, migrations, shards
+from .cache import TTLCache
 from .config import settings
+from .metrics import timed
+from .project_cache import project_cache
+from .schemas import DELETED_NICKNAME_PREFIX
+
+
+class PoolTimeout(RuntimeError):
+    """Не дождались свободного соединения за db_pool_acquire_timeout_seconds."""
 
 
 class Database:
     pool: Optional[asyncpg.Pool] = None
+    replicas: List[asyncpg.Pool] = []
+    # При шардировании pool — справочник user_directory, данные владельцев — в shards[ring/справочник]
+    shards: List[asyncpg.Pool] = []
+    ring: Optional[shards.HashRing] = None
+    replica_cursor: int = 0
+    last_seen_task: Optional[asyncio.Task] = None
+    last_seen_wakeup: Optional[asyncio.Event] = None
+    # остановка flusher'а без cancel: отменённый посреди записи flush потерял бы пачку
+    last_seen_stop: Optional[asyncio.Event] = None
+    purge_task: Optional[asyncio.Task] = None
+    purge_wakeup: Optional[asyncio.Event] = None
+    # None — ещё не проверяли наличие pg_trgm (миграция 4 необязательна)
+    trigram_enabled: Optional[bool] = None
 
 
 db = Database()
+log = logger.bind(req="-", user="-", nick="-")
+
+# Проверенные пользователи по id. Кэш локален для воркера; удаление аккаунта в любом воркере
+# приходит сюда через NOTIFY (op=account_deleted, см. _on_change). TTL — на случай, когда
+# LISTEN-соединения нет (project_feed_enabled=false или разрыв).
+user_cache: TTLCache[Dict[str, Any]] = TTLCache(
+    maxsize=settings.user_cache_size,
+    ttl=settings.user_cache_ttl_seconds,
+)
+
+# Буфер last_seen: последний timestamp на пользователя ждёт пакетной записи,
+# а момент последнего touch (monotonic) отсекает слишком частые обновления.
+_last_seen_pending: Dict[UUID, datetime] = {}
+_last_seen_touched: Dict[UUID, float] = {}
+
+# Размещение владельца (шард, moving) из user_directory. После переезда воркер узнаёт
+# новый шард не позже TTL; shards.move_owners выжидает это время, прежде чем удалять старую копию.
+placement_cache: TTLCache[Tuple[int, bool]] = TTLCache(
+    maxsize=settings.user_cache_size,
+    ttl=settings.shard_directory_ttl_seconds,
+)
+
+# Read-your-writes: до этого момента (monotonic) чтения пользователя идут на primary
+_primary_until: Dict[UUID, float] = {}
+_PRIMARY_UNTIL_PRUNE_SIZE = 10_000
+
+read_routing = metrics.counter(
+    "db_read_routing_total",
+    "Where read queries were sent.",
+    ("target",),
+)
+
+# Аккаунтов за один проход purger'а на базу
+PURGE_ACCOUNTS_PER_PASS = 20
+
+account_purge_projects = metrics.counter(
+    "account_purge_projects_deleted_total",
+    "Projects of deleted accounts removed by the background purger.",
+)
+account_purge_accounts = metrics.counter(
+    "account_purge_accounts_total",
+    "Deleted accounts fully purged.",
+)
+account_purge_batch_duration = metrics.histogram(
+    "account_purge_batch_seconds",
+    "Duration of one batched project DELETE of the purger.",
+    (),
+    metrics.DB_BUCKETS,
+)
+
+
+class _PurgeState:
+    # остаток очереди после последнего прохода purger'а (count(*) по всем базам)
+    pending: int = 0
+    oldest: Optional[datetime] = None
+
+
+_purge_state = _PurgeState()
+
+# Документ полнотекстового поиска (выражение должно совпадать с индексом из миграции 3)
+SEARCH_VECTOR_EXPR = (
+    "(setweight(to_tsvector('russian', coalesce(name_ru, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(name_en, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(organization_ru, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(organization_en, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(specialization, '')), 'C'))"
+)
+
+# Текст для нечёткого поиска по триграммам (выражение должно совпадать с индексом из миграции 4)
+SEARCH_TEXT_EXPR = (
+    "(coalesce(name_ru, '') || ' ' || coalesce(name_en, '') || ' ' || "
+    "coalesce(organization_ru, '') || ' ' || coalesce(organization_en, '') || ' ' || "
+    "coalesce(specialization, ''))"
+)
+
+
+def _on_change(owner_id: Optional[UUID], op: str, ids: Optional[List[int]], sent_at: Optional[float]) -> None:
+    """Слушатель changes.feed: удаление аккаунта в любом воркере, reset — сброс всего кэша."""
+    if owner_id is None:
+        user_cache.clear()
+    elif op == "account_deleted":
+        user_cache.invalidate(owner_id)
+
+
+changes.feed.add_listener(_on_change)
+
+
+def pin_primary(user_id: UUID, seconds: float) -> None:
+    """Закрепить чтения пользователя за primary на seconds (в этом воркере)."""
+    if not db.replicas or seconds <= 0:
+        return
+    now = monotonic()
+    if len(_primary_until) >= _PRIMARY_UNTIL_PRUNE_SIZE:
+        for key in [key for key, until in _primary_until.items() if until <= now]:
+            del _primary_until[key]
+    _primary_until[user_id] = max(_primary_until.get(user_id, 0.0), now + seconds)
+
+
+def _mark_write(user_id: UUID) -> None:
+    """
+    Закрепить чтения пользователя за primary на read_your_writes_seconds. Следующий запрос
+    может попасть в другой воркер — туда срок приносит cookie auth.PRIMARY_PIN_COOKIE,
+    которую RequestLoggingMiddleware ставит на ответы записывающих запросов.
+    """
+    pin_primary(user_id, settings.read_your_writes_seconds)
+
+
+async def _placement(owner_id: UUID) -> Tuple[int, bool]:
+    """(номер шарда, идёт ли переезд) владельца: справочник, а для отсутствующих в нём — кольцо."""
+    placement = placement_cache.get(owner_id)
+    if placement is not None:
+        return placement
+    async with _acquire() as conn:
+        row = await conn.fetchrow("SELECT shard, moving FROM user_directory WHERE user_id = $1;", owner_id)
+    assert db.ring is not None
+    placement = (row["shard"], row["moving"]) if row else (db.ring.shard_for(owner_id), False)
+    placement_cache.set(owner_id, placement)
+    return placement
+
+
+async def _pick_pool(read_for: Optional[UUID], primary_for: Optional[UUID]) -> asyncpg.Pool:
+    assert db.pool is not None
+    if db.shards and (read_for or primary_for):
+        shard, moving = await _placement(primary_for or read_for)  # type: ignore[arg-type]
+        if moving and primary_for is not None:
+            raise shards.ShardMoving("Owner is being moved to another shard")
+        return db.shards[shard]
+    if read_for is None or not db.replicas:
+        return db.pool
+    until = _primary_until.get(read_for)
+    if until is not None:
+        if until > monotonic():
+            read_routing.inc(("primary_sticky",))
+            return db.pool
+        del _primary_until[read_for]
+
+    read_routing.inc(("replica",))
+    if settings.replica_routing == "least_busy":
+        return min(db.replicas, key=lambda pool: pool.get_size() - pool.get_idle_size())
+    db.replica_cursor = (db.replica_cursor + 1) % len(db.replicas)
+    return db.replicas[db.replica_cursor]
+
+
+@asynccontextmanager
+async def _acquire(
+    read_for: Optional[UUID] = None, primary_for: Optional[UUID] = None
+) -> AsyncIterator[asyncpg.Connection]:
+    """
+    Взять соединение (с таймаутом), замерив ожидание.
+    read_for — владелец данных для чтения: такие запросы могут уйти на реплику.
+    primary_for — владелец данных для записи (или чтения строго с primary).
+    При шардировании оба ведут на шард владельца, без них — в базу справочника.
+    """
+    pool = await _pick_pool(read_for, primary_for)
+    started = perf_counter()
+    try:
+        conn = await pool.acquire(timeout=settings.db_pool_acquire_timeout_seconds)
+    except asyncio.TimeoutError:
+        raise PoolTimeout("Timed out waiting for a database connection")
+    finally:
+        metrics.db_pool_acquire_duration.observe((), perf_counter() - started)
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
+
+def _collect_db_metrics():
+    pools = [("primary", db.pool)] if db.pool is not None else []
+    pools += [(f"replica{index}", pool) for index, pool in enumerate(db.replicas)]
+    pools += [(f"shard{index}", pool) for index, pool in enumerate(db.shards)]
+    if pools:
+        for name, help, getter in (
+            ("db_pool_size", "Open connections in the asyncpg pool.", asyncpg.Pool.get_size),
+            ("db_pool_idle", "Idle connections in the asyncpg pool.", asyncpg.Pool.get_idle_size),
+            ("db_pool_max_size", "Configured pool maximum.", asyncpg.Pool.get_max_size),
+        ):
+            yield name, "gauge", help, [((label,), getter(pool)) for label, pool in pools], ("pool",)
+    stats = user_cache.stats()
+    yield "user_cache_size", "gauge", "Entries in the per-worker user cache.", [((), stats["size"])], ()
+    yield (
+        "user_cache_events_total",
+        "counter",
+        "User cache hits, misses and evictions.",
+        [(("hit",), stats["hits"]), (("miss",), stats["misses"]), (("eviction",), stats["evictions"])],
+        ("event",),
+    )
+    yield "last_seen_pending", "gauge", "Users waiting for a batched last_seen write.", [((), len(_last_seen_pending))], ()
+    yield "account_purge_pending", "gauge", "Deleted accounts still waiting for the purger.", [((), _purge_state.pending)], ()
+    oldest = _purge_state.oldest
+    yield (
+        "account_purge_oldest_seconds",
+        "gauge",
+        "Age of the oldest deleted account not yet purged.",
+        [((), (datetime.now(timezone.utc) - oldest).total_seconds() if oldest else 0)],
+        (),
+    )
+
+
+metrics.register_collector(_collect_db_metrics)
 
 
 async def connect_to_db() -> None:
     """Открыть пул соединений и инициализировать схему."""
-    db.pool = await asyncpg.create_pool(settings.database_url, min_size=1, max_size=5)
+    min_size, max_size = settings.db_pool_size()
+    db.pool = await asyncpg.create_pool(settings.database_url, min_size=min_size, max_size=max_size)
+    shard_urls = shards.shard_urls()
+    if shard_urls:
+        db.shards = [await asyncpg.create_pool(dsn, min_size=min_size, max_size=max_size) for dsn in shard_urls]
+        db.ring = shards.HashRing(len(db.shards))
+        if settings.replica_database_urls:
+            log.warning("event=replicas_ignored reason=sharding_enabled")
+    else:
+        db.replicas = [
+            await asyncpg.create_pool(dsn, min_size=min_size, max_size=max_size)
+            for dsn in (part.strip() for part in settings.replica_database_urls.split(","))
+            if dsn
+        ]
     await init_db()
 
 
 async def close_db() -> None:
-    """Закрыть пул при остановке приложения."""
+    """Закрыть пул при остановке приложения (предварительно сбросив буфер last_seen)."""
+    await stop_last_seen_flusher()
+    await stop_account_purger()
+    for extra_pool in (*db.replicas, *db.shards):
+        await extra_pool.close()
+    db.replicas = []
+    db.shards = []
+    db.ring = None
+    placement_cache.clear()
+    _primary_until.clear()
+    project_cache.clear("local")
     if db.pool:
         await db.pool.close()
         db.pool = None
+    user_cache.clear()
 
 
 async def init_db() -> None:
     """
-    Минимальная схема: пользователи (auth) и проекты.
-    Простая "миграция" через IF NOT EXISTS, чтобы не усложнять локальную разработку.
+    Привести схему к актуальной версии (см. app/migrations.py).
+    Если схема уже актуальна — это один SELECT версии без DDL.
     """
     if not db.pool:
         raise RuntimeError("Connection pool is not initialized")
+    if not settings.run_migrations_on_startup:
+        return
 
-    async with db.pool.acquire() as conn:
-        # Users: login + password hash + timestamps
-        await conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS users (
-                id UUID PRIMARY KEY,
-                nickname TEXT UNIQUE NOT NULL,
-                password_hash TEXT DEFAULT '',
-                created_at TIMESTAMPTZ DEFAULT NOW(),
-                last_seen TIMESTAMPTZ DEFAULT NOW()
-            );
-            """
-        )
-        await conn.execute(
-            "ALTER TABLE users ADD COLUMN IF NOT EXISTS password_hash TEXT DEFAULT '';"
-        )
-        await conn.execute(
-            "CREATE UNIQUE INDEX IF NOT EXISTS users_nickname_lower_idx ON users (lower(nickname));"
-        )
-
-        # Projects: приватные записи, каждая привязана к owner_id
-        await conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS projects (
-                id SERIAL PRIMARY KEY,
-                owner_id UUID REFERENCES users(id),
-                name_ru TEXT NOT NULL,
-                name_en TEXT DEFAULT '',
-                organization_ru TEXT DEFAULT '',
-                organization_en TEXT DEFAULT '',
-                direction TEXT DEFAULT '',
-                scope TEXT DEFAULT '',
-                focus TEXT DEFAULT '',
-                profile_type TEXT DEFAULT '',
-                specialization TEXT DEFAULT '',
-                created_at TIMESTAMPTZ DEFAULT NOW(),
-                updated_at TIMESTAMPTZ DEFAULT NOW()
-            );
-            """
-        )
-        alter_queries = [
-            "ALTER TABLE projects ADD COLUMN IF NOT EXISTS scope TEXT DEFAULT '';",
-            "ALTER TABLE projects ADD COLUMN IF NOT EXISTS focus TEXT DEFAULT '';",
-            "ALTER TABLE projects ADD COLUMN IF NOT EXISTS profile_type TEXT DEFAULT '';",
-            "ALTER TABLE projects ADD COLUMN IF NOT EXISTS specialization TEXT DEFAULT '';",
-            "ALTER TABLE projects ADD COLUMN IF NOT EXISTS owner_id UUID REFERENCES users(id);",
-            "CREATE INDEX IF NOT EXISTS projects_owner_idx ON projects(owner_id);",
-        ]
-        for query in alter_queries:
-            await conn.execute(query)
+    async with _acquire() as conn:
+        await migrations.migrate(conn)
+    for index, pool in enumerate(db.shards):
+        async with pool.acquire(timeout=settings.db_pool_acquire_timeout_seconds) as conn:
+            await migrations.migrate(conn)
+            if await shards.sequence_increment(conn) != shards.MAX_SHARDS:
+                raise RuntimeError(f"Shard {index} is not initialized: run python -m app.shards init")
 
 
+@timed
 async def fetch_user(user_id: UUID) -> Optional[Dict[str, Any]]:
-    """Получить пользователя по id."""
+    """Получить пользователя по id (сначала из кэша воркера)."""
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return cached
+
     if not db.pool:
         raise RuntimeError("Database is not connected")
 
     query = """
     SELECT id, nickname, created_at, last_seen
     FROM users
-    WHERE id = $1;
+    WHERE id = $1 AND deleted_at IS NULL;
     """
 
-    async with db.pool.acquire() as conn:
+    async with _acquire(read_for=user_id) as conn:
         row = await conn.fetchrow(query, user_id)
-        return dict(row) if row else None
+    if not row and db.replicas:
+        # реплика могла ещё не получить свежую регистрацию — перепроверяем на primary
+        read_routing.inc(("primary_fallback",))
+        async with _acquire(primary_for=user_id) as conn:
+            row = await conn.fetchrow(query, user_id)
+
+    if not row:
+        return None
+    user = dict(row)
+    user_cache.set(user_id, user)
+    return user
 
 
+@timed
 async def fetch_user_by_nickname(nickname: str) -> Optional[Dict[str, Any]]:
     """Найти пользователя по nickname (без учета регистра)."""
     if not db.pool:
@@ -113,58 +338,492 @@ async def fetch_user_by_nickname(nickname: str) -> Optional[Dict[str, Any]]:
     query = """
     SELECT id, nickname, password_hash, created_at, last_seen
     FROM users
-    WHERE lower(nickname) = lower($1);
+    WHERE lower(nickname) = lower($1) AND deleted_at IS NULL;
     """
 
-    async with db.pool.acquire() as conn:
+    if db.shards:
+        # ник -> id через справочник, затем сам пользователь с его шарда
+        async with _acquire() as conn:
+            user_id = await conn.fetchval(
+                "SELECT user_id FROM user_directory WHERE lower(nickname) = lower($1);", nickname
+            )
+        if user_id is None:
+            return None
+        query = """
+        SELECT id, nickname, password_hash, created_at, last_seen
+        FROM users
+        WHERE id = $1 AND deleted_at IS NULL;
+        """
+        async with _acquire(read_for=user_id) as conn:
+            row = await conn.fetchrow(query, user_id)
+            return dict(row) if row else None
+
+    async with _acquire() as conn:
         row = await conn.fetchrow(query, nickname)
         return dict(row) if row else None
 
 
-async def create_user(nickname: str) -> Dict[str, Any]:
-    """Создать пользователя без пароля (вспомогательная функция)."""
+async def _insert_user(nickname: str, password_hash: str) -> Optional[Dict[str, Any]]:
+    """Один INSERT ... ON CONFLICT DO NOTHING: None, если ник (без учёта регистра) уже занят."""
     if not db.pool:
         raise RuntimeError("Database is not connected")
 
     user_id = uuid4()
+    _mark_write(user_id)
+    # без conflict target: арбитры — оба уникальных индекса (nickname и lower(nickname)),
+    # иначе одновременная регистрация одного и того же ника упала бы на users_nickname_key
     query = """
     INSERT INTO users (id, nickname, password_hash)
     VALUES ($1, $2, $3)
+    ON CONFLICT DO NOTHING
     RETURNING id, nickname, password_hash, created_at, last_seen;
     """
-    async with db.pool.acquire() as conn:
-        row = await conn.fetchrow(query, user_id, nickname, "")
-        return dict(row)
+    if not db.shards:
+        async with _acquire() as conn:
+            row = await conn.fetchrow(query, user_id, nickname, password_hash)
+            return dict(row) if row else None
+
+    # уникальность ника между шардами держит справочник: сначала он, потом строка в шарде
+    assert db.ring is not None
+    shard = db.ring.shard_for(user_id)
+    async with _acquire() as conn:
+        claimed = await conn.fetchval(
+            """
+            INSERT INTO user_directory (user_id, nickname, shard)
+            VALUES ($1, $2, $3)
+            ON CONFLICT DO NOTHING
+            RETURNING user_id;
+            """,
+            user_id,
+            nickname,
+            shard,
+        )
+    if claimed is None:
+        return None
+    placement_cache.set(user_id, (shard, False))
+    row = None
+    try:
+        async with _acquire(primary_for=user_id) as conn:
+            row = await conn.fetchrow(query, user_id, nickname, password_hash)
+        return dict(row) if row else None
+    finally:
+        if row is None:
+            # иначе ник остался бы занят пользователем, которого нет
+            async with _acquire() as conn:
+                await conn.execute("DELETE FROM user_directory WHERE user_id = $1;", user_id)
+            placement_cache.invalidate(user_id)
+
+
+@timed
+async def create_user(nickname: str) -> Optional[Dict[str, Any]]:
+    """Создать пользователя без пароля (вспомогательная функция); None — ник занят."""
+    return await _insert_user(nickname, "")
+
+
+@timed
+async def create_user_with_password(nickname: str, password_hash: str) -> Optional[Dict[str, Any]]:
+    """Создать пользователя с паролем (основной путь регистрации); None — ник занят."""
+    return await _insert_user(nickname, password_hash)
+
+
+async def _copy_users(conn: asyncpg.Connection, records: List[Tuple[UUID, str, str]]) -> List[asyncpg.Record]:
+    async with conn.transaction():
+        await conn.execute(
+            "CREATE TEMP TABLE users_import (id UUID, nickname TEXT, password_hash TEXT) ON COMMIT DROP;"
+        )
+        await conn.copy_records_to_table("users_import", records=records)
+        return await conn.fetch(
+            """
+            INSERT INTO users (id, nickname, password_hash)
+            SELECT id, nickname, password_hash FROM users_import
+            ON CONFLICT DO NOTHING
+            RETURNING id, nickname;
+            """
+        )
+
+
+@timed
+async def create_users_bulk(users: Sequence[Tuple[str, str]]) -> List[Dict[str, Any]]:
+    """
+    Массово создать пользователей (nickname, password_hash) через COPY во временную таблицу
+    и один INSERT ... ON CONFLICT DO NOTHING. Возвращает созданных (id, nickname); занятые ники пропускаются.
+    """
+    if not db.pool:
+        raise RuntimeError("Database is not connected")
+
+    records = [(uuid4(), nickname, password_hash) for nickname, password_hash in users]
+    if not db.shards:
+        async with _acquire() as conn:
+            return [dict(row) for row in await _copy_users(conn, records)]
+
+    # справочник решает, какие ники свободны; затем пачка в каждый шард
+    assert db.ring is not None
+    ring = db.ring
+    async with _acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                "CREATE TEMP TABLE directory_import (user_id UUID, nickname TEXT, shard INTEGER) ON COMMIT DROP;"
+            )
+            await conn.copy_records_to_table(
+                "directory_import",
+                records=[(user_id, nickname, ring.shard_for(user_id)) for user_id, nickname, _ in records],
+            )
+            claimed = await conn.fetch(
+                """
+                INSERT INTO user_directory (user_id, nickname, shard)
+                SELECT user_id, nickname, shard FROM directory_import
+                ON CONFLICT DO NOTHING
+                RETURNING user_id, shard;
+                """
+            )
+    by_id = {record[0]: record for record in records}
+    by_shard: Dict[int, List[Tuple[UUID, str, str]]] = {}
+    for row in claimed:
+        by_shard.setdefault(row["shard"], []).append(by_id[row["user_id"]])
+
+    created: List[Dict[str, Any]] = []
+    for shard, shard_records in by_shard.items():
+        rows: List[asyncpg.Record] = []
+        try:
+            async with db.shards[shard].acquire(timeout=settings.db_pool_acquire_timeout_seconds) as conn:
+                rows = await _copy_users(conn, shard_records)
+        finally:
+            # освободить ники тех, кто в шард не попал
+            inserted = {row["id"] for row in rows}
+            orphans = [user_id for user_id, _, _ in shard_records if user_id not in inserted]
+            if orphans:
+                async with _acquire() as conn:
+                    await conn.execute("DELETE FROM user_directory WHERE user_id = ANY($1::uuid[]);", orphans)
+        created.extend(dict(row) for row in rows)
+    return created
+
+
+@timed
+async def touch_user(user_id: UUID, timestamp: datetime) -> None:
+    """
+    Обновить last_seen (скользящие сессии).
+    Если запущен фоновый flusher, запись только попадает в буфер; повторные touch
+    одного пользователя чаще last_seen_min_interval_seconds игнорируются.
+    """
+    if db.last_seen_task is None:
+        if not db.pool:
+            raise RuntimeError("Database is not connected")
 
+        query = "UPDATE users SET last_seen = $2 WHERE id = $1;"
+        async with _acquire(primary_for=user_id) as conn:
+            await conn.execute(query, user_id, timestamp)
+        return
 
-async def create_user_with_password(nickname: str, password_hash: str) -> Dict[str, Any]:
-    """Создать пользователя с паролем (основной путь регистрации)."""
+    now = monotonic()
+    last = _last_seen_touched.get(user_id)
+    if last is not None and now - last < settings.last_seen_min_interval_seconds:
+        return
+    _last_seen_touched[user_id] = now
+
+    pending = _last_seen_pending.get(user_id)
+    if pending is None or timestamp > pending:
+        _last_seen_pending[user_id] = timestamp
+    if len(_last_seen_pending) >= settings.last_seen_flush_max_entries and db.last_seen_wakeup:
+        db.last_seen_wakeup.set()
+
+
+@timed
+async def flush_last_seen() -> int:
+    """Записать накопленные last_seen одним UPDATE ... FROM unnest(...). Возвращает число строк."""
+    if not _last_seen_pending:
+        return 0
     if not db.pool:
         raise RuntimeError("Database is not connected")
 
-    user_id = uuid4()
+    batch = dict(_last_seen_pending)
+    _last_seen_pending.clear()
+
+    # забываем давно не заходивших, чтобы словарь не рос бесконечно
+    horizon = monotonic() - settings.last_seen_min_interval_seconds
+    for user_id in [uid for uid, ts in _last_seen_touched.items() if ts < horizon]:
+        del _last_seen_touched[user_id]
+
     query = """
-    INSERT INTO users (id, nickname, password_hash)
-    VALUES ($1, $2, $3)
-    RETURNING id, nickname, password_hash, created_at, last_seen;
+    UPDATE users AS u
+    SET last_seen = GREATEST(u.last_seen, v.last_seen)
+    FROM unnest($1::uuid[], $2::timestamptz[]) AS v(id, last_seen)
+    WHERE u.id = v.id;
     """
-    async with db.pool.acquire() as conn:
-        row = await conn.fetchrow(query, user_id, nickname, password_hash)
-        return dict(row)
+    def requeue(items: Dict[UUID, datetime]) -> None:
+        # вернуть в буфер, не затирая более свежие значения
+        for user_id, timestamp in items.items():
+            pending = _last_seen_pending.get(user_id)
+            if pending is None or timestamp > pending:
+                _last_seen_pending[user_id] = timestamp
 
+    if not db.shards:
+        # BaseException: пачка уже вынута из буфера, при отмене задачи её тоже надо вернуть
+        try:
+            async with _acquire() as conn:
+                await conn.execute(query, list(batch.keys()), list(batch.values()))
+        except BaseException:
+            requeue(batch)
+            raise
+        return len(batch)
 
-async def touch_user(user_id: UUID, timestamp: datetime) -> None:
-    """Обновить last_seen (скользящие сессии)."""
+    # по пачке на шард; переезжающих отложим до следующего раза
+    by_shard: Dict[int, Dict[UUID, datetime]] = {}
+    for user_id, timestamp in batch.items():
+        try:
+            shard, moving = await _placement(user_id)
+        except BaseException:
+            requeue(batch)
+            raise
+        if moving:
+            requeue({user_id: timestamp})
+        else:
+            by_shard.setdefault(shard, {})[user_id] = timestamp
+    written = 0
+    failed: Optional[Exception] = None
+    unwritten = list(by_shard)
+    for shard, items in by_shard.items():
+        try:
+            async with db.shards[shard].acquire(timeout=settings.db_pool_acquire_timeout_seconds) as conn:
+                await conn.execute(query, list(items.keys()), list(items.values()))
+            written += len(items)
+            unwritten.remove(shard)
+        except Exception as exc:
+            requeue(items)
+            unwritten.remove(shard)
+            failed = exc
+        except BaseException:
+            for rest in unwritten:
+                requeue(by_shard[rest])
+            raise
+    if failed is not None:
+        raise failed
+    return written
+
+
+async def _last_seen_flusher(wakeup: asyncio.Event, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout=settings.last_seen_flush_interval_seconds)
+        except asyncio.TimeoutError:
+            pass
+        wakeup.clear()
+        try:
+            await flush_last_seen()
+        except Exception:
+            log.exception("event=last_seen_flush_failed pending={pending}", pending=len(_last_seen_pending))
+
+
+def start_last_seen_flusher() -> None:
+    """Запустить фоновую пакетную запись last_seen (вызывается на старте приложения)."""
+    if db.last_seen_task is not None:
+        return
+    db.last_seen_wakeup = asyncio.Event()
+    db.last_seen_stop = asyncio.Event()
+    db.last_seen_task = asyncio.create_task(_last_seen_flusher(db.last_seen_wakeup, db.last_seen_stop))
+
+
+async def stop_last_seen_flusher() -> None:
+    """Остановить flusher и дописать всё, что осталось в буфере."""
+    task, wakeup, stop = db.last_seen_task, db.last_seen_wakeup, db.last_seen_stop
+    if task is None:
+        return
+    db.last_seen_task = None
+    db.last_seen_wakeup = None
+    db.last_seen_stop = None
+    # не cancel: начатый flush дописывает пачку, цикл выходит после него
+    assert wakeup is not None and stop is not None
+    stop.set()
+    wakeup.set()
+    await task
+    if db.pool:
+        try:
+            await flush_last_seen()
+        except Exception:
+            log.exception("event=last_seen_flush_failed pending={pending}", pending=len(_last_seen_pending))
+    _last_seen_touched.clear()
+
+
+# Редактируемые поля проекта (порядок совпадает с колонками в INSERT/UPDATE)
+PROJECT_FIELDS = (
+    "name_ru",
+    "name_en",
+    "organization_ru",
+    "organization_en",
+    "direction",
+    "scope",
+    "focus",
+    "profile_type",
+    "specialization",
+)
+
+# Допустимые ключи сортировки и фильтры списка проектов (имена колонок — только из белого списка)
+PROJECT_SORT_KEYS = ("id", "created_at", "updated_at", "name_ru")
+PROJECT_FILTERS = ("direction", "scope", "focus", "profile_type")
+
+
+def _owner_conditions(owner_id: UUID, filters: Optional[Dict[str, str]]) -> Tuple[List[str], List[Any]]:
+    """WHERE-условия и параметры для проектов владельца с фильтрами по равенству."""
+    conditions = ["owner_id = $1"]
+    args: List[Any] = [owner_id]
+    for column, value in (filters or {}).items():
+        if column not in PROJECT_FILTERS:
+            raise ValueError(f"Unsupported filter: {column}")
+        args.append(value)
+        conditions.append(f"{column} = ${len(args)}")
+    return conditions, args
+
+
+@timed
+async def fetch_projects_page(
+    owner_id: UUID,
+    *,
+    limit: int,
+    sort: str = "id",
+    descending: bool = False,
+    after: Optional[Tuple[Any, int]] = None,
+    filters: Optional[Dict[str, str]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Страница проектов владельца (keyset-пагинация по паре (sort, id)).
+    after — ключ последней строки предыдущей страницы. Возвращает до limit строк.
+    """
+    if not db.pool:
+        raise RuntimeError("Database is not connected")
+    if sort not in PROJECT_SORT_KEYS:
+        raise ValueError(f"Unsupported sort key: {sort}")
+
+    # только первые страницы: листание большого аккаунта иначе заполнило бы кэш всеми страницами
+    cache_key = ("page", limit, sort, descending, tuple(sorted((filters or {}).items())))
+    cached = project_cache.get_list(owner_id, cache_key) if after is None else None
+    if cached is not None:
+        return cached
+    generation = project_cache.generation
+
+    conditions, args = _owner_conditions(owner_id, filters)
+
+    op = "<" if descending else ">"
+    if after is not None:
+        value, last_id = after
+        if sort == "id":
+            args.append(last_id)
+            conditions.append(f"id {op} ${len(args)}")
+        else:
+            args.extend([value, last_id])
+            conditions.append(f"({sort}, id) {op} (${len(args) - 1}, ${len(args)})")
+
+    order = "DESC" if descending else "ASC"
+    order_by = f"id {order}" if sort == "id" else f"{sort} {order}, id {order}"
+    args.append(limit)
+    query = f"""
+    SELECT id, name_ru, name_en, organization_ru, organization_en,
+           direction, scope, focus, profile_type, specialization,
+           created_at, updated_at
+    FROM projects
+    WHERE {" AND ".join(conditions)}
+    ORDER BY {order_by}
+    LIMIT ${len(args)};
+    """
+
+    async with _acquire(read_for=owner_id) as conn:
+        rows = await conn.fetch(query, *args)
+    page = [dict(row) for row in rows]
+    if after is None:
+        project_cache.set_list(owner_id, cache_key, page, generation)
+    return page
+
+
+@timed
+async def fetch_projects_stats(
+    owner_id: UUID, filters: Optional[Dict[str, str]] = None
+) -> Tuple[int, Optional[datetime]]:
+    """Число проектов владельца и max(updated_at) — для ETag/Last-Modified списка."""
+    if not db.pool:
+        raise RuntimeError("Database is not connected")
+
+    cache_key = ("stats", tuple(sorted((filters or {}).items())))
+    cached = project_cache.get_list(owner_id, cache_key)
+    if cached is not None:
+        return cached
+    generation = project_cache.generation
+
+    conditions, args = _owner_conditions(owner_id, filters)
+
+    query = f"""
+    SELECT count(*) AS total, max(updated_at) AS last_modified
+    FROM projects
+    WHERE {" AND ".join(conditions)};
+    """
+
+    async with _acquire(read_for=owner_id) as conn:
+        row = await conn.fetchrow(query, *args)
+    stats = (row["total"], row["last_modified"])
+    project_cache.set_list(owner_id, cache_key, stats, generation)
+    return stats
+
+
+@timed
+async def search_projects(
+    owner_id: UUID, text: str, *, limit: int, offset: int = 0
+) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Поиск по названиям, организациям и специализации с ранжированием.
+    Сначала полнотекстовый (ru + en стемминг); если совпадений нет — нечёткий по pg_trgm.
+    Возвращает (режим "fts" | "fuzzy", строки страницы).
+    """
     if not db.pool:
         raise RuntimeError("Database is not connected")
 
-    query = "UPDATE users SET last_seen = $2 WHERE id = $1;"
-    async with db.pool.acquire() as conn:
-        await conn.execute(query, user_id, timestamp)
+    columns = """
+    id, name_ru, name_en, organization_ru, organization_en,
+    direction, scope, focus, profile_type, specialization,
+    created_at, updated_at
+    """
+    fts_query = f"""
+    WITH q AS (
+        SELECT websearch_to_tsquery('russian', $2) || websearch_to_tsquery('english', $2) AS query
+    )
+    SELECT {columns}
+    FROM projects, q
+    WHERE owner_id = $1 AND {SEARCH_VECTOR_EXPR} @@ q.query
+    ORDER BY ts_rank_cd({SEARCH_VECTOR_EXPR}, q.query) DESC, id ASC
+    LIMIT $3 OFFSET $4;
+    """
+    fts_exists_query = f"""
+    SELECT EXISTS (
+        SELECT 1 FROM projects
+        WHERE owner_id = $1
+          AND {SEARCH_VECTOR_EXPR} @@ (websearch_to_tsquery('russian', $2) || websearch_to_tsquery('english', $2))
+    );
+    """
+    fuzzy_query = f"""
+    SELECT {columns}
+    FROM projects
+    WHERE owner_id = $1 AND $2 <% {SEARCH_TEXT_EXPR}
+    ORDER BY word_similarity($2, {SEARCH_TEXT_EXPR}) DESC, id ASC
+    LIMIT $3 OFFSET $4;
+    """
+
+    async with _acquire(read_for=owner_id) as conn:
+        if db.trigram_enabled is None:
+            db.trigram_enabled = await conn.fetchval(
+                "SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm');"
+            )
+        rows = await conn.fetch(fts_query, owner_id, text, limit, offset)
+        if rows or not db.trigram_enabled:
+            return "fts", [dict(row) for row in rows]
+        # пустая дальняя страница FTS — ещё не повод переключаться на нечёткий режим
+        if offset and await conn.fetchval(fts_exists_query, owner_id, text):
+            return "fts", []
+        rows = await conn.fetch(fuzzy_query, owner_id, text, limit, offset)
+        return "fuzzy", [dict(row) for row in rows]
 
 
-async def fetch_projects(owner_id: UUID) -> List[Dict[str, Any]]:
-    """Получить список проектов владельца."""
+@timed
+async def iter_projects(owner_id: UUID, prefetch: int = 500) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Потоково отдать все проекты владельца через серверный курсор.
+    Соединение и транзакция держатся, пока итерация не завершится или не будет закрыта.
+    """
     if not db.pool:
         raise RuntimeError("Database is not connected")
 
@@ -177,15 +836,21 @@ async def fetch_projects(owner_id: UUID) -> List[Dict[str, Any]]:
     ORDER BY id ASC;
     """
 
-    async with db.pool.acquire() as conn:
-        rows = await conn.fetch(query, owner_id)
-        return [dict(row) for row in rows]
+    async with _acquire(read_for=owner_id) as conn:
+        async with conn.transaction(readonly=True):
+            async for row in conn.cursor(query, owner_id, prefetch=prefetch):
+                yield dict(row)
 
 
+@timed
 async def fetch_project(project_id: int, owner_id: UUID) -> Optional[Dict[str, Any]]:
-    """Получить проект владельца по id."""
+    """Получить проект владельца по id (сначала из кэша воркера)."""
     if not db.pool:
         raise RuntimeError("Database is not connected")
+    cached = project_cache.get_project(owner_id, project_id)
+    if cached is not None:
+        return cached
+    generation = project_cache.generation
 
     query = """
     SELECT id, name_ru, name_en, organization_ru, organization_en,
@@ -195,15 +860,25 @@ async def fetch_project(project_id: int, owner_id: UUID) -> Optional[Dict[str, A
     WHERE id = $1 AND owner_id = $2;
     """
 
-    async with db.pool.acquire() as conn:
+    async with _acquire(read_for=owner_id) as conn:
         row = await conn.fetchrow(query, project_id, owner_id)
-        return dict(row) if row else None
+    if not row and db.replicas:
+        read_routing.inc(("primary_fallback",))
+        async with _acquire(primary_for=owner_id) as conn:
+            row = await conn.fetchrow(query, project_id, owner_id)
+    if not row:
+        return None
+    project = dict(row)
+    project_cache.set_project(owner_id, project, generation)
+    return project
 
 
+@timed
 async def create_project(data: Dict[str, Any], owner_id: UUID) -> Dict[str, Any]:
     """Создать проект для владельца."""
     if not db.pool:
         raise RuntimeError("Database is not connected")
+    _mark_write(owner_id)
 
     query = """
     INSERT INTO projects (
@@ -224,7 +899,7 @@ async def create_project(data: Dict[str, Any], owner_id: UUID) -> Dict[str, Any]
               created_at, updated_at;
     """
 
-    async with db.pool.acquire() as conn:
+    async with _acquire(primary_for=owner_id) as conn:
         row = await conn.fetchrow(
             query,
             owner_id,
@@ -238,87 +913,328 @@ async def create_project(data: Dict[str, Any], owner_id: UUID) -> Dict[str, Any]
             data.get("profile_type", ""),
             data.get("specialization", ""),
         )
-        return dict(row)
+    project_cache.invalidate(owner_id, [row["id"]], "local")
+    return dict(row)
 
 
-async def update_project(project_id: int, data: Dict[str, Any], owner_id: UUID) -> Optional[Dict[str, Any]]:
-    """Обновить проект владельца (перезапись полей)."""
-    if not db.pool:
-        raise RuntimeError("Database is not connected")
+class UpdateConflict(Exception):
+    """Проект изменился с момента, указанного клиентом (If-Match не совпал)."""
 
-    existing = await fetch_project(project_id, owner_id)
-    if not existing:
-        return None
 
-    updated = {
-        "name_ru": data.get("name_ru", existing["name_ru"]),
-        "name_en": data.get("name_en", existing["name_en"]),
-        "organization_ru": data.get("organization_ru", existing["organization_ru"]),
-        "organization_en": data.get("organization_en", existing["organization_en"]),
-        "direction": data.get("direction", existing["direction"]),
-        "scope": data.get("scope", existing.get("scope", "")),
-        "focus": data.get("focus", existing.get("focus", "")),
-        "profile_type": data.get("profile_type", existing.get("profile_type", "")),
-        "specialization": data.get("specialization", existing.get("specialization", "")),
-    }
+@timed
+async def update_project(
+    project_id: int,
+    data: Dict[str, Any],
+    owner_id: UUID,
+    expected_updated_at: Optional[datetime] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Частично обновить проект владельца одним UPDATE (None/отсутствие поля = не менять).
+    Если задан expected_updated_at, строка обновится только при совпадении updated_at;
+    иначе — UpdateConflict. Возвращает None, если проекта нет.
+    """
+    if not db.pool:
+        raise RuntimeError("Database is not connected")
+    _mark_write(owner_id)
 
-    query = """
+    assignments = ",\n        ".join(
+        f"{field} = COALESCE(${index}, {field})" for index, field in enumerate(PROJECT_FIELDS, start=3)
+    )
+    version_param = len(PROJECT_FIELDS) + 3
+    query = f"""
     UPDATE projects
     SET
-        owner_id = $1,
-        name_ru = $2,
-        name_en = $3,
-        organization_ru = $4,
-        organization_en = $5,
-        direction = $6,
-        scope = $7,
-        focus = $8,
-        profile_type = $9,
-        specialization = $10,
+        {assignments},
         updated_at = NOW()
-    WHERE id = $11 AND owner_id = $1
+    WHERE id = $1 AND owner_id = $2
+      AND (${version_param}::timestamptz IS NULL OR updated_at = ${version_param})
     RETURNING id, owner_id, name_ru, name_en, organization_ru, organization_en,
               direction, scope, focus, profile_type, specialization,
               created_at, updated_at;
     """
 
-    async with db.pool.acquire() as conn:
+    async with _acquire(primary_for=owner_id) as conn:
         row = await conn.fetchrow(
             query,
-            owner_id,
-            updated["name_ru"],
-            updated["name_en"],
-            updated["organization_ru"],
-            updated["organization_en"],
-            updated["direction"],
-            updated["scope"],
-            updated["focus"],
-            updated["profile_type"],
-            updated["specialization"],
             project_id,
+            owner_id,
+            *(data.get(field) for field in PROJECT_FIELDS),
+            expected_updated_at,
         )
-        return dict(row) if row else None
+        if row:
+            project_cache.invalidate(owner_id, [project_id], "local")
+            return dict(row)
+        if expected_updated_at is None:
+            return None
+        # редкий путь: отличаем «нет проекта» от «версия устарела»
+        exists = await conn.fetchval(
+            "SELECT 1 FROM projects WHERE id = $1 AND owner_id = $2;", project_id, owner_id
+        )
+    if exists:
+        raise UpdateConflict(project_id)
+    return None
+
+
+@timed
+async def bulk_apply_projects(
+    owner_id: UUID,
+    creates: List[Dict[str, Any]],
+    updates: List[Tuple[int, Dict[str, Any]]],
+) -> Tuple[List[int], List[int]]:
+    """
+    Пакетно создать и обновить проекты владельца в одной транзакции.
+    Новые строки пишутся бинарным COPY с заранее выданными id, обновления идут
+    через временную staging-таблицу одним UPDATE ... FROM (None = поле не меняется).
+    Возвращает (id созданных в порядке creates, id реально обновлённых).
+    """
+    if not db.pool:
+        raise RuntimeError("Database is not connected")
+    _mark_write(owner_id)
+
+    created_ids: List[int] = []
+    updated_ids: List[int] = []
+    async with _acquire(primary_for=owner_id) as conn:
+        async with conn.transaction():
+            if creates:
+                created_ids = [
+                    row["id"]
+                    for row in await conn.fetch(
+                        "SELECT nextval(pg_get_serial_sequence('projects', 'id')) AS id "
+                        "FROM generate_series(1, $1);",
+                        len(creates),
+                    )
+                ]
+                await conn.copy_records_to_table(
+                    "projects",
+                    columns=("id", "owner_id", *PROJECT_FIELDS),
+                    records=[
+                        (project_id, owner_id, *(data.get(field) or "" for field in PROJECT_FIELDS))
+                        for project_id, data in zip(created_ids, creates)
+                    ],
+                )
+
+            if updates:
+                # повторяющиеся id схлопываем: более поздние поля перекрывают ранние
+                merged: Dict[int, Dict[str, Any]] = {}
+                for project_id, data in updates:
+                    merged.setdefault(project_id, {}).update(
+                        {key: value for key, value in data.items() if value is not None}
+                    )
 
+                stage_columns = ", ".join(f"{field} TEXT" for field in PROJECT_FIELDS)
+                await conn.execute(
+                    f"CREATE TEMP TABLE projects_bulk_stage (id INTEGER PRIMARY KEY, {stage_columns}) "
+                    "ON COMMIT DROP;"
+                )
+                await conn.copy_records_to_table(
+                    "projects_bulk_stage",
+                    columns=("id", *PROJECT_FIELDS),
+                    records=[
+                        (project_id, *(data.get(field) for field in PROJECT_FIELDS))
+                        for project_id, data in merged.items()
+                    ],
+                )
+                assignments = ",\n        ".join(
+                    f"{field} = COALESCE(s.{field}, p.{field})" for field in PROJECT_FIELDS
+                )
+                rows = await conn.fetch(
+                    f"""
+                    UPDATE projects AS p
+                    SET
+                        {assignments},
+                        updated_at = NOW()
+                    FROM projects_bulk_stage AS s
+                    WHERE p.id = s.id AND p.owner_id = $1
+                    RETURNING p.id;
+                    """,
+                    owner_id,
+                )
+                updated_ids = [row["id"] for row in rows]
 
+    if created_ids or updated_ids:
+        project_cache.invalidate(owner_id, updated_ids, "local")
+    return created_ids, updated_ids
+
+
+@timed
 async def delete_project(project_id: int, owner_id: UUID) -> bool:
     """Удалить проект владельца."""
     if not db.pool:
         raise RuntimeError("Database is not connected")
+    _mark_write(owner_id)
 
     query = "DELETE FROM projects WHERE id = $1 AND owner_id = $2;"
 
-    async with db.pool.acquire() as conn:
+    async with _acquire(primary_for=owner_id) as conn:
         result = await conn.execute(query, project_id, owner_id)
-        return result.endswith("DELETE 1")
+    project_cache.invalidate(owner_id, [project_id], "local")
+    return result.endswith("DELETE 1")
 
 
-async def delete_user_and_projects(user_id: UUID) -> bool:
-    """Каскадно удалить пользователя и все его проекты (при удалении аккаунта)."""
+@timed
+async def mark_user_deleted(user_id: UUID) -> bool:
+    """
+    Удаление аккаунта: пометить deleted_at и освободить ник — одно короткое UPDATE.
+    Проекты и саму строку пользователя удаляет фоновый purger пачками.
+    """
     if not db.pool:
         raise RuntimeError("Database is not connected")
+    _mark_write(user_id)
 
-    async with db.pool.acquire() as conn:
-        async with conn.transaction():
-            await conn.execute("DELETE FROM projects WHERE owner_id = $1;", user_id)
-            result = await conn.execute("DELETE FROM users WHERE id = $1;", user_id)
-            return result.endswith("DELETE 1")
+    user_cache.invalidate(user_id)
+    # NOTIFY в той же транзакции: остальные воркеры выкинут пользователя из user_cache
+    query = """
+    WITH deleted AS (
+        UPDATE users
+        SET deleted_at = now(), nickname = $2 || id::text
+        WHERE id = $1 AND deleted_at IS NULL
+        RETURNING id
+    )
+    SELECT pg_notify('project_changes', json_build_object(
+        'op', 'account_deleted',
+        'owner_id', id,
+        'ids', NULL,
+        'at', extract(epoch FROM clock_timestamp())
+    )::text)
+    FROM deleted;
+    """
+    async with _acquire(primary_for=user_id) as conn:
+        deleted = await conn.fetch(query, user_id, DELETED_NICKNAME_PREFIX)
+    if db.shards:
+        async with _acquire() as conn:
+            await conn.execute("DELETE FROM user_directory WHERE user_id = $1;", user_id)
+        placement_cache.invalidate(user_id)
+    # повторно — на случай, если параллельный запрос успел закэшировать пользователя
+    user_cache.invalidate(user_id)
+    if db.purge_wakeup is not None:
+        db.purge_wakeup.set()
+    return bool(deleted)
+
+
+async def _purge_account(pool: asyncpg.Pool, user_id: UUID) -> int:
+    """Удалить проекты помеченного пользователя пачками, затем его самого. Возвращает число проектов."""
+    # ctid = ANY(ARRAY(...)) даёт TID Scan по выбранным строкам (ctid IN (SELECT ...) планируется
+    # соединением); SKIP LOCKED — воркеры, чистящие одного владельца, берут разные строки
+    batch_query = """
+    DELETE FROM projects
+    WHERE ctid = ANY(ARRAY(
+        SELECT ctid FROM projects WHERE owner_id = $1 LIMIT $2 FOR UPDATE SKIP LOCKED
+    ));
+    """
+    total = 0
+    while True:
+        started = perf_counter()
+        async with pool.acquire(timeout=settings.db_pool_acquire_timeout_seconds) as conn:
+            result = await conn.execute(batch_query, user_id, settings.account_purge_batch_size)
+        deleted = int(result.split()[-1])
+        account_purge_batch_duration.observe((), perf_counter() - started)
+        account_purge_projects.inc((), deleted)
+        total += deleted
+        if deleted < settings.account_purge_batch_size:
+            break
+        # пауза между пачками: не занимать пул и диск подряд
+        await asyncio.sleep(settings.account_purge_pause_seconds)
+
+    # оставшееся (вставленное запросом, который был в полёте) удалит ON DELETE CASCADE
+    async with pool.acquire(timeout=settings.db_pool_acquire_timeout_seconds) as conn:
+        result = await conn.execute("DELETE FROM users WHERE id = $1 AND deleted_at IS NOT NULL;", user_id)
+    if result.endswith("DELETE 1"):
+        account_purge_accounts.inc()
+    project_cache.invalidate(user_id, None, "local")
+    return total
+
+
+async def purge_deleted_accounts() -> int:
+    """Один проход purger'а по всем базам с данными. Возвращает число дочищенных аккаунтов."""
+    purged = 0
+    pending = 0
+    oldest: Optional[datetime] = None
+    query = """
+    SELECT id, deleted_at FROM users
+    WHERE deleted_at IS NOT NULL
+    ORDER BY deleted_at
+    LIMIT $1;
+    """
+    # отдельный подсчёт: строк в выборке не больше PURGE_ACCOUNTS_PER_PASS, а очередь может быть длиннее
+    backlog_query = "SELECT count(*) AS pending, min(deleted_at) AS oldest FROM users WHERE deleted_at IS NOT NULL;"
+    for pool in db.shards or [db.pool]:
+        assert pool is not None
+        async with pool.acquire(timeout=settings.db_pool_acquire_timeout_seconds) as conn:
+            rows = await conn.fetch(query, PURGE_ACCOUNTS_PER_PASS)
+        for row in rows:
+            started = perf_counter()
+            projects = await _purge_account(pool, row["id"])
+            purged += 1
+            log.info(
+                "event=account_purged user_id={user_id} projects={projects} dur={dur:.2f}s",
+                user_id=row["id"],
+                projects=projects,
+                dur=perf_counter() - started,
+            )
+        async with pool.acquire(timeout=settings.db_pool_acquire_timeout_seconds) as conn:
+            backlog = await conn.fetchrow(backlog_query)
+        pending += backlog["pending"]
+        if backlog["oldest"] is not None and (oldest is None or backlog["oldest"] < oldest):
+            oldest = backlog["oldest"]
+    _purge_state.pending = pending
+    _purge_state.oldest = oldest
+    return purged
+
+
+async def _account_purger() -> None:
+    assert db.purge_wakeup is not None
+    while True:
+        try:
+            await asyncio.wait_for(db.purge_wakeup.wait(), timeout=settings.account_purge_interval_seconds)
+        except asyncio.TimeoutError:
+            pass
+        db.purge_wakeup.clear()
+        try:
+            # пока находятся аккаунты — следующий проход сразу
+            while await purge_deleted_accounts() >= PURGE_ACCOUNTS_PER_PASS:
+                pass
+        except Exception:
+            log.exception("event=account_purge_failed")
+
+
+def start_account_purger() -> None:
+    """Запустить фоновое удаление помеченных аккаунтов (вызывается на старте приложения)."""
+    if db.purge_task is not None:
+        return
+    db.purge_wakeup = asyncio.Event()
+    db.purge_task = asyncio.create_task(_account_purger())
+
+
+async def stop_account_purger() -> None:
+    task = db.purge_task
+    if task is None:
+        return
+    db.purge_task = None
+    db.purge_wakeup = None
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+@timed
+async def rate_limit_take(key: str, rate: float, burst: int) -> float:
+    """Взять токен из общего ведра (app/ratelimit.py): 0 — можно, иначе секунды до следующего."""
+    if not db.pool:
+        raise RuntimeError("Database is not connected")
+
+    async with _acquire() as conn:
+        return await conn.fetchval("SELECT rate_limit_take($1, $2, $3);", key, rate, float(burst))
+
+
+@timed
+async def purge_rate_limit_buckets(max_idle_seconds: float) -> int:
+    """Удалить вёдра, не тронутые дольше max_idle_seconds (они уже полные)."""
+    if not db.pool:
+        raise RuntimeError("Database is not connected")
+
+    query = "DELETE FROM rate_limit_buckets WHERE updated_at < extract(epoch FROM clock_timestamp()) - $1;"
+    async with _acquire() as conn:
+        result = await conn.execute(query, max_idle_seconds)
+    return int(result.split()[-1])
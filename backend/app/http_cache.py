@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+from collections import Counter
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Optional
+
+from fastapi import Request, Response, status
+
+from . import metrics
+
+CACHE_CONTROL = "private, no-cache"
+
+# Ответы условных GET по маршрутам: (route, status) -> количество
+conditional_responses: Counter = Counter()
+
+
+def http_date(value: datetime) -> str:
+    return format_datetime(value.astimezone(timezone.utc).replace(microsecond=0), usegmt=True)
+
+
+def validator_headers(etag: str, last_modified: Optional[datetime]) -> Dict[str, str]:
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # для If-None-Match сравнение слабое: W/ игнорируем
+    candidates = (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    return etag.removeprefix("W/") in candidates
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime]) -> bool:
+    """Проверить If-None-Match, а при его отсутствии — If-Modified-Since (RFC 9110)."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return last_modified.replace(microsecond=0) <= since
+
+
+def not_modified(route: str, headers: Dict[str, str], sub_response: Optional[Response] = None) -> Response:
+    """
+    304 без тела. Cookie и заголовки, выставленные зависимостями на sub_response (скользящая
+    сессия из get_current_user), переносятся — иначе клиент, опрашивающий только с
+    If-None-Match, разлогинился бы по истечении cookie.
+    """
+    conditional_responses[(route, status.HTTP_304_NOT_MODIFIED)] += 1
+    response = Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if sub_response is not None:
+        response.raw_headers.extend(
+            (name, value) for name, value in sub_response.raw_headers if name != b"content-length"
+        )
+    return response
+
+
+def modified(route: str, response: Response, headers: Dict[str, str]) -> None:
+    conditional_responses[(route, status.HTTP_200_OK)] += 1
+    response.headers.update(headers)
+
+
+def _collect_conditional_metrics():
+    yield (
+        "http_conditional_responses_total",
+        "counter",
+        "Conditional GET outcomes (200 vs 304) per route.",
+        [((route, code), count) for (route, code), count in conditional_responses.items()],
+        ("route", "status"),
+    )
+
+
+metrics.register_collector(_collect_conditional_metrics)
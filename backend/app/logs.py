@@ -0,0 +1,241 @@
+"""
+Настройка loguru. Вызывается один раз в каждом процессе-воркере (на старте приложения),
+а не при импорте app.main: импорт ничего не должен делать с глобальными sink'ами.
+
+log_format=text — цветной формат в stdout (разработка). log_format=json — JSON lines:
+запись сериализуется в вызывающем потоке и кладётся в очередь, фоновый поток пишет пачками
+в stdout или в файл с ротацией по размеру. Сэмплирование по типу события (первое слово
+сообщения, «event=...») отбрасывает запись до форматирования; warning и выше и события из
+ALWAYS_KEEP_EVENTS пишутся всегда.
+"""
+from __future__ import annotations
+
+import os
+import random
+import sys
+import threading
+import traceback
+from collections import deque
+from typing import Any, BinaryIO, Deque, Dict, List, Optional
+
+import orjson
+from loguru import logger
+
+from . import metrics
+from .config import settings
+
+LOG_FORMAT = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | "
+    "req={extra[req]} user={extra[user]} nick={extra[nick]} | {message}"
+)
+
+# Эти события не сэмплируются никогда (аудит)
+ALWAYS_KEEP_EVENTS = frozenset({"account_deleted"})
+WARNING_LEVEL = 30
+
+FLUSH_INTERVAL_SECONDS = 0.5
+BATCH_SIZE = 512
+
+log_events_dropped = metrics.counter(
+    "log_events_dropped_total",
+    "Log records not written: sampled out, access log of a skipped path, or JSON sink queue full.",
+    ("event", "reason"),
+)
+
+
+def event_name(message: str) -> str:
+    """«event=projects_listed count=3» -> projects_listed; «request method=...» -> request."""
+    head = message.split(" ", 1)[0]
+    return head[6:] if head.startswith("event=") else head
+
+
+def parse_sample_rates(raw: str) -> Dict[str, float]:
+    """«projects_listed=0.01,project_read=0.1» -> {событие: доля сохраняемых записей}."""
+    rates = {}
+    for part in raw.split(","):
+        name, _, value = part.partition("=")
+        if name.strip():
+            rates[name.strip()] = min(1.0, max(0.0, float(value)))
+    return rates
+
+
+class Sampler:
+    """loguru-фильтр: оставить долю rate записей события, остальные посчитать как sampled."""
+
+    def __init__(self, rates: Dict[str, float]) -> None:
+        self.rates = {name: rate for name, rate in rates.items() if name not in ALWAYS_KEEP_EVENTS}
+
+    def __call__(self, record: Dict[str, Any]) -> bool:
+        if not self.rates or record["level"].no >= WARNING_LEVEL:
+            return True
+        event = event_name(record["message"])
+        rate = self.rates.get(event)
+        if rate is None or random.random() < rate:
+            return True
+        log_events_dropped.inc((event, "sampled"))
+        return False
+
+
+class JsonLinesSink:
+    """
+    Stream-sink для loguru (write/stop). На горячем пути — orjson и append в deque;
+    если писатель не успевает и очередь полна, запись отбрасывается (счётчик queue_full),
+    а не блокирует event loop.
+    """
+
+    def __init__(self, path: str, max_bytes: int, backups: int, queue_size: int) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = max(1, backups)
+        self.queue_size = queue_size
+        self.queue: Deque[bytes] = deque()
+        self.written = 0
+        self.closed = False
+        self.file: Optional[BinaryIO] = open(path, "ab") if path else None
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self.thread.start()
+
+    # --- вызывающий поток ---
+
+    def write(self, message: Any) -> None:
+        record = message.record
+        if len(self.queue) >= self.queue_size:
+            log_events_dropped.inc((event_name(record["message"]), "queue_full"))
+            return
+        self.queue.append(self._serialize(record))
+        if len(self.queue) >= BATCH_SIZE:
+            with self.condition:
+                self.condition.notify()
+
+    @staticmethod
+    def _serialize(record: Dict[str, Any]) -> bytes:
+        message = record["message"]
+        data = {
+            "ts": record["time"].isoformat(timespec="milliseconds"),
+            "level": record["level"].name,
+            "event": event_name(message),
+        }
+        # extra: req/user/nick из bind и аргументы форматирования сообщения (capture loguru)
+        for key, value in record["extra"].items():
+            data.setdefault(key, value)
+        data["msg"] = message
+        if record["exception"] is not None:
+            data["exc"] = "".join(traceback.format_exception(*record["exception"]))
+        return orjson.dumps(data, default=str) + b"\n"
+
+    def stop(self) -> None:
+        """Вызывается loguru при logger.remove(): дописать очередь и закрыть файл."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join(timeout=5)
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    # --- поток записи ---
+
+    def _run(self) -> None:
+        while True:
+            with self.condition:
+                if not self.queue and not self.closed:
+                    self.condition.wait(FLUSH_INTERVAL_SECONDS)
+            batch: List[bytes] = []
+            while self.queue and len(batch) < BATCH_SIZE * 4:
+                batch.append(self.queue.popleft())
+            if batch:
+                self._write(b"".join(batch))
+                self.written += len(batch)
+            elif self.closed:
+                return
+
+    def _write(self, chunk: bytes) -> None:
+        try:
+            if self.file is None:
+                sys.stdout.buffer.write(chunk)
+                sys.stdout.buffer.flush()
+                return
+            self.file.write(chunk)
+            self.file.flush()
+            if os.fstat(self.file.fileno()).st_size >= self.max_bytes:
+                self._rotate()
+        except OSError:
+            # логирование не должно ронять воркер; потерянные строки видны по log_events_written
+            traceback.print_exc(file=sys.stderr)
+
+    def _rotate(self) -> None:
+        assert self.file is not None
+        ours = os.fstat(self.file.fileno()).st_ino
+        self.file.close()
+        try:
+            # файл общий для воркеров: если его уже повернул другой, просто переоткрываем
+            if os.stat(self.path).st_ino == ours:
+                for index in range(self.backups - 1, 0, -1):
+                    if os.path.exists(f"{self.path}.{index}"):
+                        os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+                os.replace(self.path, f"{self.path}.1")
+        except FileNotFoundError:
+            pass
+        self.file = open(self.path, "ab")
+
+
+class _LoggingState:
+    configured: bool = False
+    json_sink: Optional[JsonLinesSink] = None
+
+
+_state = _LoggingState()
+
+
+def configure_logging(force: bool = False) -> None:
+    """Заменить sink'и loguru согласно настройкам; повторный вызов ничего не делает."""
+    if _state.configured and not force:
+        return
+    logger.remove()
+    # значения extra по умолчанию — для записей, у которых нет контекста запроса
+    logger.configure(extra={"req": "-", "user": "-", "nick": "-"})
+    sampler = Sampler(parse_sample_rates(settings.log_sample_rates))
+    if settings.log_format == "json":
+        _state.json_sink = JsonLinesSink(
+            settings.log_file,
+            settings.log_file_max_bytes,
+            settings.log_file_backups,
+            settings.log_queue_size,
+        )
+        # format-функция возвращает пустой шаблон: строку loguru не собирает, sink берёт record
+        logger.add(_state.json_sink, format=lambda record: "", filter=sampler, colorize=False)
+    else:
+        rotation = {"rotation": settings.log_file_max_bytes, "retention": settings.log_file_backups} if settings.log_file else {}
+        logger.add(
+            settings.log_file or sys.stdout,
+            format=LOG_FORMAT,
+            filter=sampler,
+            enqueue=True,
+            backtrace=False,
+            diagnose=False,
+            **rotation,
+        )
+    _state.configured = True
+
+
+def shutdown_logging() -> None:
+    """Дописать буферы sink'ов при остановке воркера."""
+    logger.remove()
+    _state.json_sink = None
+    _state.configured = False
+
+
+def _collect_log_metrics():
+    sink = _state.json_sink
+    yield (
+        "log_events_written_total",
+        "counter",
+        "Log lines written by the JSON sink.",
+        [((), sink.written if sink else 0)],
+        (),
+    )
+    yield "log_queue_depth", "gauge", "Lines waiting for the JSON log writer thread.", [((), len(sink.queue) if sink else 0)], ()
+
+
+metrics.register_collector(_collect_log_metrics)
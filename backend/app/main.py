@@ -1,61 +1,106 @@
 import secrets
-import sys
-from time import perf_counter
+from time import perf_counter, time
 
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import cookie_parser
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from loguru import logger
 
-from . import auth, db
+from . import auth, db, metrics, shards, storage
+from .admission import AdmissionMiddleware, service_unavailable, shed_requests
+from .config import settings
+from .logs import configure_logging, log_events_dropped, shutdown_logging
+from .passwords import hasher
 from .routes.auth import router as auth_router
 from .routes.projects import router as projects_router
 
-# Configure loguru with defaults for extra fields
-logger.remove()
 logger = logger.bind(req="-", user="-", nick="-")
-logger.add(
-    sys.stdout,
-    format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | "
-    "req={extra[req]} user={extra[user]} nick={extra[nick]} | {message}",
-    enqueue=True,
-    backtrace=False,
-    diagnose=False,
-)
 
+SAFE_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+# access-лог этих путей не пишется вовсе (пробы балансировщика), только считается
+SKIP_LOG_PATHS = frozenset(path.strip() for path in settings.log_skip_paths.split(",") if path.strip())
 
-class RequestLoggingMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
-        start = perf_counter()
-        req_id = secrets.token_hex(4)
-        request.state.req_id = req_id
 
-        raw_cookie = request.cookies.get(auth.COOKIE_NAME)
-        user_id = auth.verify_cookie_value(raw_cookie) if raw_cookie else None
-        uid = str(user_id) if user_id else "-"
+class RequestLoggingMiddleware:
+    """
+    Чистый ASGI middleware: без BaseHTTPMiddleware (лишняя задача и обёртка потока на
+    каждый запрос, ломает стриминг). Cookie проверяется здесь один раз, результат
+    кладётся в scope["state"] и переиспользуется auth-зависимостями.
+    """
 
-        bound = logger.bind(req=req_id, user=uid, nick="-")
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = perf_counter()
+        req_id = secrets.token_hex(4)
+        user_id = None
+        pin = None
+        for name, value in scope["headers"]:
+            if name == b"cookie":
+                cookies = cookie_parser(value.decode("latin-1"))
+                raw_cookie = cookies.get(auth.COOKIE_NAME)
+                user_id = auth.verify_cookie_value(raw_cookie) if raw_cookie else None
+                pin = cookies.get(auth.PRIMARY_PIN_COOKIE)
+                break
+        # read-your-writes между воркерами: запись могла пройти через другой воркер
+        if pin and user_id and db.db.replicas:
+            until = auth.verify_primary_pin(pin, user_id)
+            if until is not None:
+                db.pin_primary(user_id, until - time())
+        pin_writes = bool(user_id and db.db.replicas and scope["method"] not in SAFE_METHODS)
+        state = scope.setdefault("state", {})
+        state["req_id"] = req_id
+        state[auth.AUTH_STATE_KEY] = user_id
+
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if pin_writes and status_code < 400:
+                    headers = list(message.get("headers", ()))
+                    headers.append((b"set-cookie", auth.primary_pin_header(user_id, time())))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        bound = logger.bind(req=req_id, user=str(user_id) if user_id else "-", nick="-")
         try:
-            response = await call_next(request)
-            status_code = response.status_code
-            return response
+            await self.app(scope, receive, send_wrapper)
         except Exception:
             status_code = 500
             bound.exception(
                 "unhandled_error method={method} path={path}",
-                method=request.method,
-                path=request.url.path,
+                method=scope["method"],
+                path=scope["path"],
             )
             raise
         finally:
             duration = perf_counter() - start
-            bound.info(
-                "request method={method} path={path} status={status} dur={duration:.3f}s",
-                method=request.method,
-                path=request.url.path,
-                status=status_code,
-                duration=duration,
+            # шаблон маршрута, а не сырой путь — иначе кардинальность метрик не ограничена
+            route = scope.get("route")
+            metrics.http_request_duration.observe(
+                (getattr(route, "path", "unmatched"), scope["method"], status_code),
+                duration,
             )
+            if scope["path"] in SKIP_LOG_PATHS and status_code < 500:
+                log_events_dropped.inc(("request", "skipped_path"))
+            else:
+                bound.info(
+                    "request method={method} path={path} status={status} dur={duration:.3f}s",
+                    method=scope["method"],
+                    path=scope["path"],
+                    status=status_code,
+                    duration=duration,
+                )
 
 
 app = FastAPI(title="Project Manager API", version="0.1.0")
@@ -65,24 +110,57 @@ allowed_origins = [
     "http://127.0.0.1:3000",
 ]
 
+# Порядок: логирование -> CORS -> admission -> роутеры (add_middleware добавляет снаружи).
+# CORS снаружи admission, чтобы браузер видел 503, а не ошибку CORS.
+app.add_middleware(
+    AdmissionMiddleware,
+    max_concurrent=settings.max_concurrent_requests,
+    target_wait=settings.admission_target_wait_seconds,
+    # SSE-поток держит соединение часами и занимал бы слот admission всё это время
+    exempt_paths=("/health", "/metrics", "/api/projects/stream"),
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allowed_origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Search-Mode", "ETag", "Last-Modified"],
 )
 app.add_middleware(RequestLoggingMiddleware)
 
 
+@app.exception_handler(db.PoolTimeout)
+async def pool_timeout_handler(request, exc):
+    shed_requests.inc(("pool_timeout",))
+    return service_unavailable()
+
+
+@app.exception_handler(shards.ShardMoving)
+async def shard_moving_handler(request, exc):
+    shed_requests.inc(("shard_moving",))
+    return service_unavailable()
+
+
 @app.on_event("startup")
 async def on_startup() -> None:
-    await db.connect_to_db()
+    # здесь, а не при импорте: так sink настраивается в каждом воркере app.serve
+    configure_logging()
+    await storage.backend.startup()
+    metrics.start_loop_lag_monitor()
 
 
 @app.on_event("shutdown")
 async def on_shutdown() -> None:
-    await db.close_db()
+    await metrics.stop_loop_lag_monitor()
+    await storage.backend.shutdown()
+    hasher.shutdown()
+    shutdown_logging()
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint() -> PlainTextResponse:
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 
 @app.get("/health")
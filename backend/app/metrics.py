@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import inspect
+from bisect import bisect_left
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Метрики живут в памяти воркера и обновляются только из event loop,
+# поэтому на горячем пути нет блокировок: observe — это bisect и пара сложений.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+LOOP_LAG_INTERVAL_SECONDS = 0.5
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[Any, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [счётчики по корзинам (+Inf последней), сумма]
+        self._series: Dict[Tuple[Any, ...], List[Any]] = {}
+
+    def observe(self, labels: Tuple[Any, ...], value: float) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[Any, ...], float] = {}
+
+    def inc(self, labels: Tuple[Any, ...] = (), amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+# Коллекторы отдают снимок состояния на момент запроса /metrics:
+# (имя, тип, help, [(labels, значение)], имена labels)
+Sample = Tuple[str, str, str, List[Tuple[Tuple[Any, ...], float]], Tuple[str, ...]]
+_collectors: List[Callable[[], Iterable[Sample]]] = []
+_histograms: List[Histogram] = []
+_counters: List[Counter] = []
+
+
+def histogram(name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+    metric = Histogram(name, help, labelnames, buckets)
+    _histograms.append(metric)
+    return metric
+
+
+def counter(name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+    metric = Counter(name, help, labelnames)
+    _counters.append(metric)
+    return metric
+
+
+def register_collector(collector: Callable[[], Iterable[Sample]]) -> None:
+    _collectors.append(collector)
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in (*_histograms, *_counters):
+        lines.extend(metric.render())
+    for collector in _collectors:
+        for name, kind, help, samples, labelnames in collector():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_labels(labelnames, labels)} {_number(value)}")
+    lines.append("")
+    return "\n".join(lines)
+
+
+http_request_duration = histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template, method and status.",
+    ("route", "method", "status"),
+)
+db_query_duration = histogram(
+    "db_query_duration_seconds",
+    "Duration of app.db coroutines.",
+    ("function",),
+    DB_BUCKETS,
+)
+db_pool_acquire_duration = histogram(
+    "db_pool_acquire_seconds",
+    "Time spent waiting for a pooled connection.",
+    (),
+    DB_BUCKETS,
+)
+event_loop_lag = histogram(
+    "event_loop_lag_seconds",
+    "Delay between scheduled and actual wake-up of the lag probe.",
+    (),
+    DB_BUCKETS,
+)
+
+
+def timed(func: Callable[..., Any]) -> Callable[..., Any]:
+    """Замерять время корутины (или полного прохода async-генератора) app.db."""
+    labels = (func.__name__,)
+
+    if inspect.isasyncgenfunction(func):
+
+        @functools.wraps(func)
+        async def gen_wrapper(*args: Any, **kwargs: Any) -> Any:
+            started = perf_counter()
+            try:
+                async for item in func(*args, **kwargs):
+                    yield item
+            finally:
+                db_query_duration.observe(labels, perf_counter() - started)
+
+        return gen_wrapper
+
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        started = perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            db_query_duration.observe(labels, perf_counter() - started)
+
+    return wrapper
+
+
+class _LoopLagMonitor:
+    task: Optional[asyncio.Task] = None
+
+
+_loop_lag = _LoopLagMonitor()
+
+
+async def _probe_loop_lag() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + LOOP_LAG_INTERVAL_SECONDS
+        await asyncio.sleep(LOOP_LAG_INTERVAL_SECONDS)
+        event_loop_lag.observe((), max(0.0, loop.time() - expected))
+
+
+def start_loop_lag_monitor() -> None:
+    if _loop_lag.task is None:
+        _loop_lag.task = asyncio.create_task(_probe_loop_lag())
+
+
+async def stop_loop_lag_monitor() -> None:
+    task, _loop_lag.task = _loop_lag.task, None
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
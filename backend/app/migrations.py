@@ -0,0 +1,480 @@
+"""
+Версионные миграции схемы.
+
+Каждый шаг — упорядоченный набор SQL с контрольной суммой. Применённые шаги пишутся
+в schema_migrations; изменять уже выпущенный шаг нельзя (сработает проверка checksum) —
+только добавлять новый в конец списка.
+
+Запуск перед деплоем: python -m app.migrations  (или --check, чтобы только сверить версию).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import re
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import asyncpg
+from loguru import logger
+
+# Ключ pg_advisory_lock: миграции выполняет только один процесс одновременно
+ADVISORY_LOCK_KEY = 7_201_001
+# Пауза между попытками взять блокировку. Ждём не внутри pg_advisory_lock: ожидающий оператор
+# держит снимок, и CREATE INDEX CONCURRENTLY у владельца блокировки ждал бы его вечно
+LOCK_RETRY_SECONDS = 0.5
+CONCURRENT_INDEX_RE = re.compile(r"CREATE\s+INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE)
+
+log = logger.bind(req="-", user="-", nick="-")
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    statements: Tuple[str, ...]
+    # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+    transactional: bool = True
+    # ошибка не останавливает миграцию (например, нет прав на CREATE EXTENSION)
+    optional: bool = False
+
+    @property
+    def checksum(self) -> str:
+        return hashlib.sha256("\n".join(self.statements).encode()).hexdigest()
+
+
+# Первые шаги повторяют прежний init_db и идемпотентны (IF NOT EXISTS),
+# поэтому их можно накатить и на базу, созданную старой версией.
+MIGRATIONS: Tuple[Migration, ...] = (
+    Migration(
+        1,
+        "base_schema",
+        (
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                id UUID PRIMARY KEY,
+                nickname TEXT UNIQUE NOT NULL,
+                password_hash TEXT DEFAULT '',
+                created_at TIMESTAMPTZ DEFAULT NOW(),
+                last_seen TIMESTAMPTZ DEFAULT NOW()
+            );
+            """,
+            "ALTER TABLE users ADD COLUMN IF NOT EXISTS password_hash TEXT DEFAULT '';",
+            "CREATE UNIQUE INDEX IF NOT EXISTS users_nickname_lower_idx ON users (lower(nickname));",
+            """
+            CREATE TABLE IF NOT EXISTS projects (
+                id SERIAL PRIMARY KEY,
+                owner_id UUID REFERENCES users(id),
+                name_ru TEXT NOT NULL,
+                name_en TEXT DEFAULT '',
+                organization_ru TEXT DEFAULT '',
+                organization_en TEXT DEFAULT '',
+                direction TEXT DEFAULT '',
+                scope TEXT DEFAULT '',
+                focus TEXT DEFAULT '',
+                profile_type TEXT DEFAULT '',
+                specialization TEXT DEFAULT '',
+                created_at TIMESTAMPTZ DEFAULT NOW(),
+                updated_at TIMESTAMPTZ DEFAULT NOW()
+            );
+            """,
+            "ALTER TABLE projects ADD COLUMN IF NOT EXISTS scope TEXT DEFAULT '';",
+            "ALTER TABLE projects ADD COLUMN IF NOT EXISTS focus TEXT DEFAULT '';",
+            "ALTER TABLE projects ADD COLUMN IF NOT EXISTS profile_type TEXT DEFAULT '';",
+            "ALTER TABLE projects ADD COLUMN IF NOT EXISTS specialization TEXT DEFAULT '';",
+            "ALTER TABLE projects ADD COLUMN IF NOT EXISTS owner_id UUID REFERENCES users(id);",
+        ),
+    ),
+    Migration(
+        2,
+        "project_page_indexes",
+        (
+            # (owner_id, <ключ>, id) даёт range scan для каждой сортировки/фильтра списка
+            "CREATE INDEX IF NOT EXISTS projects_owner_id_idx ON projects(owner_id, id);",
+            "CREATE INDEX IF NOT EXISTS projects_owner_created_idx ON projects(owner_id, created_at, id);",
+            "CREATE INDEX IF NOT EXISTS projects_owner_updated_idx ON projects(owner_id, updated_at, id);",
+            "CREATE INDEX IF NOT EXISTS projects_owner_name_idx ON projects(owner_id, name_ru, id);",
+            "CREATE INDEX IF NOT EXISTS projects_owner_direction_idx ON projects(owner_id, direction, id);",
+            "CREATE INDEX IF NOT EXISTS projects_owner_scope_idx ON projects(owner_id, scope, id);",
+            "CREATE INDEX IF NOT EXISTS projects_owner_focus_idx ON projects(owner_id, focus, id);",
+            "CREATE INDEX IF NOT EXISTS projects_owner_profile_type_idx ON projects(owner_id, profile_type, id);",
+            # покрывается projects_owner_id_idx
+            "DROP INDEX IF EXISTS projects_owner_idx;",
+        ),
+    ),
+    Migration(
+        3,
+        "project_search_vector",
+        (
+            # GIN по выражению (должно совпадать с db.SEARCH_VECTOR_EXPR), а не STORED-колонка:
+            # ADD COLUMN ... GENERATED STORED переписывает всю таблицу под ACCESS EXCLUSIVE
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS projects_search_vector_idx ON projects USING GIN ((
+                setweight(to_tsvector('russian', coalesce(name_ru, '')), 'A') ||
+                setweight(to_tsvector('english', coalesce(name_en, '')), 'A') ||
+                setweight(to_tsvector('russian', coalesce(organization_ru, '')), 'B') ||
+                setweight(to_tsvector('english', coalesce(organization_en, '')), 'B') ||
+                setweight(to_tsvector('simple', coalesce(specialization, '')), 'C')
+            ));
+            """,
+        ),
+        transactional=False,
+    ),
+    Migration(
+        4,
+        "project_search_trigram",
+        (
+            "CREATE EXTENSION IF NOT EXISTS pg_trgm;",
+            # выражение должно совпадать с db.SEARCH_TEXT_EXPR
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS projects_search_trgm_idx ON projects USING GIN (
+                (coalesce(name_ru, '') || ' ' || coalesce(name_en, '') || ' ' ||
+                 coalesce(organization_ru, '') || ' ' || coalesce(organization_en, '') || ' ' ||
+                 coalesce(specialization, '')) gin_trgm_ops
+            );
+            """,
+        ),
+        transactional=False,
+        optional=True,
+    ),
+    Migration(
+        5,
+        "project_change_notify",
+        (
+            # Триггеры уровня оператора: одно NOTIFY на владельца, а не на строку (bulk/COPY).
+            # Во всех трёх триггерах таблица переходов называется changed_rows.
+            # ids не больше 500 (лимит payload 8000 байт), иначе null — «перечитать всё»;
+            # число должно совпадать с changes.MAX_EVENT_IDS
+            """
+            CREATE OR REPLACE FUNCTION notify_project_changes() RETURNS trigger AS $$
+            DECLARE
+                change RECORD;
+            BEGIN
+                FOR change IN
+                    SELECT owner_id, array_agg(id ORDER BY id) AS ids
+                    FROM changed_rows
+                    WHERE owner_id IS NOT NULL
+                    GROUP BY owner_id
+                LOOP
+                    PERFORM pg_notify('project_changes', json_build_object(
+                        'op', lower(TG_OP),
+                        'owner_id', change.owner_id,
+                        'ids', CASE WHEN cardinality(change.ids) <= 500 THEN change.ids END
+                    )::text);
+                END LOOP;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            "DROP TRIGGER IF EXISTS projects_notify_insert ON projects;",
+            "DROP TRIGGER IF EXISTS projects_notify_update ON projects;",
+            "DROP TRIGGER IF EXISTS projects_notify_delete ON projects;",
+            """
+            CREATE TRIGGER projects_notify_insert AFTER INSERT ON projects
+            REFERENCING NEW TABLE AS changed_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_project_changes();
+            """,
+            """
+            CREATE TRIGGER projects_notify_update AFTER UPDATE ON projects
+            REFERENCING NEW TABLE AS changed_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_project_changes();
+            """,
+            """
+            CREATE TRIGGER projects_notify_delete AFTER DELETE ON projects
+            REFERENCING OLD TABLE AS changed_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_project_changes();
+            """,
+        ),
+    ),
+    Migration(
+        6,
+        "project_change_notify_timestamp",
+        (
+            # время записи в событии — для метрики задержки инвалидации кэша проектов
+            """
+            CREATE OR REPLACE FUNCTION notify_project_changes() RETURNS trigger AS $$
+            DECLARE
+                change RECORD;
+            BEGIN
+                FOR change IN
+                    SELECT owner_id, array_agg(id ORDER BY id) AS ids
+                    FROM changed_rows
+                    WHERE owner_id IS NOT NULL
+                    GROUP BY owner_id
+                LOOP
+                    PERFORM pg_notify('project_changes', json_build_object(
+                        'op', lower(TG_OP),
+                        'owner_id', change.owner_id,
+                        'ids', CASE WHEN cardinality(change.ids) <= 500 THEN change.ids END,
+                        'at', extract(epoch FROM clock_timestamp())
+                    )::text);
+                END LOOP;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+        ),
+    ),
+    Migration(
+        7,
+        "user_directory",
+        (
+            # Глобальный справочник для шардирования (app/shards.py): ник -> пользователь и его шард.
+            # Создаётся во всех базах, используется только в database_url при shard_database_urls.
+            """
+            CREATE TABLE IF NOT EXISTS user_directory (
+                user_id UUID PRIMARY KEY,
+                nickname TEXT NOT NULL,
+                shard INTEGER NOT NULL,
+                moving BOOLEAN NOT NULL DEFAULT FALSE
+            );
+            """,
+            "CREATE UNIQUE INDEX IF NOT EXISTS user_directory_nickname_lower_idx ON user_directory (lower(nickname));",
+            # переезд владельца между шардами не должен рассылать SSE-события (SET LOCAL app.suppress_notify)
+            """
+            CREATE OR REPLACE FUNCTION notify_project_changes() RETURNS trigger AS $$
+            DECLARE
+                change RECORD;
+            BEGIN
+                IF current_setting('app.suppress_notify', true) = 'on' THEN
+                    RETURN NULL;
+                END IF;
+                FOR change IN
+                    SELECT owner_id, array_agg(id ORDER BY id) AS ids
+                    FROM changed_rows
+                    WHERE owner_id IS NOT NULL
+                    GROUP BY owner_id
+                LOOP
+                    PERFORM pg_notify('project_changes', json_build_object(
+                        'op', lower(TG_OP),
+                        'owner_id', change.owner_id,
+                        'ids', CASE WHEN cardinality(change.ids) <= 500 THEN change.ids END,
+                        'at', extract(epoch FROM clock_timestamp())
+                    )::text);
+                END LOOP;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+        ),
+    ),
+    Migration(
+        8,
+        "rate_limit_buckets",
+        (
+            # Общие для воркеров token bucket'ы (app/ratelimit.py, rate_limit_backend=postgres).
+            # UNLOGGED: без WAL и реплик; после сбоя сервера таблица пуста — лимиты просто начнутся заново
+            """
+            CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_buckets (
+                key TEXT PRIMARY KEY,
+                tokens DOUBLE PRECISION NOT NULL,
+                updated_at DOUBLE PRECISION NOT NULL
+            );
+            """,
+            # взять токен: 0 — можно, иначе сколько секунд ждать; время — по часам сервера БД
+            """
+            CREATE OR REPLACE FUNCTION rate_limit_take(p_key TEXT, p_rate DOUBLE PRECISION, p_burst DOUBLE PRECISION)
+            RETURNS DOUBLE PRECISION AS $$
+            DECLARE
+                now_s DOUBLE PRECISION := extract(epoch FROM clock_timestamp());
+                available DOUBLE PRECISION;
+            BEGIN
+                INSERT INTO rate_limit_buckets (key, tokens, updated_at)
+                VALUES (p_key, p_burst - 1, now_s)
+                ON CONFLICT (key) DO NOTHING;
+                IF FOUND THEN
+                    RETURN 0;
+                END IF;
+                SELECT least(p_burst, tokens + greatest(0, now_s - updated_at) * p_rate) INTO available
+                FROM rate_limit_buckets
+                WHERE key = p_key
+                FOR UPDATE;
+                IF available IS NULL THEN
+                    -- строку только что удалила очистка: считаем ведро полным
+                    RETURN 0;
+                ELSIF available >= 1 THEN
+                    UPDATE rate_limit_buckets SET tokens = available - 1, updated_at = now_s WHERE key = p_key;
+                    RETURN 0;
+                END IF;
+                UPDATE rate_limit_buckets SET tokens = available, updated_at = now_s WHERE key = p_key;
+                RETURN (1 - available) / p_rate;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+        ),
+    ),
+    Migration(
+        9,
+        "account_soft_delete",
+        (
+            # удалённый аккаунт сразу помечается, а строки удаляет фоновый purger (app/db.py)
+            "ALTER TABLE users ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMPTZ;",
+            "CREATE INDEX IF NOT EXISTS users_deleted_at_idx ON users (deleted_at) WHERE deleted_at IS NOT NULL;",
+            # FK projects.owner_id -> ON DELETE CASCADE. Имя ограничения зависит от того, как создавалась
+            # колонка (CREATE TABLE или ADD COLUMN), поэтому снимаем все FK projects -> users.
+            # NOT VALID — без проверки существующих строк под ACCESS EXCLUSIVE; проверка — в миграции 10
+            """
+            DO $$
+            DECLARE
+                constraint_name TEXT;
+            BEGIN
+                FOR constraint_name IN
+                    SELECT conname FROM pg_constraint
+                    WHERE conrelid = 'projects'::regclass AND confrelid = 'users'::regclass AND contype = 'f'
+                LOOP
+                    EXECUTE format('ALTER TABLE projects DROP CONSTRAINT %I', constraint_name);
+                END LOOP;
+            END;
+            $$;
+            """,
+            """
+            ALTER TABLE projects ADD CONSTRAINT projects_owner_id_fkey
+                FOREIGN KEY (owner_id) REFERENCES users(id) ON DELETE CASCADE NOT VALID;
+            """,
+        ),
+    ),
+    Migration(
+        10,
+        "projects_owner_fk_validate",
+        # отдельной транзакцией: VALIDATE берёт SHARE UPDATE EXCLUSIVE и не блокирует запись
+        ("ALTER TABLE projects VALIDATE CONSTRAINT projects_owner_id_fkey;",),
+    ),
+)
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+async def current_version(conn: asyncpg.Connection) -> int:
+    try:
+        return await conn.fetchval("SELECT coalesce(max(version), 0) FROM schema_migrations;")
+    except asyncpg.UndefinedTableError:
+        return 0
+
+
+async def _index_valid(conn: asyncpg.Connection, name: str) -> Optional[bool]:
+    """None — индекса нет, False — остался INVALID после прерванной CONCURRENTLY-сборки."""
+    return await conn.fetchval(
+        "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = $1 AND pg_catalog.pg_table_is_visible(c.oid);",
+        name,
+    )
+
+
+async def _create_index_concurrently(conn: asyncpg.Connection, statement: str, name: str) -> None:
+    # IF NOT EXISTS пропустил бы INVALID-индекс от прошлой упавшей попытки — пересобираем его
+    if await _index_valid(conn, name) is False:
+        log.warning("event=invalid_index_dropped index={index}", index=name)
+        await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name};")
+    failure: Optional[BaseException] = None
+    try:
+        await conn.execute(statement)
+    except asyncpg.PostgresError as exc:
+        failure = exc
+    # упавшая сборка оставляет INVALID-индекс: не записывать шаг применённым вместе с ним
+    if await _index_valid(conn, name) is False:
+        await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name};")
+        failure = failure or RuntimeError(f"Index {name} was built INVALID and has been dropped")
+    if failure is not None:
+        raise failure
+
+
+async def _apply(conn: asyncpg.Connection, migration: Migration) -> None:
+    if migration.transactional:
+        async with conn.transaction():
+            for statement in migration.statements:
+                await conn.execute(statement)
+    else:
+        for statement in migration.statements:
+            match = CONCURRENT_INDEX_RE.search(statement)
+            if match:
+                await _create_index_concurrently(conn, statement, match.group(1))
+            else:
+                await conn.execute(statement)
+
+
+async def _lock(conn: asyncpg.Connection) -> None:
+    while not await conn.fetchval("SELECT pg_try_advisory_lock($1);", ADVISORY_LOCK_KEY):
+        await asyncio.sleep(LOCK_RETRY_SECONDS)
+
+
+async def migrate(conn: asyncpg.Connection) -> int:
+    """
+    Довести схему до LATEST_VERSION. Если она уже актуальна — один SELECT и никакого DDL.
+    Иначе под advisory lock применяются недостающие шаги по порядку. Возвращает число шагов.
+    """
+    if await current_version(conn) >= LATEST_VERSION:
+        return 0
+
+    await _lock(conn)
+    try:
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                checksum TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+            """
+        )
+        # другой процесс мог успеть всё применить, пока мы ждали блокировку
+        rows = await conn.fetch("SELECT version, checksum FROM schema_migrations;")
+        applied: Dict[int, str] = {row["version"]: row["checksum"] for row in rows}
+
+        count = 0
+        for migration in MIGRATIONS:
+            if migration.version in applied:
+                if applied[migration.version] != migration.checksum:
+                    raise RuntimeError(
+                        f"Migration {migration.version} ({migration.name}) was changed after it was applied"
+                    )
+                continue
+
+            try:
+                await _apply(conn, migration)
+            except asyncpg.PostgresError:
+                if not migration.optional:
+                    raise
+                log.exception("event=migration_skipped version={version}", version=migration.version)
+
+            await conn.execute(
+                "INSERT INTO schema_migrations (version, name, checksum) VALUES ($1, $2, $3);",
+                migration.version,
+                migration.name,
+                migration.checksum,
+            )
+            log.info("event=migration_applied version={version} name={name}", version=migration.version, name=migration.name)
+            count += 1
+        return count
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1);", ADVISORY_LOCK_KEY)
+
+
+async def _main(check_only: bool) -> int:
+    from .config import settings
+    from .shards import shard_urls
+
+    # при шардировании схема одна и та же: в базе справочника и в каждом шарде
+    status = 0
+    for name, dsn in [("main", settings.database_url)] + [(f"shard{i}", url) for i, url in enumerate(shard_urls())]:
+        conn = await asyncpg.connect(dsn)
+        try:
+            version = await current_version(conn)
+            if check_only:
+                print(f"{name}: schema version {version}, latest {LATEST_VERSION}")
+                if version < LATEST_VERSION:
+                    status = 1
+                continue
+            applied = await migrate(conn)
+            print(f"{name}: applied {applied} migration(s), schema version {await current_version(conn)}")
+        finally:
+            await conn.close()
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply database schema migrations")
+    parser.add_argument("--check", action="store_true", help="only report whether the schema is current")
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(_main(args.check)))
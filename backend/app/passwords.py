@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from . import metrics
+from .config import settings
+
+# используем стойкий PBKDF2-SHA256, чтобы не зависеть от реализации bcrypt в ОС
+pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+
+RETRY_AFTER_SECONDS = 1
+
+password_jobs = metrics.counter(
+    "password_jobs_total",
+    "Password hash/verify jobs by outcome (completed, failed, rejected with 503).",
+    ("outcome",),
+)
+password_hash_seconds = metrics.histogram(
+    "password_hash_seconds",
+    "Duration of successful password hash/verify jobs in the worker pool.",
+    ("op",),
+)
+password_queue_wait = metrics.histogram(
+    "password_queue_wait_seconds",
+    "Time password jobs spent waiting for a free worker.",
+)
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(password: str, password_hash: str) -> bool:
+    return pwd_context.verify(password, password_hash)
+
+
+def hash_many(passwords: Sequence[str], workers: int) -> List[str]:
+    """Захэшировать пачку паролей на workers процессах (массовое создание, не из event loop)."""
+    if workers <= 1 or len(passwords) < 2:
+        return [_hash(password) for password in passwords]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_hash, passwords, chunksize=max(1, len(passwords) // (workers * 4))))
+
+
+class PasswordHasher:
+    """
+    PBKDF2 занимает сотни миллисекунд CPU, поэтому выполняется в отдельном пуле.
+    Одновременно работают не больше workers задач, ещё max_queue ждут своей очереди;
+    сверх этого запрос сразу получает 503 с Retry-After.
+    """
+
+    def __init__(self, workers: int, max_queue: int, use_processes: bool = False) -> None:
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.use_processes = use_processes
+        self._executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._waiting = 0
+
+    def _ensure_started(self) -> None:
+        if self._executor is None:
+            if self.use_processes:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pbkdf2")
+            self._slots = asyncio.Semaphore(self.workers)
+
+    async def _run(self, op: str, func: Callable[..., Any], *args: Any) -> Any:
+        self._ensure_started()
+        assert self._slots is not None
+        if self._slots.locked() and self._waiting >= self.max_queue:
+            password_jobs.inc(("rejected",))
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, try again later",
+                headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+            )
+
+        queued_at = perf_counter()
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        started_at = perf_counter()
+        password_queue_wait.observe((), started_at - queued_at)
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._executor, func, *args)
+        except BaseException:
+            password_jobs.inc(("failed",))
+            raise
+        finally:
+            self._slots.release()
+        password_jobs.inc(("completed",))
+        password_hash_seconds.observe((op,), perf_counter() - started_at)
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", _hash, password)
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        return await self._run("verify", _verify, password, password_hash)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._slots = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"workers": self.workers, "waiting": self._waiting}
+
+
+hasher = PasswordHasher(
+    workers=settings.password_workers,
+    max_queue=settings.password_max_queue,
+    use_processes=settings.password_executor == "process",
+)
+
+
+def _collect_password_metrics():
+    stats = hasher.stats()
+    yield "password_jobs_waiting", "gauge", "Password hash/verify jobs waiting for a worker.", [((), stats["waiting"])], ()
+
+
+metrics.register_collector(_collect_password_metrics)
@@ -0,0 +1,154 @@
+"""
+Кэш чтений проектов в воркере: отдельные проекты по (owner_id, id) и результаты списков
+(страницы и статистика для ETag) по владельцу.
+
+Свои записи сбрасываются сразу после коммита, записи других воркеров — по NOTIFY
+project_changes (app.changes). Пока LISTEN-соединение не поднято, кэш не используется:
+иначе чужие изменения были бы видны только по истечении TTL. TTL — страховка на случай
+потерянного события.
+
+Чтение, начавшееся до сброса, не должно положить в кэш старые данные: перед запросом
+запоминается generation, и запись в кэш делается, только если он не изменился.
+"""
+from __future__ import annotations
+
+import time
+from typing import Any, Dict, Hashable, List, Optional
+from uuid import UUID
+
+from . import changes, metrics
+from .cache import TTLCache
+from .config import settings
+
+# Разных запросов списка (сортировки, фильтры) на владельца; сверх — словарь начинается заново.
+# Кэшируются только первые страницы (без курсора) — см. app.db.fetch_projects_page
+MAX_LISTS_PER_OWNER = 16
+
+
+def _list_rows(results: Dict[Hashable, Any]) -> int:
+    """Вес записи владельца: строки во всех его закэшированных списках (статистика — 1)."""
+    return sum(len(value) if isinstance(value, list) else 1 for value in results.values())
+
+project_cache_invalidations = metrics.counter(
+    "project_cache_invalidations_total",
+    "Project cache invalidations by source: local write, NOTIFY from any worker, LISTEN reset.",
+    ("source",),
+)
+project_cache_invalidation_lag = metrics.histogram(
+    "project_cache_invalidation_lag_seconds",
+    "Delay between a project write (trigger clock_timestamp) and the NOTIFY reaching this worker.",
+    (),
+    metrics.DB_BUCKETS,
+)
+
+
+class ProjectCache:
+    def __init__(self, maxsize: int, list_maxsize: int, list_rows: int, ttl: float) -> None:
+        self.projects: TTLCache[Dict[str, Any]] = TTLCache(maxsize, ttl)
+        # память ограничена суммарным числом строк, а не только числом владельцев
+        self.lists: TTLCache[Dict[Hashable, Any]] = TTLCache(list_maxsize, ttl, weigher=_list_rows, maxweight=list_rows)
+        self.generation = 0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.project_cache_enabled and changes.feed.connected
+
+    # --- чтение ---
+
+    def get_project(self, owner_id: UUID, project_id: int) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        return self.projects.get((owner_id, project_id))
+
+    def set_project(self, owner_id: UUID, project: Dict[str, Any], generation: int) -> None:
+        if self.enabled and generation == self.generation:
+            self.projects.set((owner_id, project["id"]), project)
+
+    def get_list(self, owner_id: UUID, key: Hashable) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        # hit/miss считаем по конкретному запросу, а не по словарю владельца
+        results = self.lists.peek(owner_id)
+        value = results.get(key) if results is not None else None
+        if value is None:
+            self.lists.misses += 1
+        else:
+            self.lists.hits += 1
+        return value
+
+    def set_list(self, owner_id: UUID, key: Hashable, value: Any, generation: int) -> None:
+        if not self.enabled or generation != self.generation:
+            return
+        results = self.lists.peek(owner_id)
+        if results is None or len(results) >= MAX_LISTS_PER_OWNER:
+            self.lists.set(owner_id, {key: value})
+        else:
+            # новый словарь, а не правка на месте: TTLCache пересчитывает вес при set
+            self.lists.set(owner_id, {**results, key: value})
+
+    # --- сброс ---
+
+    def invalidate(self, owner_id: UUID, ids: Optional[List[int]], source: str) -> None:
+        """Сбросить списки владельца и перечисленные проекты (ids=None — все проекты владельца)."""
+        self.generation += 1
+        project_cache_invalidations.inc((source,))
+        self.lists.invalidate(owner_id)
+        if ids is None:
+            self.projects.invalidate_if(lambda key: key[0] == owner_id)
+        else:
+            for project_id in ids:
+                self.projects.invalidate((owner_id, project_id))
+
+    def clear(self, source: str) -> None:
+        self.generation += 1
+        project_cache_invalidations.inc((source,))
+        self.projects.clear()
+        self.lists.clear()
+
+    def on_change(self, owner_id: Optional[UUID], op: str, ids: Optional[List[int]], sent_at: Optional[float]) -> None:
+        """Слушатель app.changes.feed: события из NOTIFY всех воркеров (включая этот)."""
+        if owner_id is None:
+            self.clear("reset")
+            return
+        if sent_at is not None:
+            project_cache_invalidation_lag.observe((), max(0.0, time.time() - sent_at))
+        self.invalidate(owner_id, ids, "notify")
+
+
+project_cache = ProjectCache(
+    settings.project_cache_size,
+    settings.project_cache_list_size,
+    settings.project_cache_list_rows,
+    settings.project_cache_ttl_seconds,
+)
+changes.feed.add_listener(project_cache.on_change)
+
+
+def _collect_project_cache_metrics():
+    for name, cache in (("project", project_cache.projects), ("list", project_cache.lists)):
+        stats = cache.stats()
+        yield (
+            f"project_cache_{name}_size",
+            "gauge",
+            f"Entries in the per-worker {name} cache.",
+            [((), stats["size"])],
+            (),
+        )
+        if name == "list":
+            yield (
+                "project_cache_list_rows",
+                "gauge",
+                "Rows held by cached project lists (bounded by project_cache_list_rows).",
+                [((), stats["weight"])],
+                (),
+            )
+        yield (
+            f"project_cache_{name}_events_total",
+            "counter",
+            f"Project {name} cache hits, misses and evictions.",
+            [(("hit",), stats["hits"]), (("miss",), stats["misses"]), (("eviction",), stats["evictions"])],
+            ("event",),
+        )
+
+
+metrics.register_collector(_collect_project_cache_metrics)
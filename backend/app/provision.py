@@ -0,0 +1,111 @@
+"""
+Массовое создание пользователей из CSV (онбординг группы вместо сотен вызовов /register).
+
+    cd backend
+    python -m app.provision cohort.csv > credentials.csv
+    python -m app.provision - --workers 8 < cohort.csv
+
+CSV: колонка nickname и необязательная password (заголовок можно не писать). Без пароля,
+как и при регистрации через API, пароль совпадает с ником. Пароли хэшируются параллельно
+на всех доступных ядрах, пользователи вставляются пачками через COPY; занятые ники
+(и повторы в самом файле, без учёта регистра) и служебный префикс «deleted:» пропускаются
+и перечисляются в stderr.
+На stdout — CSV login,password созданных пользователей.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import csv
+import sys
+from time import perf_counter
+from typing import Iterable, List, Optional, Tuple
+
+from loguru import logger
+
+from . import db
+from .passwords import hash_many
+from .schemas import nickname_reserved
+from .serve import available_cores
+
+log = logger.bind(req="-", user="-", nick="-")
+
+
+def read_users(lines: Iterable[str]) -> Tuple[List[Tuple[str, str]], List[str]]:
+    """(nickname, password) в порядке файла и список отброшенных строк (пустой ник, повтор, служебный ник)."""
+    users: List[Tuple[str, str]] = []
+    rejected: List[str] = []
+    seen = set()
+    for index, row in enumerate(csv.reader(lines)):
+        if not row or not any(cell.strip() for cell in row):
+            continue
+        nickname = row[0].strip()
+        if index == 0 and nickname.lower() == "nickname":
+            continue
+        password = row[1].strip() if len(row) > 1 and row[1].strip() else nickname
+        if not nickname or nickname.lower() in seen or nickname_reserved(nickname):
+            rejected.append(nickname or f"<line {index + 1}>")
+            continue
+        seen.add(nickname.lower())
+        users.append((nickname, password))
+    return users, rejected
+
+
+async def provision(users: List[Tuple[str, str]], workers: int, batch: int) -> List[Tuple[str, str]]:
+    """Создать пользователей; возвращает (login, password) созданных."""
+    loop = asyncio.get_running_loop()
+    passwords = dict(users)
+    created: List[Tuple[str, str]] = []
+    await db.connect_to_db()
+    try:
+        for start in range(0, len(users), batch):
+            chunk = users[start:start + batch]
+            started = perf_counter()
+            # хэширование — минуты CPU на тысячи паролей; event loop в это время ждать нечему
+            hashes = await loop.run_in_executor(None, hash_many, [password for _, password in chunk], workers)
+            hashed = perf_counter()
+            rows = await db.create_users_bulk([(nickname, hashes[i]) for i, (nickname, _) in enumerate(chunk)])
+            created.extend((row["nickname"], passwords[row["nickname"]]) for row in rows)
+            log.info(
+                "event=users_provisioned batch={batch} created={created} hash_s={hash_s:.1f} insert_s={insert_s:.2f}",
+                batch=len(chunk),
+                created=len(rows),
+                hash_s=hashed - started,
+                insert_s=perf_counter() - hashed,
+            )
+    finally:
+        await db.close_db()
+    return created
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("csv", help="CSV file with nickname[,password] rows, or - for stdin")
+    parser.add_argument("--workers", type=int, default=0, help="hashing processes, 0 = number of available cores")
+    parser.add_argument("--batch", type=int, default=5_000, help="users per hash + COPY batch")
+    args = parser.parse_args(argv)
+
+    if args.csv == "-":
+        users, rejected = read_users(sys.stdin)
+    else:
+        with open(args.csv, newline="", encoding="utf-8") as file:
+            users, rejected = read_users(file)
+
+    workers = args.workers if args.workers > 0 else available_cores()
+    created = asyncio.run(provision(users, workers, max(1, args.batch)))
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(("login", "password"))
+    writer.writerows(created)
+    created_names = {nickname for nickname, _ in created}
+    skipped = [nickname for nickname, _ in users if nickname not in created_names]
+    for nickname in rejected:
+        print(f"rejected (empty, reserved or duplicate in file): {nickname}", file=sys.stderr)
+    for nickname in skipped:
+        print(f"skipped (nickname taken): {nickname}", file=sys.stderr)
+    print(f"created {len(created)}, skipped {len(skipped)}, rejected {len(rejected)}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,225 @@
+"""
+Ограничение частоты запросов (token bucket) для дорогих эндпоинтов: вход и регистрация
+(PBKDF2 по IP клиента, вход ещё и по нику — подбор пароля одного аккаунта с многих адресов)
+запись и выгрузка проектов (соединение пула по пользователю).
+
+Ведро — два числа (__slots__), пополняется лениво при обращении. Вёдра одной политики лежат
+в OrderedDict в порядке последнего обращения: ведро, к которому не обращались period секунд,
+снова полное и ничем не отличается от отсутствующего, поэтому такие удаляются с начала
+словаря при каждом обращении; rate_limit_max_keys — жёсткий потолок на политику.
+
+rate_limit_backend=postgres — общие для всех воркеров вёдра в UNLOGGED-таблице (миграция 8).
+Если БД недоступна, лимит продолжает действовать по локальным вёдрам воркера.
+"""
+from __future__ import annotations
+
+import math
+from collections import OrderedDict
+from time import monotonic
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional
+
+import asyncpg
+from fastapi import HTTPException, Request, status
+from loguru import logger
+
+from . import auth, db, metrics
+from .config import settings
+
+# Чем считаются политики по умолчанию: ip — адрес клиента, user — пользователь из cookie (иначе IP),
+# nickname — ник из тела запроса (проверяет сам маршрут через limit_nickname)
+DEFAULT_SCOPES = {"login": "ip", "login_nickname": "nickname", "register": "ip", "project_write": "user", "project_export": "user"}
+# Как часто воркер чистит устаревшие строки rate_limit_buckets
+PURGE_INTERVAL_SECONDS = 60.0
+
+log = logger.bind(req="-", user="-", nick="-")
+
+rate_limited = metrics.counter(
+    "http_requests_rate_limited_total",
+    "Requests rejected with 429 by a rate limit policy.",
+    ("policy",),
+)
+rate_limit_backend_errors = metrics.counter(
+    "rate_limit_backend_errors_total",
+    "Shared rate limit lookups that failed and fell back to per-worker buckets.",
+)
+
+
+class Policy(NamedTuple):
+    name: str
+    burst: int
+    period: float
+    scope: str
+
+    @property
+    def rate(self) -> float:
+        """Токенов в секунду."""
+        return self.burst / self.period
+
+
+def parse_policies(raw: str) -> Dict[str, Policy]:
+    """«login=10/60,project_write=120/60:user» -> {политика: Policy}; scope по умолчанию из DEFAULT_SCOPES."""
+    policies = {}
+    for part in raw.split(","):
+        name, _, spec = part.partition("=")
+        name = name.strip()
+        if not name or not spec.strip():
+            continue
+        spec, _, scope = spec.partition(":")
+        burst, _, period = spec.partition("/")
+        policy = Policy(name, int(burst), float(period or 1), scope.strip() or DEFAULT_SCOPES.get(name, "ip"))
+        if policy.burst <= 0 or policy.period <= 0 or policy.scope not in ("ip", "user", "nickname"):
+            raise ValueError(f"Invalid rate limit policy: {part.strip()}")
+        policies[name] = policy
+    return policies
+
+
+class Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float) -> None:
+        self.tokens = tokens
+        self.updated = updated
+
+
+class LocalBuckets:
+    """Вёдра одной политики в памяти воркера."""
+
+    def __init__(self, policy: Policy, max_keys: int) -> None:
+        self.policy = policy
+        self.max_keys = max(1, max_keys)
+        self.buckets: "OrderedDict[str, Bucket]" = OrderedDict()
+        self.evictions = 0
+
+    def _evict_idle(self, now: float) -> None:
+        # в начале — самые давние обращения; первое непросроченное останавливает проход
+        buckets = self.buckets
+        while buckets:
+            oldest = next(iter(buckets.values()))
+            if now - oldest.updated < self.policy.period:
+                return
+            buckets.popitem(last=False)
+
+    def take(self, key: str, now: Optional[float] = None) -> float:
+        """Взять токен: 0.0 — можно, иначе через сколько секунд появится следующий."""
+        now = monotonic() if now is None else now
+        self._evict_idle(now)
+        policy = self.policy
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = Bucket(policy.burst, now)
+            if len(self.buckets) > self.max_keys:
+                # потолок памяти: вытесняем самое давнее ведро, даже если оно не полное
+                self.buckets.popitem(last=False)
+                self.evictions += 1
+        else:
+            bucket.tokens = min(policy.burst, bucket.tokens + (now - bucket.updated) * policy.rate)
+            bucket.updated = now
+            self.buckets.move_to_end(key)
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return 0.0
+        return (1 - bucket.tokens) / policy.rate
+
+
+class RateLimiter:
+    def __init__(self, policies: Dict[str, Policy], max_keys: int, backend: str) -> None:
+        self.policies = policies
+        self.local = {name: LocalBuckets(policy, max_keys) for name, policy in policies.items()}
+        self.backend = backend
+        self.backend_failing = False
+        self.next_purge = 0.0
+
+    def _shared(self) -> bool:
+        return self.backend == "postgres" and settings.storage_backend == "postgres" and db.db.pool is not None
+
+    async def take(self, name: str, key: str) -> float:
+        policy = self.policies[name]
+        if not self._shared():
+            return self.local[name].take(key)
+        try:
+            wait = await db.rate_limit_take(f"{name}:{key}", policy.rate, policy.burst)
+            await self._maybe_purge()
+        except (OSError, db.PoolTimeout, asyncpg.PostgresError, asyncpg.InterfaceError):
+            rate_limit_backend_errors.inc()
+            if not self.backend_failing:
+                log.exception("event=rate_limit_backend_failed fallback=local")
+                self.backend_failing = True
+            return self.local[name].take(key)
+        if self.backend_failing:
+            log.info("event=rate_limit_backend_recovered")
+            self.backend_failing = False
+        return wait
+
+    async def _maybe_purge(self) -> None:
+        now = monotonic()
+        if now < self.next_purge:
+            return
+        self.next_purge = now + PURGE_INTERVAL_SECONDS
+        # строка старше самого длинного периода — полное ведро, её можно удалить
+        longest = max(policy.period for policy in self.policies.values())
+        await db.purge_rate_limit_buckets(longest)
+
+
+limiter = RateLimiter(parse_policies(settings.rate_limits), settings.rate_limit_max_keys, settings.rate_limit_backend)
+
+
+def client_ip(request: Request) -> str:
+    # за прокси адрес уже подставлен uvicorn из X-Forwarded-For (proxy_headers, forwarded_allow_ips)
+    return request.client.host if request.client else "-"
+
+
+async def _enforce(request: Request, name: str, key: str, user: str = "-", nick: str = "-") -> None:
+    wait = await limiter.take(name, key)
+    if wait <= 0:
+        return
+    rate_limited.inc((name,))
+    logger.bind(req=getattr(request.state, "req_id", "-"), user=user, nick=nick).info(
+        "event=rate_limited policy={policy} key={key} retry_after={wait:.1f}", policy=name, key=key, wait=wait
+    )
+    raise HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many requests, try again later",
+        headers={"Retry-After": str(math.ceil(wait))},
+    )
+
+
+def rate_limit(name: str) -> Callable[[Request], Awaitable[None]]:
+    """FastAPI-зависимость: 429 с Retry-After, если ведро политики name пусто."""
+
+    async def dependency(request: Request) -> None:
+        policy = limiter.policies.get(name)
+        if policy is None or not settings.rate_limit_enabled:
+            return
+        user_id = auth.request_user_id(request) if policy.scope == "user" else None
+        key = str(user_id) if user_id else client_ip(request)
+        await _enforce(request, name, key, user=str(user_id) if user_id else "-")
+
+    return dependency
+
+
+async def limit_nickname(request: Request, name: str, nickname: str) -> None:
+    """То же для политики со scope=nickname: ключ — ник без учёта регистра (как уникальность в users)."""
+    policy = limiter.policies.get(name)
+    if policy is None or not settings.rate_limit_enabled:
+        return
+    await _enforce(request, name, nickname.lower(), nick=nickname)
+
+
+def _collect_rate_limit_metrics():
+    yield (
+        "rate_limit_buckets",
+        "gauge",
+        "Per-worker token buckets held in memory.",
+        [((name,), len(buckets.buckets)) for name, buckets in limiter.local.items()],
+        ("policy",),
+    )
+    yield (
+        "rate_limit_bucket_evictions_total",
+        "counter",
+        "Buckets dropped before refilling because rate_limit_max_keys was reached.",
+        [((name,), buckets.evictions) for name, buckets in limiter.local.items()],
+        ("policy",),
+    )
+
+
+metrics.register_collector(_collect_rate_limit_metrics)
@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, List, Optional
+
+import orjson
+from fastapi import Response
+
+# Поля Project в порядке схемы; owner_id и служебные колонки наружу не отдаём
+PROJECT_COLUMNS = (
+    "id",
+    "name_ru",
+    "name_en",
+    "organization_ru",
+    "organization_en",
+    "direction",
+    "scope",
+    "focus",
+    "profile_type",
+    "specialization",
+    "created_at",
+    "updated_at",
+)
+
+
+def project_payload(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {column: row[column] for column in PROJECT_COLUMNS}
+
+
+def projects_payload(rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [{column: row[column] for column in PROJECT_COLUMNS} for row in rows]
+
+
+def json_response(content: Any, sub_response: Optional[Response] = None, status_code: int = 200) -> Response:
+    """
+    Сразу отдать JSON-байты через orjson (UUID/datetime — нативно, UTC как «Z», как у Pydantic),
+    минуя повторную валидацию response_model; схема OpenAPI при этом берётся из response_model.
+    Заголовки и cookie, выставленные зависимостями на sub_response, переносятся в ответ.
+    """
+    response = Response(
+        orjson.dumps(content, option=orjson.OPT_UTC_Z),
+        status_code=status_code,
+        media_type="application/json",
+    )
+    if sub_response is not None:
+        response.raw_headers.extend(sub_response.raw_headers)
+    return response
@@ -3,28 +3,32 @@ from __future__ import annotations
 from datetime import datetime
 from fastapi import APIRouter, HTTPException, Request, Response, status, Depends
 from loguru import logger
-from passlib.context import CryptContext
 
-from .. import db
 from .. import auth as auth_utils
-from ..schemas import AuthRequest, AuthResponse, LoginRequest, User
+from ..passwords import hasher
+from ..ratelimit import limit_nickname, rate_limit
+from ..storage import Storage, get_storage
+from ..schemas import AuthRequest, AuthResponse, LoginRequest, User, nickname_reserved
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
-# используем стойкий PBKDF2-SHA256, чтобы не зависеть от реализации bcrypt в ОС
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 
 
-@router.post("/register")
-async def register(payload: AuthRequest, response: Response, request: Request) -> dict:
+@router.post("/register", dependencies=[Depends(rate_limit("register"))])
+async def register(
+    payload: AuthRequest,
+    response: Response,
+    request: Request,
+    store: Storage = Depends(get_storage),
+) -> dict:
     nickname = payload.nickname.strip()
     if not nickname:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Nickname is required")
-
-    existing = await db.fetch_user_by_nickname(nickname)
-    if existing:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User already exists")
+    if nickname_reserved(nickname):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Nickname is reserved")
 
     if not payload.create_if_missing:
+        if await store.fetch_user_by_nickname(nickname):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User already exists")
         logger.bind(
             req=getattr(request.state, "req_id", "-"),
             user="-",
@@ -33,8 +37,11 @@ async def register(payload: AuthRequest, response: Response, request: Request) -
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Creation is not allowed")
 
     password = nickname
-    password_hash = pwd_context.hash(password)
-    user = await db.create_user_with_password(nickname, password_hash)
+    password_hash = await hasher.hash(password)
+    # проверка занятости ника — в самом INSERT (ON CONFLICT DO NOTHING), без отдельного SELECT и гонки
+    user = await store.create_user_with_password(nickname, password_hash)
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User already exists")
     logger.bind(
         req=getattr(request.state, "req_id", "-"),
         user=str(user["id"]),
@@ -46,17 +53,16 @@ async def register(payload: AuthRequest, response: Response, request: Request) -
 
 
 @router.get("/me", response_model=AuthResponse)
-async def me(response: Response, request: Request) -> AuthResponse:
-    raw_cookie = request.cookies.get(auth_utils.COOKIE_NAME)
-    user_id = auth_utils.verify_cookie_value(raw_cookie) if raw_cookie else None
+async def me(response: Response, request: Request, store: Storage = Depends(get_storage)) -> AuthResponse:
+    user_id = auth_utils.request_user_id(request)
     if not user_id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
 
-    user = await db.fetch_user(user_id)
+    user = await store.fetch_user(user_id)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
 
-    await db.touch_user(user_id, datetime.utcnow())
+    await store.touch_user(user_id, datetime.utcnow())
     auth_utils.set_user_cookie(response, user_id)
     csrf = auth_utils.issue_csrf(response)
     logger.bind(
@@ -78,17 +84,24 @@ async def logout(response: Response, request: Request) -> dict[str, str]:
     return {"status": "logged_out"}
 
 
-@router.post("/login", response_model=AuthResponse)
-async def login(payload: LoginRequest, response: Response, request: Request) -> AuthResponse:
+@router.post("/login", response_model=AuthResponse, dependencies=[Depends(rate_limit("login"))])
+async def login(
+    payload: LoginRequest,
+    response: Response,
+    request: Request,
+    store: Storage = Depends(get_storage),
+) -> AuthResponse:
     nickname = payload.login.strip()
     if not nickname or not payload.password:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Login and password are required")
+    # ведро по IP — в зависимости маршрута, по нику — здесь: ключ есть только после разбора тела
+    await limit_nickname(request, "login_nickname", nickname)
 
-    user = await db.fetch_user_by_nickname(nickname)
+    user = await store.fetch_user_by_nickname(nickname)
     if not user or not user.get("password_hash"):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
-    if not pwd_context.verify(payload.password, user["password_hash"]):
+    if not await hasher.verify(payload.password, user["password_hash"]):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
     auth_utils.set_user_cookie(response, user["id"])
@@ -104,17 +117,21 @@ async def login(payload: LoginRequest, response: Response, request: Request) ->
 
 
 @router.delete("/me", status_code=status.HTTP_204_NO_CONTENT, dependencies=[Depends(auth_utils.csrf_protect)])
-async def delete_account(response: Response, request: Request) -> Response:
-    raw_cookie = request.cookies.get(auth_utils.COOKIE_NAME)
-    user_id = auth_utils.verify_cookie_value(raw_cookie) if raw_cookie else None
+async def delete_account(
+    response: Response,
+    request: Request,
+    store: Storage = Depends(get_storage),
+) -> Response:
+    user_id = auth_utils.request_user_id(request)
     if not user_id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
 
-    user = await db.fetch_user(user_id)
+    user = await store.fetch_user(user_id)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
 
-    await db.delete_user_and_projects(user_id)
+    # помечаем и отвечаем сразу; проекты удалит фоновый purger (app/db.py)
+    await store.delete_account(user_id)
     auth_utils.clear_cookies(response)
     logger.bind(
         req=getattr(request.state, "req_id", "-"),
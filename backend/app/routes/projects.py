@@ -1,99 +1,524 @@
-from typing import List
+import asyncio
+import base64
+import csv
+import hashlib
+import io
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, List, Literal, Optional, Tuple
 
-from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
 from loguru import logger
+from pydantic import ValidationError
 
 from .. import auth
+from .. import changes
 from .. import db
-from ..schemas import Project, ProjectCreate, ProjectUpdate
+from ..config import settings
+from ..ratelimit import rate_limit
+from ..storage import Storage, get_storage
+from .. import http_cache
+from ..responses import PROJECT_COLUMNS, json_response, project_payload, projects_payload
+from ..schemas import Project, ProjectBulkItem, ProjectBulkResult, ProjectCreate, ProjectUpdate
 
 router = APIRouter(prefix="/api/projects", tags=["projects"])
 
 
+# одно ведро на все записи пользователя: каждая держит соединение пула
+write_limit = rate_limit("project_write")
+# выгрузка держит соединение всё время скачивания — отдельное, более строгое ведро
+export_limit = rate_limit("project_export")
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def _encode_cursor(sort: str, row: dict) -> str:
+    value = row[sort]
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps({"s": sort, "v": value, "id": row["id"]}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str, sort: str) -> Tuple[Any, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if data["s"] != sort:
+            raise ValueError("cursor belongs to another sort key")
+        value, last_id = data["v"], data["id"]
+        # тип значения проверяем по ключу сортировки: иначе чужой тип дойдёт до SQL и вернёт 500
+        if type(last_id) is not int:
+            raise ValueError("cursor id must be an integer")
+        if sort in ("created_at", "updated_at"):
+            if not isinstance(value, str):
+                raise ValueError("cursor value must be an ISO datetime")
+            value = datetime.fromisoformat(value)
+            if value.tzinfo is None:
+                raise ValueError("cursor datetime must carry a timezone")
+        elif sort == "id":
+            if type(value) is not int:
+                raise ValueError("cursor value must be an integer")
+        elif not isinstance(value, str):
+            raise ValueError("cursor value must be a string")
+        return value, last_id
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _project_etag(project: dict) -> str:
+    """Сильный ETag проекта: id + updated_at в микросекундах."""
+    micros = (project["updated_at"] - _EPOCH) // timedelta(microseconds=1)
+    return f'"p{project["id"]}-{micros}"'
+
+
+def _parse_if_match(if_match: Optional[str], project_id: int) -> Optional[datetime]:
+    """Достать ожидаемый updated_at из If-Match. «*» и отсутствие заголовка — без проверки."""
+    if not if_match or if_match.strip() == "*":
+        return None
+    try:
+        tag = if_match.strip().strip('"')
+        tag_id, micros = tag[1:].split("-", 1)
+        if not tag.startswith("p") or int(tag_id) != project_id:
+            raise ValueError(tag)
+        return _EPOCH + timedelta(microseconds=int(micros))
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail="Precondition failed")
+
+
+def _list_etag(stats: Tuple[int, Optional[datetime]], query: str) -> str:
+    """ETag страницы списка: число строк + max(updated_at) по фильтру + параметры запроса."""
+    count, last_modified = stats
+    micros = (last_modified - _EPOCH) // timedelta(microseconds=1) if last_modified else 0
+    digest = hashlib.sha256(f"{count}:{micros}:{query}".encode()).hexdigest()[:32]
+    return f'"l{digest}"'
+
+
 @router.get("/", response_model=List[Project])
 async def list_projects(
     request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = Query(None, description="Opaque cursor from X-Next-Cursor"),
+    sort: Literal["id", "created_at", "updated_at", "name_ru"] = "id",
+    order: Literal["asc", "desc"] = "asc",
+    direction: Optional[str] = None,
+    scope: Optional[str] = None,
+    focus: Optional[str] = None,
+    profile_type: Optional[str] = None,
     current_user: dict = Depends(auth.get_current_user),
-) -> List[Project]:
-    projects = await db.fetch_projects(current_user["id"])
+    store: Storage = Depends(get_storage),
+) -> Response:
+    filters = {
+        key: value
+        for key, value in (
+            ("direction", direction),
+            ("scope", scope),
+            ("focus", focus),
+            ("profile_type", profile_type),
+        )
+        if value is not None
+    }
+    # дешёвый агрегат вместо выборки строк: если ничего не менялось — 304 без сериализации
+    stats = await store.fetch_projects_stats(current_user["id"], filters=filters)
+    # без Last-Modified: удаление не самого свежего проекта или выход проекта из фильтра не двигают
+    # max(updated_at), и If-Modified-Since отдал бы 304 на устаревший список; решает ETag (с числом строк)
+    headers = http_cache.validator_headers(_list_etag(stats, request.url.query), None)
+    if http_cache.is_not_modified(request, headers["ETag"], None):
+        return http_cache.not_modified("list_projects", headers, response)
+
+    # берём на одну строку больше, чтобы понять, есть ли следующая страница
+    projects = await store.fetch_projects_page(
+        current_user["id"],
+        limit=limit + 1,
+        sort=sort,
+        descending=order == "desc",
+        after=_decode_cursor(after, sort) if after else None,
+        filters=filters,
+    )
+    if len(projects) > limit:
+        projects = projects[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = _encode_cursor(sort, projects[-1])
+    http_cache.modified("list_projects", response, headers)
+
     logger.bind(
         req=getattr(request.state, "req_id", "-"),
         user=str(current_user["id"]),
         nick=current_user.get("nickname", "-"),
     ).info("event=projects_listed count={count}", count=len(projects))
-    return [Project(**project) for project in projects]
+    return json_response(projects_payload(projects), response)
+
+
+EXPORT_CHUNK_BYTES = 64 * 1024
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+EXPORT_RETRY_AFTER_SECONDS = 5
+
+# Одновременных выгрузок на воркер: медленный клиент держит соединение пула до конца скачивания,
+# без потолка несколько выгрузок заняли бы весь пул
+_export_slots = asyncio.Semaphore(max(1, settings.export_max_concurrent))
+
+
+def _export_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+async def _export_chunks(store: Storage, owner_id, fmt: str) -> AsyncIterator[bytes]:
+    """Сериализовать проекты построчно и отдавать блоками ~EXPORT_CHUNK_BYTES (слот выгрузки — на всё время)."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == "csv" else None
+    if writer:
+        writer.writerow(PROJECT_COLUMNS)
+
+    async with _export_slots:
+        async for row in store.iter_projects(owner_id):
+            if writer:
+                writer.writerow([_export_value(row[column]) for column in PROJECT_COLUMNS])
+            else:
+                record = {column: _export_value(row[column]) for column in PROJECT_COLUMNS}
+                buffer.write(json.dumps(record, ensure_ascii=False))
+                buffer.write("\n")
+            if buffer.tell() >= EXPORT_CHUNK_BYTES:
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+@router.get("/export", dependencies=[Depends(export_limit)])
+async def export_projects(
+    request: Request,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    current_user: dict = Depends(auth.get_current_user),
+    store: Storage = Depends(get_storage),
+) -> StreamingResponse:
+    # все слоты заняты — 503 до начала ответа (слот берётся уже в генераторе, после отправки заголовков)
+    if _export_slots.locked():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many exports in progress, try again later",
+            headers={"Retry-After": str(EXPORT_RETRY_AFTER_SECONDS)},
+        )
+    logger.bind(
+        req=getattr(request.state, "req_id", "-"),
+        user=str(current_user["id"]),
+        nick=current_user.get("nickname", "-"),
+    ).info("event=projects_exported format={format}", format=format)
+    return StreamingResponse(
+        _export_chunks(store, current_user["id"], format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="projects.{format}"'},
+    )
+
+
+# через сколько мс браузерный EventSource переподключается после обрыва
+STREAM_RETRY_MS = 3000
+
+
+async def _stream_events(owner_id, last_event_id: Optional[str]) -> AsyncIterator[bytes]:
+    # подписка внутри генератора: если поток так и не начнётся, подписчик не останется висеть
+    subscription = changes.feed.subscribe(owner_id, last_event_id)
+    try:
+        yield f"retry: {STREAM_RETRY_MS}\n\n".encode()
+        while True:
+            try:
+                event = await asyncio.wait_for(
+                    subscription.queue.get(), timeout=settings.project_feed_heartbeat_seconds
+                )
+            except asyncio.TimeoutError:
+                # комментарий SSE: держит соединение через прокси и выявляет отвалившихся клиентов
+                yield b": keep-alive\n\n"
+                continue
+            if event is None:
+                return
+            yield changes.format_event(event)
+    finally:
+        changes.feed.unsubscribe(subscription)
+
+
+@router.get("/stream")
+async def stream_project_changes(
+    request: Request,
+    last_event_id: Optional[str] = Header(None),
+    current_user: dict = Depends(auth.get_current_user),
+) -> StreamingResponse:
+    """
+    Server-Sent Events об изменениях проектов текущего пользователя: insert/update/delete с id
+    (ids=null — изменилось слишком много, перечитать список) и reset — перечитать список целиком.
+    """
+    if not changes.feed.available or changes.feed.subscriber_count >= settings.project_feed_max_clients:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Change feed unavailable")
+    logger.bind(
+        req=getattr(request.state, "req_id", "-"),
+        user=str(current_user["id"]),
+        nick=current_user.get("nickname", "-"),
+    ).info("event=projects_stream_opened resume={resume}", resume=bool(last_event_id))
+    return StreamingResponse(
+        _stream_events(current_user["id"], last_event_id),
+        media_type="text/event-stream",
+        # X-Accel-Buffering: nginx иначе копит ответ в буфере и события приходят пачками
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+SEARCH_MODE_HEADER = "X-Search-Mode"
+
+
+@router.get("/search", response_model=List[Project])
+async def search_projects(
+    request: Request,
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=10_000),
+    current_user: dict = Depends(auth.get_current_user),
+    store: Storage = Depends(get_storage),
+) -> Response:
+    mode, projects = await store.search_projects(current_user["id"], q.strip(), limit=limit, offset=offset)
+    response.headers[SEARCH_MODE_HEADER] = mode
+    logger.bind(
+        req=getattr(request.state, "req_id", "-"),
+        user=str(current_user["id"]),
+        nick=current_user.get("nickname", "-"),
+    ).info("event=projects_searched mode={mode} count={count}", mode=mode, count=len(projects))
+    return json_response(projects_payload(projects), response)
 
 
 @router.get("/{project_id}", response_model=Project)
 async def get_project(
     project_id: int,
     request: Request,
+    response: Response,
     current_user: dict = Depends(auth.get_current_user),
-) -> Project:
-    project = await db.fetch_project(project_id, current_user["id"])
+    store: Storage = Depends(get_storage),
+) -> Response:
+    project = await store.fetch_project(project_id, current_user["id"])
     if not project:
         raise HTTPException(status_code=404, detail="Not found")
+    headers = http_cache.validator_headers(_project_etag(project), project["updated_at"])
+    if http_cache.is_not_modified(request, headers["ETag"], project["updated_at"]):
+        return http_cache.not_modified("get_project", headers, response)
+    http_cache.modified("get_project", response, headers)
     logger.bind(
         req=getattr(request.state, "req_id", "-"),
         user=str(current_user["id"]),
         nick=current_user.get("nickname", "-"),
     ).info("event=project_read id={id}", id=project_id)
-    return Project(**project)
+    return json_response(project_payload(project), response)
 
 
 @router.post(
     "/",
     response_model=Project,
     status_code=status.HTTP_201_CREATED,
-    dependencies=[Depends(auth.csrf_protect)],
+    dependencies=[Depends(auth.csrf_protect), Depends(write_limit)],
 )
 async def create_project(
     payload: ProjectCreate,
     request: Request,
+    response: Response,
     current_user: dict = Depends(auth.get_current_user),
-) -> Project:
-    project = await db.create_project(payload.model_dump(), current_user["id"])
+    store: Storage = Depends(get_storage),
+) -> Response:
+    project = await store.create_project(payload.model_dump(), current_user["id"])
     logger.bind(
         req=getattr(request.state, "req_id", "-"),
         user=str(current_user["id"]),
         nick=current_user.get("nickname", "-"),
     ).info("event=project_created id={id}", id=project["id"])
-    return Project(**project)
+    return json_response(project_payload(project), response, status_code=status.HTTP_201_CREATED)
 
 
-@router.put(
-    "/{project_id}",
-    response_model=Project,
-    dependencies=[Depends(auth.csrf_protect)],
+BULK_MAX_ITEMS = 10_000
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+_bulk_body_schema = {"type": "array", "items": ProjectBulkItem.model_json_schema(), "maxItems": BULK_MAX_ITEMS}
+
+
+async def _read_bulk_items(request: Request) -> List[Any]:
+    """Прочитать тело bulk-запроса: JSON-массив или построчный NDJSON (читается потоком)."""
+    content_type = request.headers.get("content-type", "")
+    if not content_type.startswith(NDJSON_MEDIA_TYPE):
+        try:
+            items = json.loads(await request.body())
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid JSON body")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Expected a JSON array")
+        if len(items) > BULK_MAX_ITEMS:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Too many items")
+        return items
+
+    items: List[Any] = []
+    tail = b""
+
+    def _consume(line: bytes) -> None:
+        if not line.strip():
+            return
+        if len(items) >= BULK_MAX_ITEMS:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Too many items")
+        try:
+            items.append(json.loads(line))
+        except ValueError:
+            # невалидная строка станет invalid-результатом на своей позиции
+            items.append(None)
+
+    async for chunk in request.stream():
+        lines = (tail + chunk).split(b"\n")
+        tail = lines.pop()
+        for line in lines:
+            _consume(line)
+    _consume(tail)
+    return items
+
+
+@router.post(
+    "/bulk",
+    response_model=List[ProjectBulkResult],
+    dependencies=[Depends(auth.csrf_protect), Depends(write_limit)],
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": _bulk_body_schema},
+                NDJSON_MEDIA_TYPE: {"schema": ProjectBulkItem.model_json_schema()},
+            },
+        }
+    },
 )
-async def update_project(
+async def bulk_projects(
+    request: Request,
+    current_user: dict = Depends(auth.get_current_user),
+    store: Storage = Depends(get_storage),
+) -> List[ProjectBulkResult]:
+    raw_items = await _read_bulk_items(request)
+
+    results: List[Optional[ProjectBulkResult]] = [None] * len(raw_items)
+    creates: List[dict] = []
+    create_slots: List[int] = []
+    updates: List[Tuple[int, dict]] = []
+    update_slots: List[int] = []
+    for index, raw in enumerate(raw_items):
+        try:
+            item = ProjectBulkItem.model_validate(raw)
+            data = item.model_dump(exclude_unset=True, exclude={"id"})
+            if item.id is None:
+                creates.append(ProjectCreate.model_validate(data).model_dump())
+                create_slots.append(index)
+            else:
+                updates.append((item.id, data))
+                update_slots.append(index)
+        except ValidationError as exc:
+            error = "; ".join(err["msg"] for err in exc.errors())
+            results[index] = ProjectBulkResult(index=index, status="invalid", error=error)
+
+    created_ids, updated_ids = await store.bulk_apply_projects(current_user["id"], creates, updates)
+    for index, project_id in zip(create_slots, created_ids):
+        results[index] = ProjectBulkResult(index=index, status="created", id=project_id)
+    updated = set(updated_ids)
+    for index, (project_id, _) in zip(update_slots, updates):
+        results[index] = ProjectBulkResult(
+            index=index,
+            status="updated" if project_id in updated else "not_found",
+            id=project_id,
+        )
+
+    logger.bind(
+        req=getattr(request.state, "req_id", "-"),
+        user=str(current_user["id"]),
+        nick=current_user.get("nickname", "-"),
+    ).info(
+        "event=projects_bulk created={created} updated={updated} total={total}",
+        created=len(created_ids),
+        updated=len(updated),
+        total=len(raw_items),
+    )
+    return [result for result in results if result is not None]
+
+
+async def _apply_update(
     project_id: int,
     payload: ProjectUpdate,
+    if_match: Optional[str],
     request: Request,
-    current_user: dict = Depends(auth.get_current_user),
-) -> Project:
-    updated = await db.update_project(project_id, payload.model_dump(exclude_unset=True), current_user["id"])
+    response: Response,
+    current_user: dict,
+    store: Storage,
+) -> Response:
+    try:
+        updated = await store.update_project(
+            project_id,
+            payload.model_dump(exclude_unset=True),
+            current_user["id"],
+            expected_updated_at=_parse_if_match(if_match, project_id),
+        )
+    except db.UpdateConflict:
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail="Precondition failed")
     if not updated:
         raise HTTPException(status_code=404, detail="Not found")
+    response.headers["ETag"] = _project_etag(updated)
     logger.bind(
         req=getattr(request.state, "req_id", "-"),
         user=str(current_user["id"]),
         nick=current_user.get("nickname", "-"),
     ).info("event=project_updated id={id}", id=project_id)
-    return Project(**updated)
+    return json_response(project_payload(updated), response)
+
+
+@router.put(
+    "/{project_id}",
+    response_model=Project,
+    dependencies=[Depends(auth.csrf_protect), Depends(write_limit)],
+)
+async def update_project(
+    project_id: int,
+    payload: ProjectUpdate,
+    request: Request,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    current_user: dict = Depends(auth.get_current_user),
+    store: Storage = Depends(get_storage),
+) -> Response:
+    return await _apply_update(project_id, payload, if_match, request, response, current_user, store)
+
+
+@router.patch(
+    "/{project_id}",
+    response_model=Project,
+    dependencies=[Depends(auth.csrf_protect), Depends(write_limit)],
+)
+async def patch_project(
+    project_id: int,
+    payload: ProjectUpdate,
+    request: Request,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    current_user: dict = Depends(auth.get_current_user),
+    store: Storage = Depends(get_storage),
+) -> Response:
+    return await _apply_update(project_id, payload, if_match, request, response, current_user, store)
 
 
 @router.delete(
     "/{project_id}",
     status_code=status.HTTP_204_NO_CONTENT,
-    dependencies=[Depends(auth.csrf_protect)],
+    dependencies=[Depends(auth.csrf_protect), Depends(write_limit)],
 )
 async def delete_project(
     project_id: int,
     request: Request,
     current_user: dict = Depends(auth.get_current_user),
+    store: Storage = Depends(get_storage),
 ) -> None:
-    deleted = await db.delete_project(project_id, current_user["id"])
+    deleted = await store.delete_project(project_id, current_user["id"])
     if not deleted:
         raise HTTPException(status_code=404, detail="Not found")
     logger.bind(
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Optional
+from typing import Literal, Optional
 from uuid import UUID
 
 from pydantic import BaseModel, Field
@@ -15,6 +15,15 @@ class User(BaseModel):
         from_attributes = True
 
 
+# Удалённый аккаунт до purge'а получает ник prefix + id; регистрация с таким префиксом запрещена
+DELETED_NICKNAME_PREFIX = "deleted:"
+
+
+def nickname_reserved(nickname: str) -> bool:
+    """Ник занят под служебные имена (удалённые аккаунты), без учёта регистра."""
+    return nickname.lower().startswith(DELETED_NICKNAME_PREFIX)
+
+
 class AuthRequest(BaseModel):
     nickname: str = Field(..., min_length=1)
     create_if_missing: bool = False
@@ -58,6 +67,19 @@ class ProjectUpdate(BaseModel):
     specialization: Optional[str] = None
 
 
+class ProjectBulkItem(ProjectUpdate):
+    """Элемент пакетной операции: без id — создание, с id — частичное обновление."""
+
+    id: Optional[int] = None
+
+
+class ProjectBulkResult(BaseModel):
+    index: int
+    status: Literal["created", "updated", "not_found", "invalid"]
+    id: Optional[int] = None
+    error: Optional[str] = None
+
+
 class Project(ProjectBase):
     id: int
     created_at: datetime
@@ -0,0 +1,95 @@
+"""
+Продакшн-запуск бэкенда: несколько воркеров uvicorn на uvloop/httptools.
+
+    cd backend
+    python -m app.serve                  # воркеров по числу доступных ядер
+    python -m app.serve --workers 4 --port 8080
+
+Для разработки по-прежнему uvicorn app.main:app --reload (dev.sh).
+"""
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import os
+from typing import List, Optional
+
+import uvicorn
+from loguru import logger
+
+from .config import settings
+from .logs import configure_logging
+
+log = logger.bind(req="-", user="-", nick="-")
+
+
+def available_cores() -> int:
+    """Ядра, доступные процессу (учитывает cpuset/taskset контейнера), а не все ядра хоста."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def resolve_workers(requested: int) -> int:
+    return requested if requested > 0 else available_cores()
+
+
+def _pick(module: str, preferred: str, fallback: str) -> str:
+    # uvloop нет под Windows; без него uvicorn работает на стандартном asyncio
+    return preferred if importlib.util.find_spec(module) is not None else fallback
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=settings.web_host)
+    parser.add_argument("--port", type=int, default=settings.web_port)
+    parser.add_argument("--workers", type=int, default=settings.web_workers, help="0 = number of available cores")
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    workers = resolve_workers(args.workers)
+    # воркеры читают Settings заново при импорте app.main: так они узнают,
+    # на сколько частей делить db_connection_budget
+    os.environ["WEB_WORKERS"] = str(workers)
+    settings.web_workers = workers
+    min_size, max_size = settings.db_pool_size()
+
+    loop = _pick("uvloop", "uvloop", "asyncio")
+    http = _pick("httptools", "httptools", "h11")
+    log.info(
+        "event=server_starting host={host} port={port} workers={workers} loop={loop} http={http} "
+        "pool_per_worker={min_size}..{max_size}",
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        loop=loop,
+        http=http,
+        min_size=min_size,
+        max_size=max_size,
+    )
+    if settings.db_connection_budget and settings.db_connection_budget < workers:
+        log.warning(
+            "event=connection_budget_too_small budget={budget} workers={workers}",
+            budget=settings.db_connection_budget,
+            workers=workers,
+        )
+
+    uvicorn.run(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        loop=loop,
+        http=http,
+        backlog=settings.web_backlog,
+        timeout_keep_alive=settings.web_keepalive_seconds,
+        timeout_graceful_shutdown=settings.web_graceful_shutdown_seconds,
+        # каждый запрос и так логирует RequestLoggingMiddleware
+        access_log=False,
+        proxy_headers=True,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+Шардирование данных по владельцу.
+
+Каждый пользователь со всеми своими проектами живёт целиком в одном шарде (shard_database_urls).
+Размещение выбирается консистентным хэшированием UUID пользователя и записывается в глобальный
+справочник user_directory в базе database_url; там же — уникальность ников (вход по нику).
+Номер шарда — позиция DSN в списке, поэтому список можно только дописывать: новый шард забирает
+у остальных примерно 1/N владельцев, остальные остаются на месте.
+
+Id проектов уникальны между шардами: последовательность шарда k идёт с шагом MAX_SHARDS
+и даёт числа ≡ k + 1 (mod MAX_SHARDS), поэтому переезд строк не конфликтует по id.
+
+Обслуживание (из каталога backend):
+    python -m app.shards init         # шаг последовательностей + заполнить справочник из шардов
+    python -m app.shards plan         # сколько владельцев не на «своём» по кольцу шарде
+    python -m app.shards rebalance    # перевезти их пачками онлайн
+    python -m app.shards move <user_id> <shard>
+
+Переезд онлайн: владелец помечается moving (записи получают 503, чтение идёт со старого шарда),
+ждём, пока все воркеры увидят пометку (TTL кэша размещений), копируем строки, переключаем
+шард в справочнике, ждём ещё раз (отставшие воркеры ещё читают старую копию) и удаляем старую.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+from bisect import bisect_right
+from collections import Counter
+from typing import Dict, List, Sequence, Tuple
+from uuid import UUID
+
+import asyncpg
+from loguru import logger
+
+from .config import settings
+
+# Верхняя граница числа шардов: шаг последовательности id проектов
+MAX_SHARDS = 64
+# Точек на кольце на шард: больше — ровнее распределение
+VNODES = 128
+SEQUENCE_NAME = "projects_id_seq"
+# Колонки, переносимые при переезде
+USER_COLUMNS = ("id", "nickname", "password_hash", "created_at", "last_seen")
+PROJECT_COPY_COLUMNS = (
+    "id",
+    "owner_id",
+    "name_ru",
+    "name_en",
+    "organization_ru",
+    "organization_en",
+    "direction",
+    "scope",
+    "focus",
+    "profile_type",
+    "specialization",
+    "created_at",
+    "updated_at",
+)
+
+log = logger.bind(req="-", user="-", nick="-")
+
+
+class ShardMoving(RuntimeError):
+    """Владелец переезжает между шардами: запись временно невозможна."""
+
+
+def shard_urls() -> List[str]:
+    return [dsn.strip() for dsn in settings.shard_database_urls.split(",") if dsn.strip()]
+
+
+def _hash(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Консистентное хэширование: у каждого шарда VNODES точек, ключ — к ближайшей по часовой."""
+
+    def __init__(self, shard_count: int, vnodes: int = VNODES) -> None:
+        if not 0 < shard_count <= MAX_SHARDS:
+            raise ValueError(f"Shard count must be between 1 and {MAX_SHARDS}")
+        points = sorted(
+            (_hash(f"shard{index}#{vnode}".encode()), index)
+            for index in range(shard_count)
+            for vnode in range(vnodes)
+        )
+        self._points = [point for point, _ in points]
+        self._shards = [index for _, index in points]
+
+    def shard_for(self, key: UUID) -> int:
+        position = bisect_right(self._points, _hash(key.bytes)) % len(self._points)
+        return self._shards[position]
+
+
+def sequence_setup_sql(index: int) -> str:
+    """Шаг MAX_SHARDS и следующее значение ≡ index + 1 выше всех выданных id этого шарда."""
+    return f"""
+    DO $$
+    DECLARE
+        high BIGINT;
+    BEGIN
+        LOCK TABLE projects IN SHARE ROW EXCLUSIVE MODE;
+        ALTER SEQUENCE {SEQUENCE_NAME} INCREMENT BY {MAX_SHARDS};
+        SELECT greatest(last_value, (SELECT coalesce(max(id), 0) FROM projects)) INTO high FROM {SEQUENCE_NAME};
+        PERFORM setval('{SEQUENCE_NAME}', high - high % {MAX_SHARDS} + {MAX_SHARDS} + {index + 1}, false);
+    END;
+    $$;
+    """
+
+
+async def sequence_increment(conn: asyncpg.Connection) -> int:
+    return await conn.fetchval("SELECT increment_by FROM pg_sequences WHERE sequencename = $1;", SEQUENCE_NAME)
+
+
+# --- обслуживание ---
+
+
+async def _connect_all() -> Tuple[asyncpg.Connection, List[asyncpg.Connection]]:
+    from . import migrations
+
+    directory = await asyncpg.connect(settings.database_url)
+    shards = [await asyncpg.connect(dsn) for dsn in shard_urls()]
+    for conn in (directory, *shards):
+        await migrations.migrate(conn)
+    return directory, shards
+
+
+async def init_shards(directory: asyncpg.Connection, shards: Sequence[asyncpg.Connection]) -> None:
+    """Один раз перед включением шардирования и после добавления шарда; повторный запуск безопасен."""
+    for index, conn in enumerate(shards):
+        if await sequence_increment(conn) != MAX_SHARDS:
+            await conn.execute(sequence_setup_sql(index))
+        # удалённые аккаунты (ник уже переименован) в каталог не попадают — их дочистит purge
+        users = await conn.fetch("SELECT id, nickname FROM users WHERE deleted_at IS NULL;")
+        await directory.executemany(
+            "INSERT INTO user_directory (user_id, nickname, shard) VALUES ($1, $2, $3) ON CONFLICT DO NOTHING;",
+            [(row["id"], row["nickname"], index) for row in users],
+        )
+        print(f"shard {index}: {len(users)} user(s) checked into the directory")
+
+
+async def plan_moves(directory: asyncpg.Connection, ring: HashRing) -> List[Tuple[UUID, int, int]]:
+    """(user_id, текущий шард, шард по кольцу) для всех, кто стоит не на своём месте."""
+    rows = await directory.fetch("SELECT user_id, shard FROM user_directory WHERE NOT moving;")
+    return [
+        (row["user_id"], row["shard"], target)
+        for row in rows
+        if (target := ring.shard_for(row["user_id"])) != row["shard"]
+    ]
+
+
+async def _copy_owner(source: asyncpg.Connection, target: asyncpg.Connection, user_id: UUID) -> int:
+    user = await source.fetchrow(f"SELECT {', '.join(USER_COLUMNS)} FROM users WHERE id = $1;", user_id)
+    projects = await source.fetch(
+        f"SELECT {', '.join(PROJECT_COPY_COLUMNS)} FROM projects WHERE owner_id = $1;", user_id
+    )
+    async with target.transaction():
+        # переезд не должен выглядеть для SSE-клиентов как удаление/создание проектов
+        await target.execute("SET LOCAL app.suppress_notify = 'on';")
+        # остатки прерванной прошлой попытки
+        await target.execute("DELETE FROM projects WHERE owner_id = $1;", user_id)
+        await target.execute("DELETE FROM users WHERE id = $1;", user_id)
+        if user is not None:
+            await target.copy_records_to_table("users", columns=USER_COLUMNS, records=[tuple(user)])
+        if projects:
+            await target.copy_records_to_table(
+                "projects", columns=PROJECT_COPY_COLUMNS, records=[tuple(row) for row in projects]
+            )
+    return len(projects)
+
+
+async def _delete_owner(conn: asyncpg.Connection, user_id: UUID) -> None:
+    async with conn.transaction():
+        await conn.execute("SET LOCAL app.suppress_notify = 'on';")
+        await conn.execute("DELETE FROM projects WHERE owner_id = $1;", user_id)
+        await conn.execute("DELETE FROM users WHERE id = $1;", user_id)
+
+
+async def move_owners(
+    directory: asyncpg.Connection,
+    shards: Sequence[asyncpg.Connection],
+    moves: Sequence[Tuple[UUID, int]],
+) -> int:
+    """Перевезти владельцев (user_id, целевой шард) одной пачкой. Возвращает число перевезённых."""
+    grace = settings.shard_directory_ttl_seconds + settings.db_pool_acquire_timeout_seconds + 1
+    sources: Dict[UUID, int] = {}
+    for user_id, target in moves:
+        source = await directory.fetchval(
+            "UPDATE user_directory SET moving = TRUE WHERE user_id = $1 AND NOT moving RETURNING shard;",
+            user_id,
+        )
+        if source is not None and source != target:
+            sources[user_id] = source
+        elif source is not None:
+            await directory.execute("UPDATE user_directory SET moving = FALSE WHERE user_id = $1;", user_id)
+    if not sources:
+        return 0
+
+    moved: List[UUID] = []
+    try:
+        # все воркеры должны увидеть moving и закончить начатые записи
+        await asyncio.sleep(grace)
+        targets = dict(moves)
+        for user_id, source in sources.items():
+            count = await _copy_owner(shards[source], shards[targets[user_id]], user_id)
+            await directory.execute(
+                "UPDATE user_directory SET shard = $2, moving = FALSE WHERE user_id = $1;",
+                user_id,
+                targets[user_id],
+            )
+            moved.append(user_id)
+            log.info(
+                "event=owner_moved user_id={user_id} source={source} target={target} projects={count}",
+                user_id=user_id,
+                source=source,
+                target=targets[user_id],
+                count=count,
+            )
+    finally:
+        # не перевезённые (ошибка) — снова доступны на старом шарде
+        for user_id in sources:
+            if user_id not in moved:
+                await directory.execute("UPDATE user_directory SET moving = FALSE WHERE user_id = $1;", user_id)
+
+    # отставшие воркеры ещё читают старую копию, пока не истечёт их кэш размещений
+    await asyncio.sleep(grace)
+    for user_id in moved:
+        await _delete_owner(shards[sources[user_id]], user_id)
+    return len(moved)
+
+
+async def _main(args: argparse.Namespace) -> int:
+    if not shard_urls():
+        print("shard_database_urls is empty: sharding is disabled")
+        return 1
+    directory, shards = await _connect_all()
+    ring = HashRing(len(shards))
+    try:
+        if args.command == "init":
+            await init_shards(directory, shards)
+        elif args.command == "plan":
+            moves = await plan_moves(directory, ring)
+            for (source, target), count in sorted(Counter((s, t) for _, s, t in moves).items()):
+                print(f"shard {source} -> shard {target}: {count} owner(s)")
+            print(f"total: {len(moves)} owner(s) to move")
+        elif args.command == "rebalance":
+            moves = await plan_moves(directory, ring)
+            if args.limit:
+                moves = moves[: args.limit]
+            total = 0
+            for start in range(0, len(moves), args.batch):
+                batch = moves[start:start + args.batch]
+                total += await move_owners(directory, shards, [(user_id, target) for user_id, _, target in batch])
+                print(f"moved {total}/{len(moves)}")
+        elif args.command == "move":
+            if not 0 <= args.shard < len(shards):
+                print(f"unknown shard {args.shard}")
+                return 1
+            moved = await move_owners(directory, shards, [(UUID(args.user_id), args.shard)])
+            print(f"moved {moved} owner(s)")
+        return 0
+    finally:
+        for conn in (directory, *shards):
+            await conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Owner shard maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("init", help="set up per-shard id sequences and fill the nickname directory")
+    commands.add_parser("plan", help="show owners that are not on their ring shard")
+    rebalance = commands.add_parser("rebalance", help="move misplaced owners online")
+    rebalance.add_argument("--batch", type=int, default=100, help="owners per move batch (one grace wait each)")
+    rebalance.add_argument("--limit", type=int, default=0, help="move at most this many owners")
+    move = commands.add_parser("move", help="move one owner to a shard")
+    move.add_argument("user_id")
+    move.add_argument("shard", type=int)
+    raise SystemExit(asyncio.run(_main(parser.parse_args())))
@@ -0,0 +1,346 @@
+"""
+Хранилище пользователей и проектов за единым интерфейсом.
+
+Маршруты получают backend через Depends(get_storage): по умолчанию это Postgres (app.db),
+для тестов и нагрузочных экспериментов — MemoryStorage (storage_backend=memory в .env).
+"""
+from __future__ import annotations
+
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Protocol, Tuple
+from uuid import UUID, uuid4
+
+from . import changes, db, shards
+from .config import settings
+from .db import PROJECT_FIELDS, PROJECT_FILTERS, PROJECT_SORT_KEYS, UpdateConflict
+
+
+class Storage(Protocol):
+    async def startup(self) -> None: ...
+
+    async def shutdown(self) -> None: ...
+
+    async def fetch_user(self, user_id: UUID) -> Optional[Dict[str, Any]]: ...
+
+    async def fetch_user_by_nickname(self, nickname: str) -> Optional[Dict[str, Any]]: ...
+
+    async def create_user_with_password(self, nickname: str, password_hash: str) -> Optional[Dict[str, Any]]: ...
+
+    async def touch_user(self, user_id: UUID, timestamp: datetime) -> None: ...
+
+    async def delete_account(self, user_id: UUID) -> bool: ...
+
+    async def fetch_projects_page(
+        self,
+        owner_id: UUID,
+        *,
+        limit: int,
+        sort: str = "id",
+        descending: bool = False,
+        after: Optional[Tuple[Any, int]] = None,
+        filters: Optional[Dict[str, str]] = None,
+    ) -> List[Dict[str, Any]]: ...
+
+    async def fetch_projects_stats(
+        self, owner_id: UUID, filters: Optional[Dict[str, str]] = None
+    ) -> Tuple[int, Optional[datetime]]: ...
+
+    async def search_projects(
+        self, owner_id: UUID, text: str, *, limit: int, offset: int = 0
+    ) -> Tuple[str, List[Dict[str, Any]]]: ...
+
+    def iter_projects(self, owner_id: UUID) -> AsyncIterator[Dict[str, Any]]: ...
+
+    async def fetch_project(self, project_id: int, owner_id: UUID) -> Optional[Dict[str, Any]]: ...
+
+    async def create_project(self, data: Dict[str, Any], owner_id: UUID) -> Dict[str, Any]: ...
+
+    async def update_project(
+        self,
+        project_id: int,
+        data: Dict[str, Any],
+        owner_id: UUID,
+        expected_updated_at: Optional[datetime] = None,
+    ) -> Optional[Dict[str, Any]]: ...
+
+    async def bulk_apply_projects(
+        self,
+        owner_id: UUID,
+        creates: List[Dict[str, Any]],
+        updates: List[Tuple[int, Dict[str, Any]]],
+    ) -> Tuple[List[int], List[int]]: ...
+
+    async def delete_project(self, project_id: int, owner_id: UUID) -> bool: ...
+
+
+class PostgresStorage:
+    """Текущий backend на asyncpg: тонкая обёртка над функциями app.db."""
+
+    async def startup(self) -> None:
+        await db.connect_to_db()
+        db.start_last_seen_flusher()
+        db.start_account_purger()
+        if settings.project_feed_enabled:
+            # NOTIFY шлют триггеры той базы, где лежат проекты: при шардировании — каждого шарда
+            changes.feed.start(*(shards.shard_urls() or [settings.database_url]))
+
+    async def shutdown(self) -> None:
+        await changes.feed.stop()
+        await db.close_db()
+
+    fetch_user = staticmethod(db.fetch_user)
+    fetch_user_by_nickname = staticmethod(db.fetch_user_by_nickname)
+    create_user_with_password = staticmethod(db.create_user_with_password)
+    touch_user = staticmethod(db.touch_user)
+    delete_account = staticmethod(db.mark_user_deleted)
+    fetch_projects_page = staticmethod(db.fetch_projects_page)
+    fetch_projects_stats = staticmethod(db.fetch_projects_stats)
+    search_projects = staticmethod(db.search_projects)
+    iter_projects = staticmethod(db.iter_projects)
+    fetch_project = staticmethod(db.fetch_project)
+    create_project = staticmethod(db.create_project)
+    update_project = staticmethod(db.update_project)
+    bulk_apply_projects = staticmethod(db.bulk_apply_projects)
+    delete_project = staticmethod(db.delete_project)
+
+
+_PROJECT_COLUMNS = ("id", *PROJECT_FIELDS, "created_at", "updated_at")
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _public(project: Dict[str, Any]) -> Dict[str, Any]:
+    # копия без owner_id — как у SELECT в app.db
+    return {column: project[column] for column in _PROJECT_COLUMNS}
+
+
+class MemoryStorage:
+    """
+    In-memory backend для тестов и бенчмарков HTTP/auth/сериализации без Postgres.
+    Проекты лежат в dict по id, у каждого владельца — отсортированный список своих id.
+    Изменения публикуются в changes.feed так же, как это делают триггеры Postgres:
+    одно событие на операцию.
+    """
+
+    def __init__(self) -> None:
+        self.users: Dict[UUID, Dict[str, Any]] = {}
+        self.users_by_nickname: Dict[str, UUID] = {}
+        self.projects: Dict[int, Dict[str, Any]] = {}
+        self.project_ids_by_owner: Dict[UUID, List[int]] = {}
+        self._next_project_id = 1
+
+    async def startup(self) -> None:
+        changes.feed.start()
+
+    async def shutdown(self) -> None:
+        await changes.feed.stop()
+
+    # --- users ---
+
+    async def fetch_user(self, user_id: UUID) -> Optional[Dict[str, Any]]:
+        user = self.users.get(user_id)
+        if not user:
+            return None
+        return {key: user[key] for key in ("id", "nickname", "created_at", "last_seen")}
+
+    async def fetch_user_by_nickname(self, nickname: str) -> Optional[Dict[str, Any]]:
+        user_id = self.users_by_nickname.get(nickname.lower())
+        return dict(self.users[user_id]) if user_id else None
+
+    async def create_user_with_password(self, nickname: str, password_hash: str) -> Optional[Dict[str, Any]]:
+        if nickname.lower() in self.users_by_nickname:
+            return None
+        now = _now()
+        user = {
+            "id": uuid4(),
+            "nickname": nickname,
+            "password_hash": password_hash,
+            "created_at": now,
+            "last_seen": now,
+        }
+        self.users[user["id"]] = user
+        self.users_by_nickname[nickname.lower()] = user["id"]
+        return dict(user)
+
+    async def touch_user(self, user_id: UUID, timestamp: datetime) -> None:
+        user = self.users.get(user_id)
+        if user:
+            user["last_seen"] = timestamp
+
+    async def delete_account(self, user_id: UUID) -> bool:
+        # в памяти удалять нечего долго — сразу, без пометки и purger'а
+        project_ids = self.project_ids_by_owner.pop(user_id, [])
+        for project_id in project_ids:
+            del self.projects[project_id]
+        if project_ids:
+            changes.feed.publish(user_id, "delete", project_ids)
+        user = self.users.pop(user_id, None)
+        if not user:
+            return False
+        del self.users_by_nickname[user["nickname"].lower()]
+        changes.feed.publish(user_id, "account_deleted", None)
+        return True
+
+    # --- projects ---
+
+    def _owned(self, owner_id: UUID, filters: Optional[Dict[str, str]] = None) -> List[Dict[str, Any]]:
+        for column in filters or {}:
+            if column not in PROJECT_FILTERS:
+                raise ValueError(f"Unsupported filter: {column}")
+        return [
+            project
+            for project in (self.projects[pid] for pid in self.project_ids_by_owner.get(owner_id, []))
+            if all(project[column] == value for column, value in (filters or {}).items())
+        ]
+
+    async def fetch_projects_page(
+        self,
+        owner_id: UUID,
+        *,
+        limit: int,
+        sort: str = "id",
+        descending: bool = False,
+        after: Optional[Tuple[Any, int]] = None,
+        filters: Optional[Dict[str, str]] = None,
+    ) -> List[Dict[str, Any]]:
+        if sort not in PROJECT_SORT_KEYS:
+            raise ValueError(f"Unsupported sort key: {sort}")
+
+        if sort == "id" and not filters:
+            # быстрый путь: срез отсортированного списка id владельца
+            ids = self.project_ids_by_owner.get(owner_id, [])
+            if descending:
+                end = bisect_left(ids, after[1]) if after else len(ids)
+                page = ids[max(0, end - limit):end][::-1]
+            else:
+                start = bisect_right(ids, after[1]) if after else 0
+                page = ids[start:start + limit]
+            return [_public(self.projects[pid]) for pid in page]
+
+        rows = sorted(self._owned(owner_id, filters), key=lambda p: (p[sort], p["id"]), reverse=descending)
+        if after is not None:
+            key = after if sort != "id" else (after[1], after[1])
+            if descending:
+                rows = [p for p in rows if (p[sort], p["id"]) < key]
+            else:
+                rows = [p for p in rows if (p[sort], p["id"]) > key]
+        return [_public(project) for project in rows[:limit]]
+
+    async def fetch_projects_stats(
+        self, owner_id: UUID, filters: Optional[Dict[str, str]] = None
+    ) -> Tuple[int, Optional[datetime]]:
+        rows = self._owned(owner_id, filters)
+        return len(rows), max((p["updated_at"] for p in rows), default=None)
+
+    async def search_projects(
+        self, owner_id: UUID, text: str, *, limit: int, offset: int = 0
+    ) -> Tuple[str, List[Dict[str, Any]]]:
+        needle = text.lower()
+        fields = ("name_ru", "name_en", "organization_ru", "organization_en", "specialization")
+        rows = [
+            project
+            for project in self._owned(owner_id)
+            if any(needle in (project[field] or "").lower() for field in fields)
+        ]
+        return "fts", [_public(project) for project in rows[offset:offset + limit]]
+
+    async def iter_projects(self, owner_id: UUID) -> AsyncIterator[Dict[str, Any]]:
+        for project_id in list(self.project_ids_by_owner.get(owner_id, [])):
+            project = self.projects.get(project_id)
+            if project:
+                yield _public(project)
+
+    async def fetch_project(self, project_id: int, owner_id: UUID) -> Optional[Dict[str, Any]]:
+        project = self.projects.get(project_id)
+        if not project or project["owner_id"] != owner_id:
+            return None
+        return _public(project)
+
+    def _insert(self, data: Dict[str, Any], owner_id: UUID) -> Dict[str, Any]:
+        now = _now()
+        project = {field: data.get(field) or "" for field in PROJECT_FIELDS}
+        project.update(id=self._next_project_id, owner_id=owner_id, created_at=now, updated_at=now)
+        self._next_project_id += 1
+        self.projects[project["id"]] = project
+        # id растут монотонно, поэтому append сохраняет порядок
+        self.project_ids_by_owner.setdefault(owner_id, []).append(project["id"])
+        return project
+
+    def _update(
+        self,
+        project_id: int,
+        data: Dict[str, Any],
+        owner_id: UUID,
+        expected_updated_at: Optional[datetime] = None,
+    ) -> Optional[Dict[str, Any]]:
+        project = self.projects.get(project_id)
+        if not project or project["owner_id"] != owner_id:
+            return None
+        if expected_updated_at is not None and project["updated_at"] != expected_updated_at:
+            raise UpdateConflict(project_id)
+        for field in PROJECT_FIELDS:
+            if data.get(field) is not None:
+                project[field] = data[field]
+        project["updated_at"] = _now()
+        return project
+
+    async def create_project(self, data: Dict[str, Any], owner_id: UUID) -> Dict[str, Any]:
+        project = self._insert(data, owner_id)
+        changes.feed.publish(owner_id, "insert", [project["id"]])
+        return dict(project)
+
+    async def update_project(
+        self,
+        project_id: int,
+        data: Dict[str, Any],
+        owner_id: UUID,
+        expected_updated_at: Optional[datetime] = None,
+    ) -> Optional[Dict[str, Any]]:
+        project = self._update(project_id, data, owner_id, expected_updated_at)
+        if not project:
+            return None
+        changes.feed.publish(owner_id, "update", [project_id])
+        return dict(project)
+
+    async def bulk_apply_projects(
+        self,
+        owner_id: UUID,
+        creates: List[Dict[str, Any]],
+        updates: List[Tuple[int, Dict[str, Any]]],
+    ) -> Tuple[List[int], List[int]]:
+        created_ids = [self._insert(data, owner_id)["id"] for data in creates]
+        updated_ids = list(
+            dict.fromkeys(project_id for project_id, data in updates if self._update(project_id, data, owner_id))
+        )
+        if created_ids:
+            changes.feed.publish(owner_id, "insert", created_ids)
+        if updated_ids:
+            changes.feed.publish(owner_id, "update", updated_ids)
+        return created_ids, updated_ids
+
+    async def delete_project(self, project_id: int, owner_id: UUID) -> bool:
+        project = self.projects.get(project_id)
+        if not project or project["owner_id"] != owner_id:
+            return False
+        del self.projects[project_id]
+        ids = self.project_ids_by_owner[owner_id]
+        del ids[bisect_left(ids, project_id)]
+        changes.feed.publish(owner_id, "delete", [project_id])
+        return True
+
+
+def _create_backend() -> Storage:
+    if settings.storage_backend == "memory":
+        return MemoryStorage()
+    return PostgresStorage()
+
+
+backend: Storage = _create_backend()
+
+
+def get_storage() -> Storage:
+    """FastAPI-зависимость; в тестах подменяется через app.dependency_overrides."""
+    return backend
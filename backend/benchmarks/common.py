@@ -0,0 +1,90 @@
+"""Общие помощники бенчмарков: окружение, замер запросов, перцентили, сравнение с baseline."""
+from __future__ import annotations
+
+import json
+import math
+import os
+import platform
+from collections import defaultdict
+from time import perf_counter
+from typing import Any, Dict, List
+
+
+def configure_env(storage: str) -> None:
+    """Settings читает .env/окружение при импорте app — задаём значения до импорта."""
+    os.environ.setdefault("database_url", "postgresql://localhost/bench")
+    os.environ.setdefault("auth_secret", "bench-secret")
+    # все виртуальные пользователи идут с одного адреса — лимиты по IP исказили бы замер
+    os.environ.setdefault("rate_limit_enabled", "false")
+    os.environ["storage_backend"] = storage
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank: наименьшее значение, не меньшее pct% выборки (p95 из 100 значений — 95-е)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct * len(sorted_values) / 100) - 1))
+    return sorted_values[rank]
+
+
+class Recorder:
+    """Латентности и статусы по эндпоинтам одного сценария."""
+
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.started = perf_counter()
+        self.finished = self.started
+
+    async def request(self, client: Any, method: str, url: str, endpoint: str, ok: tuple = (200,), **kwargs: Any) -> Any:
+        started = perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.latencies[endpoint].append(perf_counter() - started)
+        if response.status_code not in ok:
+            self.errors[endpoint] += 1
+        return response
+
+    def stop(self) -> None:
+        self.finished = perf_counter()
+
+    def summary(self) -> Dict[str, Any]:
+        duration = max(self.finished - self.started, 1e-9)
+        endpoints = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            endpoints[endpoint] = {
+                "count": len(values),
+                "errors": self.errors.get(endpoint, 0),
+                "throughput_rps": round(len(values) / duration, 1),
+                "p50_ms": round(percentile(values, 50) * 1000, 3),
+                "p95_ms": round(percentile(values, 95) * 1000, 3),
+                "p99_ms": round(percentile(values, 99) * 1000, 3),
+            }
+        return {"duration_s": round(duration, 3), "endpoints": endpoints}
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def write_results(path: str, results: Dict[str, Any]) -> None:
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump(results, fh, indent=2, ensure_ascii=False)
+        fh.write("\n")
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], metric: str, tolerance: float) -> List[str]:
+    """Сравнить метрику (p95_ms / per_op_us …) с baseline; вернуть описания регрессий."""
+    regressions = []
+    for group, items in current.items():
+        base_items = baseline.get(group, {})
+        for name, stats in items.items():
+            base = base_items.get(name, {}).get(metric)
+            value = stats.get(metric)
+            if base and value is not None and value > base * (1 + tolerance):
+                regressions.append(f"{group} / {name}: {metric} {value} > baseline {base} (+{tolerance:.0%})")
+    return regressions
@@ -0,0 +1,103 @@
+"""
+Микробенчмарки горячих помощников: подпись cookie и сериализация проектов.
+
+    cd backend
+    python -m benchmarks.micro --out micro.json
+    python -m benchmarks.micro --baseline micro.json   # exit 1, если стало медленнее
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import timeit
+import uuid
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from .common import compare, configure_env, environment, write_results
+
+
+def _project_rows(count: int) -> List[dict]:
+    now = datetime.now(timezone.utc)
+    return [
+        {
+            "id": i,
+            "name_ru": f"Проект {i}",
+            "name_en": f"Project {i}",
+            "organization_ru": "Организация",
+            "organization_en": "Organization",
+            "direction": "direction",
+            "scope": "scope",
+            "focus": "focus",
+            "profile_type": "profile",
+            "specialization": "specialization",
+            "created_at": now,
+            "updated_at": now,
+        }
+        for i in range(count)
+    ]
+
+
+def build_cases() -> Dict[str, Callable[[], object]]:
+    from pydantic import TypeAdapter
+
+    from app import auth
+    from app.responses import json_response, projects_payload
+    from app.schemas import Project
+
+    user_id = uuid.uuid4()
+    cookie = auth.build_cookie_value(user_id)
+    forged = cookie[:-1] + ("0" if cookie[-1] != "0" else "1")
+    rows = _project_rows(1000)
+    projects = [Project(**row) for row in rows]
+    list_adapter = TypeAdapter(List[Project])
+
+    return {
+        "auth.build_cookie_value": lambda: auth.build_cookie_value(user_id),
+        "auth.verify_cookie_value (valid)": lambda: auth.verify_cookie_value(cookie),
+        "auth.verify_cookie_value (forged)": lambda: auth.verify_cookie_value(forged),
+        "Project(**row)": lambda: Project(**rows[0]),
+        "Project.model_dump_json": lambda: projects[0].model_dump_json(),
+        "1000 x Project(**row)": lambda: [Project(**row) for row in rows],
+        "List[Project] dump_json (1000)": lambda: list_adapter.dump_json(projects),
+        "pydantic response path (1000)": lambda: list_adapter.dump_json([Project(**row) for row in rows]),
+        "json_response(projects_payload) (1000)": lambda: json_response(projects_payload(rows)),
+    }
+
+
+def run_case(func: Callable[[], object], repeat: int = 5) -> Dict[str, float]:
+    """Лучшее из repeat прогонов; число вызовов в прогоне подбирает timeit (~0.2 с)."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+    return {"per_op_us": round(best * 1e6, 3), "ops_per_s": round(1 / best, 1)}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", help="write JSON results here")
+    parser.add_argument("--baseline", help="compare per-op time against a stored JSON result")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    configure_env("memory")
+    results = {}
+    for name, func in build_cases().items():
+        results[name] = run_case(func)
+        print(f"{name:40s} {results[name]['per_op_us']:12.3f} us/op")
+
+    if args.out:
+        write_results(args.out, {"environment": environment(), "micro": results})
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        regressions = compare({"micro": results}, {"micro": baseline.get("micro", {})}, "per_op_us", args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
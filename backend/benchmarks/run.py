@@ -0,0 +1,262 @@
+"""
+Сквозные сценарии нагрузки на API.
+
+По умолчанию app.main.app поднимается в процессе (httpx ASGITransport) на MemoryStorage —
+это замер HTTP/auth/сериализации без БД. --storage postgres берёт DSN из .env/окружения,
+--base-url отправляет запросы в уже запущенный uvicorn.
+
+    cd backend
+    python -m benchmarks.run --out bench.json
+    python -m benchmarks.run --baseline bench.json --tolerance 0.15   # exit 1 при регрессии p95
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import secrets
+import sys
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from .common import Recorder, compare, configure_env, environment, write_results
+
+
+class Target:
+    """Откуда брать HTTP-клиентов: in-process ASGI или внешний сервер."""
+
+    def __init__(self, base_url: Optional[str], with_logs: bool = False) -> None:
+        self.base_url = base_url
+        self.with_logs = with_logs
+        self.app: Any = None
+
+    async def start(self) -> None:
+        if self.base_url:
+            return
+        from loguru import logger
+
+        from app import storage
+        from app.logs import configure_logging
+        from app.main import app
+
+        # ASGITransport не шлёт lifespan, поэтому startup приложения здесь не вызывается
+        if self.with_logs:
+            configure_logging()
+        else:
+            # иначе вывод логов на каждый запрос забивает и stdout, и замеры
+            logger.remove()
+        self.app = app
+        await storage.backend.startup()
+
+    async def stop(self) -> None:
+        if self.app is not None:
+            from app import storage
+
+            await storage.backend.shutdown()
+
+    def client(self) -> httpx.AsyncClient:
+        if self.base_url:
+            return httpx.AsyncClient(base_url=self.base_url, timeout=30)
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=self.app), base_url="http://bench", timeout=30)
+
+
+async def _register(client: httpx.AsyncClient, rec: Recorder) -> str:
+    nickname = f"bench_{secrets.token_hex(6)}"
+    await rec.request(
+        client,
+        "POST",
+        "/api/auth/register",
+        "POST /api/auth/register",
+        json={"nickname": nickname, "create_if_missing": True},
+    )
+    return nickname
+
+
+async def _login(client: httpx.AsyncClient, rec: Recorder, nickname: str) -> Dict[str, str]:
+    response = await rec.request(
+        client,
+        "POST",
+        "/api/auth/login",
+        "POST /api/auth/login",
+        json={"login": nickname, "password": nickname},
+    )
+    return {"X-CSRF-Token": response.json().get("csrf_token", "")}
+
+
+async def login_storm(target: Target, users: int, iterations: int) -> Recorder:
+    """Много пользователей одновременно логинятся (PBKDF2 в пуле воркеров)."""
+    rec = Recorder()
+
+    async def user() -> None:
+        async with target.client() as client:
+            nickname = await _register(client, rec)
+            for _ in range(iterations):
+                await _login(client, rec, nickname)
+
+    await asyncio.gather(*(user() for _ in range(users)))
+    rec.stop()
+    return rec
+
+
+async def cabinet_polling(target: Target, users: int, iterations: int, projects: int = 200) -> Recorder:
+    """Кабинет опрашивает список проектов: полный ответ и условный GET."""
+    rec = Recorder()
+
+    async def user() -> None:
+        async with target.client() as client:
+            nickname = await _register(client, rec)
+            headers = await _login(client, rec, nickname)
+            await rec.request(
+                client,
+                "POST",
+                "/api/projects/bulk",
+                "POST /api/projects/bulk",
+                json=[{"name_ru": f"Проект {i}", "scope": "bench"} for i in range(projects)],
+                headers=headers,
+            )
+            etag = None
+            for i in range(iterations):
+                response = await rec.request(client, "GET", "/api/projects/?limit=100", "GET /api/projects/")
+                etag = response.headers.get("etag", etag)
+                if etag and i % 2:
+                    await rec.request(
+                        client,
+                        "GET",
+                        "/api/projects/?limit=100",
+                        "GET /api/projects/ (If-None-Match)",
+                        ok=(304,),
+                        headers={"If-None-Match": etag},
+                    )
+
+    await asyncio.gather(*(user() for _ in range(users)))
+    rec.stop()
+    return rec
+
+
+async def wizard_bursts(target: Target, users: int, iterations: int) -> Recorder:
+    """Мастер заявки: создание проекта и серия частичных сохранений."""
+    rec = Recorder()
+
+    async def user() -> None:
+        async with target.client() as client:
+            nickname = await _register(client, rec)
+            headers = await _login(client, rec, nickname)
+            for i in range(iterations):
+                created = await rec.request(
+                    client,
+                    "POST",
+                    "/api/projects/",
+                    "POST /api/projects/",
+                    ok=(201,),
+                    json={"name_ru": f"Черновик {i}"},
+                    headers=headers,
+                )
+                project_id = created.json()["id"]
+                for step, field in enumerate(("direction", "scope", "focus", "profile_type")):
+                    await rec.request(
+                        client,
+                        "PATCH",
+                        f"/api/projects/{project_id}",
+                        "PATCH /api/projects/{id}",
+                        json={field: f"step-{step}"},
+                        headers=headers,
+                    )
+
+    await asyncio.gather(*(user() for _ in range(users)))
+    rec.stop()
+    return rec
+
+
+async def account_deletion(target: Target, users: int, iterations: int, projects: int = 50) -> Recorder:
+    """Удаление аккаунтов с проектами."""
+    rec = Recorder()
+
+    async def user() -> None:
+        for _ in range(iterations):
+            async with target.client() as client:
+                nickname = await _register(client, rec)
+                headers = await _login(client, rec, nickname)
+                await rec.request(
+                    client,
+                    "POST",
+                    "/api/projects/bulk",
+                    "POST /api/projects/bulk",
+                    json=[{"name_ru": f"Проект {i}"} for i in range(projects)],
+                    headers=headers,
+                )
+                await rec.request(client, "DELETE", "/api/auth/me", "DELETE /api/auth/me", ok=(204,), headers=headers)
+
+    await asyncio.gather(*(user() for _ in range(users)))
+    rec.stop()
+    return rec
+
+
+SCENARIOS: Dict[str, Callable[..., Awaitable[Recorder]]] = {
+    "login_storm": login_storm,
+    "cabinet_polling": cabinet_polling,
+    "wizard_bursts": wizard_bursts,
+    "account_deletion": account_deletion,
+}
+
+
+def _print_table(results: Dict[str, Any]) -> None:
+    print(f"{'scenario / endpoint':58s} {'count':>6s} {'err':>4s} {'rps':>8s} {'p50':>8s} {'p95':>8s} {'p99':>8s}")
+    for scenario, data in results.items():
+        for endpoint, stats in data["endpoints"].items():
+            print(
+                f"{scenario + ' / ' + endpoint:58s} {stats['count']:6d} {stats['errors']:4d} "
+                f"{stats['throughput_rps']:8.1f} {stats['p50_ms']:8.2f} {stats['p95_ms']:8.2f} {stats['p99_ms']:8.2f}"
+            )
+
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="run only these scenarios")
+    parser.add_argument("--users", type=int, default=20, help="concurrent virtual users per scenario")
+    parser.add_argument("--iterations", type=int, default=10, help="iterations per virtual user")
+    parser.add_argument("--storage", choices=("memory", "postgres"), default="memory")
+    parser.add_argument("--base-url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--with-logs", action="store_true", help="keep request logging enabled in-process")
+    parser.add_argument("--out", help="write JSON results here")
+    parser.add_argument("--baseline", help="compare p95 against a stored JSON result")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 regression vs baseline")
+    args = parser.parse_args(argv)
+
+    configure_env(args.storage)
+    target = Target(args.base_url, args.with_logs)
+    await target.start()
+    try:
+        scenarios = {}
+        for name in args.scenario or list(SCENARIOS):
+            rec = await SCENARIOS[name](target, args.users, args.iterations)
+            scenarios[name] = rec.summary()
+    finally:
+        await target.stop()
+
+    _print_table(scenarios)
+    results = {
+        "environment": environment(),
+        "config": {"users": args.users, "iterations": args.iterations, "storage": args.storage, "base_url": args.base_url},
+        "scenarios": scenarios,
+    }
+    if args.out:
+        write_results(args.out, results)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        regressions = compare(
+            {name: data["endpoints"] for name, data in scenarios.items()},
+            {name: data["endpoints"] for name, data in baseline.get("scenarios", {}).items()},
+            "p95_ms",
+            args.tolerance,
+        )
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
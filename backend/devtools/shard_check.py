@@ -0,0 +1,142 @@
+"""
+Проверка шардирования на справочнике и двух шардах (docker-compose.dev-db.yml, профиль shards).
+
+    docker compose -f docker-compose.dev-db.yml --profile shards up -d directory shard0 shard1
+    cd backend && python -m devtools.shard_check
+
+Через приложение регистрируются пользователи (пока не окажутся на обоих шардах) и создают
+по проекту; проверяется, что строки лежат только в шарде из справочника, а id проекта — из
+последовательности этого шарда. Затем один владелец переезжает на другой шард: во время
+переезда запись отвечает 503, чтение работает; после — данные только на новом шарде,
+и plan/move возвращают его обратно на шард по кольцу.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+from typing import Dict, List, Tuple
+from uuid import UUID
+
+DIRECTORY = os.environ.get("CHECK_DIRECTORY_URL", "postgresql://tm:tm@localhost:55434/tm")
+SHARDS = os.environ.get(
+    "CHECK_SHARD_URLS",
+    "postgresql://tm:tm@localhost:55435/tm,postgresql://tm:tm@localhost:55436/tm",
+)
+MAX_USERS = 16
+
+# Settings читает окружение при импорте app; короткий TTL размещений — короткое ожидание переезда
+os.environ.update(
+    database_url=DIRECTORY,
+    shard_database_urls=SHARDS,
+    shard_directory_ttl_seconds="0.5",
+    db_pool_acquire_timeout_seconds="1",
+    storage_backend="postgres",
+    auth_secret=os.environ.get("auth_secret", "shard-check"),
+    rate_limit_enabled="false",
+    project_feed_enabled="false",
+)
+
+import asyncpg  # noqa: E402
+import httpx  # noqa: E402
+
+from app import shards  # noqa: E402
+from app.main import app  # noqa: E402
+
+failures: List[str] = []
+
+
+def check(ok: bool, message: str) -> None:
+    print(f"{'ok  ' if ok else 'FAIL'} {message}")
+    if not ok:
+        failures.append(message)
+
+
+async def _located(conns: List[asyncpg.Connection], project_id: int) -> List[int]:
+    """Номера шардов, в которых есть строка проекта."""
+    return [
+        index
+        for index, conn in enumerate(conns)
+        if await conn.fetchval("SELECT 1 FROM projects WHERE id = $1;", project_id)
+    ]
+
+
+async def _signup(nickname: str) -> Tuple[httpx.AsyncClient, UUID, Dict[str, str]]:
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://check")
+    await client.post("/api/auth/register", json={"nickname": nickname, "create_if_missing": True})
+    login = await client.post("/api/auth/login", json={"login": nickname, "password": nickname})
+    login.raise_for_status()
+    return client, UUID(login.json()["user"]["id"]), {"X-CSRF-Token": login.json()["csrf_token"]}
+
+
+async def main() -> int:
+    directory, conns = await shards._connect_all()
+    ring = shards.HashRing(len(conns))
+    clients: List[httpx.AsyncClient] = []
+    try:
+        await shards.init_shards(directory, conns)
+        await app.router.startup()
+
+        # --- маршрутизация ---
+        owners: Dict[int, Tuple[httpx.AsyncClient, UUID, Dict[str, str], int]] = {}
+        for index in range(MAX_USERS):
+            client, user_id, headers = await _signup(f"shard{os.getpid()}x{index}")
+            clients.append(client)
+            created = await client.post("/api/projects/", json={"name_ru": f"shard-check {index}"}, headers=headers)
+            created.raise_for_status()
+            project_id = created.json()["id"]
+            shard = await directory.fetchval("SELECT shard FROM user_directory WHERE user_id = $1;", user_id)
+            check(shard == ring.shard_for(user_id), f"user {index}: directory shard {shard} matches the ring")
+            check(await _located(conns, project_id) == [shard], f"user {index}: project {project_id} only on shard {shard}")
+            check(project_id % shards.MAX_SHARDS == shard + 1, f"user {index}: project id from shard {shard} sequence")
+            owners.setdefault(shard, (client, user_id, headers, project_id))
+            if len(owners) == len(conns):
+                break
+        check(len(owners) == len(conns), f"owners landed on all {len(conns)} shards")
+
+        # --- переезд ---
+        client, user_id, headers, project_id = owners[0]
+        target = 1
+        move = asyncio.create_task(shards.move_owners(directory, conns, [(user_id, target)]))
+        await asyncio.sleep(1)  # moving уже в справочнике, кэш размещений воркера истёк
+        during = await client.post("/api/projects/", json={"name_ru": "during move"}, headers=headers)
+        check(during.status_code == 503, f"write during the move answers 503 (got {during.status_code})")
+        listed = await client.get("/api/projects/")
+        check(
+            listed.status_code == 200 and project_id in [p["id"] for p in listed.json()],
+            "read during the move still served",
+        )
+        moved = await move
+        check(moved == 1, "move_owners reports one owner moved")
+
+        shard = await directory.fetchval("SELECT shard FROM user_directory WHERE user_id = $1;", user_id)
+        check(shard == target, f"directory points at shard {target} after the move")
+        check(await _located(conns, project_id) == [target], f"project {project_id} only on shard {target} after the move")
+        listed = await client.get("/api/projects/")
+        check(project_id in [p["id"] for p in listed.json()], "owner reads the moved project")
+        created = await client.post("/api/projects/", json={"name_ru": "after move"}, headers=headers)
+        check(
+            created.is_success and created.json()["id"] % shards.MAX_SHARDS == target + 1,
+            f"new project after the move gets an id from shard {target}",
+        )
+
+        # --- plan / rebalance обратно на шард по кольцу ---
+        plan = {owner: (source, ring_shard) for owner, source, ring_shard in await shards.plan_moves(directory, ring)}
+        check(plan.get(user_id) == (target, 0), "plan moves the owner back to its ring shard")
+        await shards.move_owners(directory, conns, [(user_id, 0)])
+        plan = {owner for owner, _, _ in await shards.plan_moves(directory, ring)}
+        check(user_id not in plan, "owner is back on its ring shard")
+        check(await _located(conns, project_id) == [0], f"project {project_id} back on shard 0")
+    finally:
+        for client in clients:
+            await client.aclose()
+        await app.router.shutdown()
+        for conn in (directory, *conns):
+            await conn.close()
+
+    print(f"{len(failures)} failure(s)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))